@@ -0,0 +1,62 @@
+"""Import time regression benchmark
+
+Times `import brainmap` in fresh interpreters and checks that the optional heavy dependencies
+(plotting, widgets, scipy, the Allen SDK) are not loaded by it.
+
+    python benchmarks/bench_import.py --repeat 5 --max-seconds 1.0
+
+Exits with status 1 if the median import time exceeds `--max-seconds` or if a heavy module was imported.
+"""
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+HEAVY_MODULES = ("matplotlib", "scipy", "ipywidgets", "allensdk", "skimage", "colormap", "pandas")
+
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import brainmap
+elapsed = time.perf_counter() - t0
+print(json.dumps({"seconds": elapsed, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(repeat: int=5) -> dict:
+    timings = []
+    heavy = set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", PROBE], check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        heavy.update(result["heavy"])
+    return {"benchmark": "import", "repeat": repeat, "median_seconds": statistics.median(timings),
+            "min_seconds": min(timings), "max_seconds": max(timings), "heavy_modules": sorted(heavy)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None, help="fail if the median import time is larger")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    args = parser.parse_args()
+    result = measure(args.repeat)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    failed = False
+    if result["heavy_modules"]:
+        print("import brainmap loaded %s" % ", ".join(result["heavy_modules"]), file=sys.stderr)
+        failed = True
+    if args.max_seconds is not None and result["median_seconds"] > args.max_seconds:
+        print("median import time %.3fs exceeds %.3fs" % (result["median_seconds"], args.max_seconds), file=sys.stderr)
+        failed = True
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""Offline benchmark suite
+
+Runs on the volumes bundled in `data/` and writes the results as JSON, so that runs of different versions
+can be compared:
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --only load zoom --n-genes 2000
+
+Every benchmark reports the median and minimum wall time over `--repeat` runs and, where it matters,
+the peak memory allocated during one run (measured with tracemalloc, that tracks numpy allocations).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from typing import *
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import brainmap as bm  # noqa: E402
+from brainmap._version import __version__  # noqa: E402
+from brainmap.transformations import apply_transform, rotation_z_M, translation_M  # noqa: E402
+
+DATA = os.path.join(ROOT, "data")
+ANNOTATION = os.path.join(DATA, "AllenBrain3d", "E11pt5_DevMouse2012_annotation.zip")
+GRID_ANNOTATION = os.path.join(DATA, "AllenBrain3d", "P56_Mouse_gridAnnotation.zip")
+GENE_GRIDS = [os.path.join(DATA, i) for i in ("Gad1_coronal_adult_P56_479.zip", "Th_coronal_P56_1056.zip",
+                                              "Adora2a_P56_coronal_72109410_200um.zip")]
+
+
+def timed(function: Callable[[], Any], repeat: int, setup: Callable[[], Any]=None) -> Dict[str, float]:
+    """Median and minimum wall time of `function` (after `setup`, that is not timed)
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {"median_seconds": statistics.median(timings), "min_seconds": min(timings), "repeat": repeat}
+
+
+def peak_memory(function: Callable[[], Any]) -> int:
+    """Peak bytes allocated while running `function` once
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_load(args: Any) -> Dict[str, Any]:
+    results = {}
+    for name, path in [("annotation", ANNOTATION), ("grid_annotation", GRID_ANNOTATION), ("gene_grid", GENE_GRIDS[0])]:
+        vol = bm.AllenVolumetricData(path)
+        results[name] = dict(timed(lambda: bm.AllenVolumetricData(path), args.repeat),
+                             peak_bytes=peak_memory(lambda: bm.AllenVolumetricData(path)),
+                             volume_bytes=vol.nbytes, shape=list(vol.shape))
+    cache_dir = tempfile.mkdtemp(prefix="brainmap-bench-")
+    try:
+        results["annotation_sidecar_extract"] = timed(lambda: bm.AllenVolumetricData(ANNOTATION, cache_dir=cache_dir),
+                                                      args.repeat, setup=lambda: shutil.rmtree(cache_dir, ignore_errors=True))
+        results["annotation_sidecar_mmap"] = timed(lambda: bm.AllenVolumetricData(ANNOTATION, cache_dir=cache_dir), args.repeat)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def bench_contours(args: Any) -> Dict[str, Any]:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    vol = bm.AllenVolumetricData(ANNOTATION)
+    middle = vol.shape[0] // 2, vol.shape[2] // 2
+    section = vol.ids[vol[middle[0], :, :]]
+    fig = plt.figure()
+
+    def plot() -> None:
+        vol.colored._contours.clear()
+        vol.colored.plot_slides(middle[0], middle[1], contour=True, fig=fig, return_figure=True)
+        fig.canvas.draw()
+
+    results = {"one_hot_encoding": timed(lambda: bm.one_hot_encoding(section), args.repeat),
+               "contours": timed(lambda: (vol.colored._contours.clear(), vol.colored.contours(0, middle[0])), args.repeat),
+               "plot_slides_contour": timed(plot, args.repeat)}
+    plt.close(fig)
+    return results
+
+
+def bench_slicing(args: Any) -> Dict[str, Any]:
+    vol = bm.AllenVolumetricData(ANNOTATION)
+    colored = vol.colored
+
+    def coronal() -> None:
+        for i in range(0, vol.shape[0], 8):
+            colored[i, :, :]
+
+    def sagittal() -> None:
+        for i in range(0, vol.shape[2], 8):
+            colored[:, :, i]
+
+    return {"colored_coronal": timed(coronal, args.repeat), "colored_sagittal": timed(sagittal, args.repeat),
+            "n_coronal": len(range(0, vol.shape[0], 8)), "n_sagittal": len(range(0, vol.shape[2], 8))}
+
+
+def bench_zoom(args: Any) -> Dict[str, Any]:
+    labels = bm.AllenVolumetricData(ANNOTATION)
+    grid = bm.AllenVolumetricData(GENE_GRIDS[0])
+    results = {}
+    for name, vol in [("labels", labels), ("grid", grid)]:
+        for factor in (0.5, 2.0):
+            key = "%s_%s" % (name, factor)
+            results[key] = timed(lambda: vol.zoom[factor], args.repeat, setup=vol.zoom.collection.clear)
+            results[key + "_cached"] = timed(lambda: vol.zoom[factor], args.repeat)
+    return results
+
+
+def bench_transform(args: Any) -> Dict[str, Any]:
+    points = np.random.RandomState(0).uniform(0, 500, (3, args.n_points))
+    M = translation_M(np.array([10., -5., 3.])).dot(rotation_z_M(0.3))
+    return {"apply_transform": dict(timed(lambda: apply_transform(points, M), args.repeat), n_points=args.n_points,
+                                    peak_bytes=peak_memory(lambda: apply_transform(points, M)))}
+
+
+def make_fake_root(folder: str, n_genes: int) -> None:
+    """Fills folder with n_genes fake `gene_coronal_P56_id.zip` files, hard links (or copies) of the bundled grids
+    """
+    for n in range(n_genes):
+        source = GENE_GRIDS[n % len(GENE_GRIDS)]
+        target = os.path.join(folder, "Fake%05d_coronal_P56_%i.zip" % (n, 100000 + n))
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+
+def bench_ish_loader(args: Any) -> Dict[str, Any]:
+    root = tempfile.mkdtemp(prefix="brainmap-bench-root-")
+    try:
+        make_fake_root(root, args.n_genes)
+        index_path = os.path.join(root, bm.ISHIndex.index_file)
+        results = {"n_genes": args.n_genes,
+                   "index_cold": timed(lambda: bm.ISHLoader(root), args.repeat,
+                                       setup=lambda: os.path.exists(index_path) and os.remove(index_path)),
+                   "index_warm": timed(lambda: bm.ISHLoader(root), args.repeat)}
+        loader = bm.ISHLoader(root)
+        genes = sorted(loader.index)[:min(64, args.n_genes)]
+        results["first_access"] = timed(lambda: [loader[g] for g in genes], args.repeat, setup=loader._cache.clear)
+        results["cached_access"] = timed(lambda: [loader[g] for g in genes], args.repeat)
+        results["load_many"] = timed(lambda: loader.load_many(genes, download=False), args.repeat, setup=loader._cache.clear)
+        results["n_accessed"] = len(genes)
+        results["cache"] = loader._cache.stats()
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_import(args: Any) -> Dict[str, Any]:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from bench_import import measure
+    return measure(args.repeat)
+
+
+BENCHMARKS = {"load": bench_load, "contours": bench_contours, "slicing": bench_slicing, "zoom": bench_zoom,
+              "transform": bench_transform, "ish_loader": bench_ish_loader, "import": bench_import}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=None, help="run only these benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--n-genes", type=int, default=500, help="fake genes in the ISHLoader root")
+    parser.add_argument("--n-points", type=int, default=10**6, help="points transformed by apply_transform")
+    parser.add_argument("--output", default=None, help="the JSON file to write (default: print to stdout)")
+    args = parser.parse_args()
+
+    report = {"brainmap_version": __version__, "python": platform.python_version(), "numpy": np.__version__,
+              "platform": platform.platform(), "cpu_count": os.cpu_count(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": {}}  # type: Dict[str, Any]
+    for name in args.only or list(BENCHMARKS):
+        start = time.perf_counter()
+        report["results"][name] = BENCHMARKS[name](args)
+        print("%s done in %.1fs" % (name, time.perf_counter() - start), file=sys.stderr)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
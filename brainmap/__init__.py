@@ -1,3 +1,10 @@
-from .utils import LimitedSizeDict, one_hot_encoding
+from .utils import LimitedSizeDict, LRUCache, one_hot_encoding
+from . import instrument
+from .ontology import OntologyTable
 from .core import AllenBrainReference, AllenBrainStructure, AllenBrainReference, AllenVolumetricData
-from .ish import ISHFetcher, ISHLoader
+from .ish import ISHFetcher, ISHLoader, ISHIndex
+from .store import ExpressionStore
+from .aggregate import structure_statistics
+from .similarity import SimilarityIndex
+from .enrichment import rank_enrichment
+from .development import DevelopmentalAtlas
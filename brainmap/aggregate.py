@@ -0,0 +1,117 @@
+import numpy as np
+import logging
+from typing import *
+import brainmap as bm
+
+
+def _flat_values(volume: Any) -> np.ndarray:
+    """The values of a volume as a 1d array, with the no data entries of an AllenVolumetricData set to nan
+    """
+    if isinstance(volume, bm.AllenVolumetricData):
+        return volume.masked().ravel()
+    return np.ravel(volume[:, :, :])
+
+
+def _as_matrix_chunks(volumes: Any, chunk_size: int, genes: Iterable[str]=None) -> Tuple[List[Any], Iterator[np.ndarray]]:
+    """Returns the names of the rows and an iterator over (genes, voxels) float arrays
+    """
+    if isinstance(volumes, bm.ExpressionStore):
+        volumes.check_no_data()
+        if genes is not None:
+            names = list(genes)
+            return names, (volumes.rows(names[i:i + chunk_size]) for i in range(0, len(names), chunk_size))
+        names = list(volumes.genes)
+        matrix = volumes.matrix
+        return names, (np.asarray(matrix[i:i + chunk_size]) for i in range(0, len(names), chunk_size))
+    if genes is not None:
+        raise ValueError("genes can only be selected from an ExpressionStore")
+    if isinstance(volumes, Mapping):
+        names = list(volumes.keys())
+        volumes = [volumes[k] for k in names]
+    elif isinstance(volumes, np.ndarray) and volumes.ndim == 2:
+        names = list(range(volumes.shape[0]))
+        return names, (volumes[i:i + chunk_size] for i in range(0, len(names), chunk_size))
+    elif isinstance(volumes, bm.AllenVolumetricData) or (isinstance(volumes, np.ndarray) and volumes.ndim == 3):
+        names = [None]
+        volumes = [volumes]
+    else:
+        volumes = list(volumes)
+        names = list(range(len(volumes)))
+    return names, (np.stack([_flat_values(v) for v in volumes[i:i + chunk_size]])
+                   for i in range(0, len(volumes), chunk_size))
+
+
+def structure_statistics(volumes: Any, labels: Any, reference: Any=None, threshold: float=0.,
+                         hierarchical: bool=True, chunk_size: int=256, genes: Iterable[str]=None) -> Dict[str, Any]:
+    """Per-structure expression statistics of one or many gene volumes
+
+    All the genes of a chunk are reduced together with a single bincount over the label indexes.
+    Negative or non finite voxels (no data) are excluded from all the statistics.
+
+    Args
+    ----
+    volumes: AllenVolumetricData, np.ndarray, list, dict or ExpressionStore
+        one volume, a list or 4d array of volumes, a (genes, voxels) matrix, a dict gene -> volume,
+        or a whole ExpressionStore
+    labels: AllenVolumetricData
+        a label volume (e.g. a gridAnnotation) with the same shape of the gene volumes
+    reference: AllenBrainReference
+        the ontology to use for `hierarchical`, defaults to `labels.reference`
+    threshold: float
+        a voxel is counted as expressing if its value is above threshold
+    hierarchical: bool
+        if True the columns are all the structures of the ontology and every structure includes its descendants,
+        otherwise the columns are the `labels.ids` and only the voxels labeled exactly are counted
+    chunk_size: int
+        number of genes reduced at the same time
+    genes: iterable of str
+        with an ExpressionStore, the genes to reduce (read from the memory-map one chunk at a time), defaults to all
+
+    Returns
+    -------
+    statistics: dict
+        `genes` (the row names), `ids` (the structure id of each column) and the (genes, structures) arrays
+        `sum`, `count` (valid voxels), `mean` and `fraction` (of valid voxels that are expressing)
+
+    """
+    if reference is None and hierarchical:
+        reference = labels.reference
+        if reference is None:
+            raise ValueError("hierarchical statistics require an AllenBrainReference")
+    label_flat = np.ravel(labels[:, :, :])
+    n_labels = len(labels.ids)
+    names, chunks = _as_matrix_chunks(volumes, chunk_size, genes)
+
+    sums, counts, expressing = [], [], []  # type: Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]
+    for chunk in chunks:
+        if chunk.shape[1] != label_flat.shape[0]:
+            raise ValueError("gene volumes have %i voxels and the labels %i" % (chunk.shape[1], label_flat.shape[0]))
+        valid = np.isfinite(chunk) & (chunk >= 0)
+        bins = (label_flat[None, :] + n_labels * np.arange(chunk.shape[0])[:, None]).ravel()
+        size = n_labels * chunk.shape[0]
+        shape = (chunk.shape[0], n_labels)
+        sums.append(np.bincount(bins, weights=np.where(valid, chunk, 0).ravel(), minlength=size).reshape(shape))
+        counts.append(np.bincount(bins, weights=valid.ravel(), minlength=size).reshape(shape))
+        expressing.append(np.bincount(bins, weights=(valid & (chunk > threshold)).ravel(), minlength=size).reshape(shape))
+    total = np.concatenate(sums)
+    count = np.concatenate(counts)
+    expr = np.concatenate(expressing)
+
+    ids = labels.ids
+    if hierarchical:
+        table = reference.table
+        rows = table.index_of(labels.ids)
+        found = rows >= 0
+        logging.debug("%i labels are not in the ontology and will be ignored" % np.sum(~found))
+        per_structure = []
+        for per_label in (total, count, expr):
+            values = np.zeros((per_label.shape[0], len(table)))
+            values[:, rows[found]] = per_label[:, found]
+            per_structure.append(table.subtree_sum(values))
+        total, count, expr = per_structure
+        ids = table.ids
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        fraction = expr / count
+    return {"genes": names, "ids": ids, "sum": total, "count": count, "mean": mean, "fraction": fraction}
@@ -0,0 +1,41 @@
+import numpy as np
+from typing import *
+
+
+def boundary_segments(array2d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Unit segments separating neighbouring pixels with different labels, computed with one neighbour difference per axis
+
+    Returns
+    -------
+    segments: np.ndarray
+        (n, 2, 2) start and end points of each segment in (row, column) pixel coordinates
+    pairs: np.ndarray
+        (n, 2) the labels on the two sides of each segment
+
+    """
+    a = np.asarray(array2d)
+    i, j = np.nonzero(a[:, :-1] != a[:, 1:])
+    vertical = np.stack([np.stack([i - .5, j + .5], -1), np.stack([i + .5, j + .5], -1)], 1)
+    vertical_pairs = np.stack([a[i, j], a[i, j + 1]], -1)
+    i, j = np.nonzero(a[:-1, :] != a[1:, :])
+    horizontal = np.stack([np.stack([i + .5, j - .5], -1), np.stack([i + .5, j + .5], -1)], 1)
+    horizontal_pairs = np.stack([a[i, j], a[i + 1, j]], -1)
+    return np.concatenate([vertical, horizontal]), np.concatenate([vertical_pairs, horizontal_pairs])
+
+
+def contours_by_label(array2d: np.ndarray) -> Dict[Any, np.ndarray]:
+    """Returns the boundary segments of every label of a slice
+
+    Returns
+    -------
+    contours: dict
+        label -> (n, 2, 2) segments in (row, column) coordinates surrounding the pixels with that label
+
+    """
+    segments, pairs = boundary_segments(array2d)
+    labels = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    order = np.argsort(labels, kind="stable")
+    labels = labels[order]
+    segments = np.concatenate([segments, segments])[order]
+    unique, starts = np.unique(labels, return_index=True)
+    return {k: v for k, v in zip(unique.tolist(), np.split(segments, starts[1:]))}
@@ -1,46 +1,88 @@
 import numpy as np
 import zipfile
 import logging
+import os
+import json
+import hashlib
+import tempfile
 from typing import *
-from allensdk.api.queries.ontologies_api import OntologiesApi
-import matplotlib.pyplot as plt
-from matplotlib.gridspec import SubplotSpec, GridSpecFromSubplotSpec
-from skimage.measure import find_contours
-from colormap import Color
-from scipy.ndimage import zoom
-from brainmap import LimitedSizeDict, one_hot_encoding
-try:
-    from ipywidgets import interact, interactive, fixed, interact_manual
-    import ipywidgets as widgets
-except ImportError:
-    logging.warn("ipywidgets is not installed some function will not be available")
+from brainmap import LRUCache
+from brainmap.instrument import timer, timed, count
+from brainmap.contours import boundary_segments, contours_by_label
+from brainmap.render import SliceRenderer, SlideViewer
+from brainmap.resample import resample_labels, zoom_labels
+from brainmap.ontology import OntologyTable
+from brainmap.labels import LabelIndex, encode_labels, unique_labels
+
+# Bumped when the layout of the sidecar cache changes, so that older extractions are not reused
+_SIDECAR_VERSION = 2
+
+# matplotlib, scipy and ipywidgets are imported when first used, so that loading the data only requires numpy
+
+
+def _read_into(fileobj: Any, array1d: np.ndarray, chunk_size: int=2**22) -> None:
+    """Fills a C-contiguous 1d array with the content of a binary file object, reading `chunk_size` bytes at a time
+    """
+    buffer = memoryview(array1d).cast("B")
+    offset = 0
+    while offset < len(buffer):
+        n = fileobj.readinto(buffer[offset:offset + chunk_size])
+        if not n:
+            raise IOError("Unexpected end of file after %i of %i bytes" % (offset, len(buffer)))
+        offset += n
+
+
+def _read_grid(fileobj: Any, array1d: np.ndarray, chunk_size: int=2**22) -> Tuple[Optional[np.ndarray], Any]:
+    """Like `_read_into`, but finds in the same pass the negative (no data) entries and the minimum of the others
+
+    Returns
+    -------
+    no_data: np.ndarray or None
+        boolean mask of the negative entries (None if there are none)
+    minimum:
+        the minimum of the non negative entries (None if there are none)
+
+    """
+    buffer = memoryview(array1d).cast("B")
+    offset = done = 0
+    no_data = None  # type: np.ndarray
+    minimum = None
+    while offset < len(buffer):
+        n = fileobj.readinto(buffer[offset:offset + chunk_size])
+        if not n:
+            raise IOError("Unexpected end of file after %i of %i bytes" % (offset, len(buffer)))
+        offset += n
+        stop = offset // array1d.itemsize
+        chunk = array1d[done:stop]
+        negative = chunk < 0
+        if negative.any():
+            if no_data is None:
+                no_data = np.zeros(len(array1d), dtype=bool)
+            no_data[done:stop] = negative
+            np.logical_not(negative, out=negative)
+            chunk_min = chunk.min(initial=np.inf, where=negative)
+        else:
+            chunk_min = chunk.min(initial=np.inf)
+        if np.isfinite(chunk_min):
+            minimum = chunk_min if minimum is None else min(minimum, chunk_min)
+        done = stop
+    return no_data, minimum
 
 
 class AllenBrainStructure:
     def __init__(self, object_dict: Dict[str, Any], atlas: Any) -> None:
         for k, v in object_dict.items():
             setattr(self, k, v)
-        self.children = []  # type: List
-        self.parent = None  # type: Any
         self._atlas = atlas
-        
-    def add_children(self, other: Any) -> None:
-        if other not in self.children:
-            self.children.append(other)
-            other.set_parent(self)
-            
-    def set_parent(self, other: Any) -> None:
-        if self.parent is None:
-            self.parent = other
-            other.add_children(self)
-            
-    def connect(self) -> None:
-        if self.parent_structure_id is not None:
-            parent_obj = self._atlas[self.parent_structure_id]
-            self.set_parent(parent_obj)
-        else:
-            pass
-    
+
+    @property
+    def parent(self) -> Any:
+        return self._atlas.parent_of(self.id)
+
+    @property
+    def children(self) -> List[Any]:
+        return self._atlas.children_of(self.id)
+
     def __repr__(self) -> str:
         head = super(AllenBrainStructure, self).__repr__()
         memory_address = head.split(" ")[-1][:-1]
@@ -68,25 +110,82 @@ class AllenBrainStructure:
 
 
 class AllenBrainReference:
-    def __init__(self, graph: str="adult") -> None:
-        self._onto = OntologiesApi()
-        if graph == "adult":
-            self._struct_dicts_list = self._onto.get_structures(structure_graph_ids=1, num_rows='all')
-        elif graph == "development":
-            self._struct_dicts_list = self._onto.get_structures(structure_graph_ids=17, num_rows='all')
-        self._structures = {i["id"]: AllenBrainStructure(i, self) for i in self._struct_dicts_list}
-        self._link()
-    
+    def __init__(self, graph: str="adult", cache_dir: str=None, refresh: bool=False) -> None:
+        """The structure ontology of the Allen Brain Atlas
+
+        The ontology is downloaded once and kept in a local cache (see `OntologyTable.cached`),
+        structure objects are only created when accessed.
+
+        Args
+        ----
+        graph: str
+            `adult` or `development`
+        cache_dir: str
+            folder of the ontology cache, defaults to `$BRAINMAP_CACHE` or `~/.brainmap`
+        refresh: bool
+            download the ontology again and update the cache
+
+        """
+        self.graph = graph
+        self.cache_dir = cache_dir
+        self.table = OntologyTable.cached(graph, cache_dir=cache_dir, refresh=refresh)
+        self._structures = {}  # type: Dict[int, AllenBrainStructure]
+
+    def refresh(self) -> None:
+        """Downloads the ontology again and updates the local cache
+        """
+        self.table = OntologyTable.cached(self.graph, cache_dir=self.cache_dir, refresh=True)
+        self._structures = {}
+
     def __getitem__(self, key: int) -> Any:
+        if key not in self._structures:
+            row = int(self.table.index_of(key))
+            if row < 0:
+                raise KeyError(key)
+            self._structures[key] = AllenBrainStructure(self.table.records[row], self)
         return self._structures[key]
-    
+
+    def __contains__(self, key: Any) -> bool:
+        return int(self.table.index_of(key)) >= 0
+
+    def __len__(self) -> int:
+        return len(self.table)
+
     def __iter__(self) -> Any:
-        for k, v in self._structures.items():
-            yield v
-    
-    def _link(self) -> None:
-        for name, structure in self._structures.items():
-            structure.connect()
+        for idd in self.table.ids:
+            yield self[int(idd)]
+
+    def _row(self, key: Any) -> int:
+        row = int(self.table.index_of(key))
+        if row < 0:
+            raise KeyError(key)
+        return row
+
+    def parent_of(self, key: int) -> Any:
+        parent_row = self.table.parent[self._row(key)]
+        if parent_row < 0:
+            return None
+        return self[int(self.table.ids[parent_row])]
+
+    def children_of(self, key: int) -> List[Any]:
+        return [self[int(self.table.ids[i])] for i in self.table.children(self._row(key))]
+
+    def is_descendant(self, key: Any, ancestor: Any) -> np.ndarray:
+        """True where the structure ids in key descend from (or are) the ancestor ids, in O(1) per pair
+        """
+        return self.table.is_descendant(self.table.index_of(key), self.table.index_of(ancestor))
+
+    def descendants(self, key: int) -> np.ndarray:
+        """Returns the ids of a structure and all its descendants
+        """
+        return self.table.ids[self.table.descendants(self._row(key))]
+
+    def structure_mask(self, key: int, labels: Any) -> np.ndarray:
+        """Boolean mask of the voxels of a label AllenVolumetricData that belong to a structure or its descendants
+        """
+        if key not in self:
+            raise KeyError(key)
+        return self.is_descendant(labels.ids, key)[labels[:, :, :]]
 
 
 class Reference3D:
@@ -95,35 +194,165 @@ class Reference3D:
                 
     
 class AllenVolumetricData:
-    def __init__(self, filename: str, reference: AllenBrainReference=None, remove_negative_entries: bool=True) -> None:
+    def __init__(self, filename: str, reference: AllenBrainReference=None, remove_negative_entries: bool=True,
+                 cache_dir: str=None) -> None:
+        """Volume (grid expression or annotation) read from an Allen Brain Atlas .zip file
+
+        Args
+        ----
+        filename: str
+            the path to the .zip containing the .mhd and .raw files
+        reference: AllenBrainReference
+            used to color label volumes
+        remove_negative_entries: bool
+            replace the negative (no data) entries with the minimum of the others,
+            their positions are kept in `no_data` in any case
+        cache_dir: str
+            if given, the decoded volume is extracted once in a sidecar .npy file in this folder
+            (keyed by path and modification time of the zip) and memory-mapped on later loads
+
+        """
         self.filename = filename
-        self.zip_container = zipfile.ZipFile(filename)
-        for i in self.zip_container.infolist():
+        self.remove_negative_entries = remove_negative_entries
+        with timer("volume.load", file=filename, cached=cache_dir is not None):
+            if cache_dir is None:
+                self._load_zip()
+            else:
+                self._load_cached(cache_dir)
+        self.shape = tuple(self.file_info['DimSize'])
+        if self.is_label:
+            self.reference = reference
+            self._colored = ColoredVolumetric(self)
+
+    def _read_header(self, zip_container: zipfile.ZipFile) -> zipfile.ZipInfo:
+        for i in zip_container.infolist():
             if ".mhd" in i.filename:
                 mhd_file = i
             if '.raw' in i.filename:
                 raw_file = i
-        info_file = self.zip_container.open(mhd_file).read().decode("ascii")
+        info_file = zip_container.open(mhd_file).read().decode("ascii")
         entries_file = [i.split(" = ") for i in info_file.rstrip().split("\n")]
         self.file_info = {k: ([int(i) for i in (v.split(" "))] if (" " in v) else v) for k, v in entries_file}  # type: Dict[str, Any]
-        self.shape = tuple(self.file_info['DimSize'])
+        self._parse_element_type()
+        return raw_file
+
+    def _parse_element_type(self) -> None:
         self.is_label = ("UINT" in self.file_info['ElementType'])
         self.file_type = {"MET_UINT": 'uint32',
                           "MET_UCHAR": 'uint8',
                           "MET_FLOAT": "float32"}[self.file_info['ElementType']]
+
+    def _decode(self, raw: Any, array1d: np.ndarray) -> Optional[np.ndarray]:
+        """Inflates the .raw member into array1d, returning the no data mask of grids and replacing them if required
+        """
+        count("volume.bytes_inflated", array1d.nbytes)
+        if self.is_label:
+            with timer("volume.inflate"):
+                _read_into(raw, array1d)
+            return None
+        with timer("volume.inflate"):
+            no_data, minimum = _read_grid(raw, array1d)
+        if self.remove_negative_entries and no_data is not None and minimum is not None:
+            array1d[no_data] = minimum
+        return no_data
+
+    def _load_zip(self) -> None:
+        self.zip_container = zipfile.ZipFile(self.filename)
+        raw_file = self._read_header(self.zip_container)
+        shape = tuple(self.file_info['DimSize'])
         logging.debug("Reading data file")
-        buffer = self.zip_container.open(raw_file).read()
-        array1d = np.fromstring(buffer, dtype=self.file_type)
-        if remove_negative_entries and not self.is_label:
-            array1d[array1d < 0] = np.min(array1d[array1d >= 0])
+        # The .raw member is in Fortran order: it is inflated chunk by chunk in the final array and only reshaped
+        array1d = np.empty(int(np.prod(shape)), dtype=self.file_type)
+        with self.zip_container.open(raw_file) as raw:
+            no_data = self._decode(raw, array1d)
         if self.is_label:
-            self.ids, array1d = np.unique(array1d, return_inverse=True)
-        self._values = np.ascontiguousarray(array1d.reshape(self.shape, order='F'))
+            with timer("volume.encode_labels"):
+                self.ids, array1d = encode_labels(array1d)
+        self._values = array1d.reshape(shape, order='F')
+        self.no_data = None if no_data is None else no_data.reshape(shape, order='F')  # type: Optional[np.ndarray]
         self.zip_container.close()
+
+    def _cache_paths(self, cache_dir: str) -> Tuple[str, str, str]:
+        stat = os.stat(self.filename)
+        key = "%s:%i:%i:%s:%i" % (os.path.abspath(self.filename), stat.st_mtime_ns, stat.st_size, self.remove_negative_entries,
+                                  _SIDECAR_VERSION)
+        stem = "%s-%s" % (os.path.splitext(os.path.basename(self.filename))[0], hashlib.sha1(key.encode()).hexdigest()[:16])
+        stem = os.path.join(cache_dir, stem)
+        return stem + ".json", stem + ".values.npy", stem + ".ids.npy"
+
+    def _load_cached(self, cache_dir: str) -> None:
+        info_path, values_path, ids_path = self._cache_paths(cache_dir)
+        self._label_index_path = info_path[:-len(".json")] + ".labels.npz"
+        no_data_path = info_path[:-len(".json")] + ".nodata.npy"
+        if not os.path.exists(info_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            self._extract_sidecar(info_path, values_path, ids_path, no_data_path)
+        with open(info_path) as f:
+            self.file_info = json.load(f)
+        self._parse_element_type()
+        self._values = np.load(values_path, mmap_mode="r")
+        self.no_data = np.load(no_data_path, mmap_mode="r") if os.path.exists(no_data_path) else None
         if self.is_label:
-            self.reference = reference
-            self._colored = ColoredVolumetric(self)
-        
+            self.ids = np.load(ids_path)
+
+    def _extract_sidecar(self, info_path: str, values_path: str, ids_path: str, no_data_path: str) -> None:
+        """Decodes the .raw member straight into a Fortran-ordered .npy file, so that it can be memory-mapped as is
+
+        Every file is written under a unique temporary name and renamed in place, the json info last: processes
+        extracting the same zip at the same time publish identical files and never see each other's partial writes.
+        """
+        logging.debug("Extracting %s to %s" % (self.filename, values_path))
+        temporary = []  # type: List[str]
+
+        def temporary_path() -> str:
+            fd, path = tempfile.mkstemp(dir=os.path.dirname(values_path), prefix=os.path.basename(values_path) + ".",
+                                        suffix=".tmp")
+            os.close(fd)
+            temporary.append(path)
+            return path
+
+        def save(path: str, array: np.ndarray) -> None:
+            tmp_path = temporary_path()
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+        try:
+            with zipfile.ZipFile(self.filename) as zip_container:
+                raw_file = self._read_header(zip_container)
+                shape = tuple(self.file_info['DimSize'])
+                tmp_path = temporary_path()
+                values = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.file_type, shape=shape, fortran_order=True)
+                # The transpose of a Fortran-ordered array is C-contiguous: a flat view in file order
+                array1d = values.T.reshape(-1)
+                with zip_container.open(raw_file) as raw:
+                    no_data = self._decode(raw, array1d)
+            if no_data is not None:
+                save(no_data_path, no_data.reshape(shape, order='F'))
+            if self.is_label:
+                ids = unique_labels(array1d)
+                raw_path = tmp_path
+                del values, array1d
+                raw = np.load(raw_path, mmap_mode="r")
+                tmp_path = temporary_path()
+                values = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.min_scalar_type(max(len(ids) - 1, 0)),
+                                                   shape=shape, fortran_order=True)
+                with timer("volume.encode_labels"):
+                    encode_labels(raw.T.reshape(-1), out=values.T.reshape(-1), ids=ids)
+                del raw
+                save(ids_path, ids)
+            values.flush()
+            del values
+            os.replace(tmp_path, values_path)
+            info_tmp_path = temporary_path()
+            with open(info_tmp_path, "w") as f:
+                json.dump(self.file_info, f)
+            os.replace(info_tmp_path, info_path)
+        finally:
+            for path in temporary:
+                if os.path.exists(path):
+                    os.remove(path)
+
     def __getitem__(self, slice_obj: Tuple[Any, Any, Any]) -> np.ndarray:
         return self._values[slice_obj]
     
@@ -138,32 +367,106 @@ class AllenVolumetricData:
     @reference.setter
     def reference(self, reference_object: Any) -> None:
         self._reference = reference_object
-        self.color_table = np.zeros((len(self.ids), 3))
-        for i, idx in enumerate(self.ids):
-            try:
-                self.color_table[i, :] = Color("#" + self._reference[idx].color_hex_triplet).rgb
-            except KeyError:
-                self.color_table[i, :] = Color("#000000").rgb
+        self.color_lut = np.zeros((len(self.ids), 3), dtype=np.uint8)
+        if reference_object is not None:
+            rows = self._reference.table.index_of(self.ids)
+            found = rows >= 0
+            self.color_lut[found, :] = self._reference.table.color[rows[found]]
+        self.color_table = self.color_lut / 255.
+        # The slices rendered so far were colored with the previous reference
+        self.__dict__.pop("_renderer", None)
+
+    def masked(self, fill: float=np.nan) -> np.ndarray:
+        """Float32 copy of the values with the no data entries set to `fill` (whether or not they were replaced)
+        """
+        values = np.array(self._values, dtype=np.float32)
+        if self.no_data is not None:
+            values[self.no_data] = fill
+        return values
+
+    @property
+    def label_index(self) -> LabelIndex:
+        """Voxel counts, bounding boxes and voxel lists of every label (computed once, kept in the sidecar cache if any)
+        """
+        try:
+            return self._label_index
+        except AttributeError:
+            path = getattr(self, "_label_index_path", None)
+            if path is not None and os.path.exists(path):
+                self._label_index = LabelIndex.load(path, self._values)
+            else:
+                self._label_index = LabelIndex(self._values, n_labels=len(self.ids))
+                if path is not None:
+                    self._label_index.save(path)
+            return self._label_index
+
+    def _labels_of(self, structure_id: int, descendants: bool) -> np.ndarray:
+        if descendants:
+            return np.where(self.reference.is_descendant(self.ids, structure_id))[0]
+        label = np.searchsorted(self.ids, structure_id)
+        return np.array([label] if label < len(self.ids) and self.ids[label] == structure_id else [], dtype=np.intp)
+
+    def structure_voxels(self, structure_id: int, descendants: bool=False) -> np.ndarray:
+        """Sorted C order flat indexes of the voxels of a structure (and its descendants, using the reference)
+
+        After the first call, that sorts all the voxels by label, the cost is proportional to the size of the structure.
+        """
+        label_index = self.label_index
+        computed = label_index._flat is not None
+        voxels = [label_index.voxels(label) for label in self._labels_of(structure_id, descendants)]
+        if not computed and getattr(self, "_label_index_path", None) is not None:
+            label_index.save(self._label_index_path)
+        if len(voxels) == 1:
+            return voxels[0]
+        return np.sort(np.concatenate(voxels)) if voxels else np.zeros(0, dtype=np.intp)
+
+    def structure_bbox(self, structure_id: int, descendants: bool=False) -> Optional[Tuple[slice, ...]]:
+        """Slices cropping the volume to a structure, e.g. `vol[vol.structure_bbox(id)]` (None if it is absent)
+        """
+        return self.label_index.bbox(self._labels_of(structure_id, descendants))
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the values (and the label ids), used to budget caches
+        """
+        return self._values.nbytes + (self.ids.nbytes if self.is_label else 0)
 
     @property
     def colored(self) -> Any:
         return self._colored
 
+    @property
+    def renderer(self) -> SliceRenderer:
+        """Cache of display-ready slices used by `interactive_slides`
+        """
+        try:
+            return self._renderer
+        except AttributeError:
+            self._renderer = SliceRenderer(self)
+            return self._renderer
+
     @property
     def zoom(self) -> Any:
-        if self.is_label:
-            raise NotImplementedError("Zoom for label images is not implemented yet. Should be done by RegularGridInterpolator!")
-        else:
-            try:
-                return self._zooms
-            except AttributeError:
-                self._zooms = ZoomedVolumeCollection(self)  # type: Any
-                return self._zooms
+        """Zoomed versions of the volume, e.g. `vol.zoom[0.5]`. Label volumes are resampled with `zoom_labels`
+        """
+        try:
+            return self._zooms
+        except AttributeError:
+            self._zooms = ZoomedVolumeCollection(self)  # type: Any
+            return self._zooms
+
+    def resample_labels(self, other: Any, fill: int=0) -> np.ndarray:
+        """Returns the structure ids of this label volume resampled in the space of another volume (see `resample_labels`)
+        """
+        return resample_labels(self, other, fill=fill)
     
-    def plot_slides(self, coronal: int, sagittal: int, ss: SubplotSpec=None, fig: Any=None, return_figure: Any=False) -> Any:
+    @timed("volume.plot_slides")
+    def plot_slides(self, coronal: int, sagittal: int, ss: Any=None, fig: Any=None, return_figure: Any=False) -> Any:
         if self.is_label and self.reference:
             return self.colored.plot_slides(coronal=coronal, sagittal=sagittal, contour=False, ss=ss, fig=fig, return_figure=return_figure)
         else:
+            import matplotlib.pyplot as plt
+            from matplotlib.gridspec import GridSpecFromSubplotSpec
             if fig is None:
                 fig = plt.gcf()
             if ss is None:
@@ -184,24 +487,31 @@ class AllenVolumetricData:
         if self.is_label and self.reference:
             return self.colored.interactive_slides()
         else:
-            fig = plt.figure(figsize=(12, 5))
-            gs = plt.GridSpec(1, 1)
-            plot_slides = lambda coronal, sagittal, ss, fig, return_figure: self.plot_slides(coronal, sagittal, ss, fig, return_figure)
-            return interact(plot_slides, coronal=(0, self.shape[0] - 1),
-                            sagittal=(0, self.shape[-1] - 1), ss=fixed(gs[0]), fig=fixed(fig), return_figure=fixed(1)), plt.clf()
+            from ipywidgets import interact, fixed
+            viewer = SlideViewer(self.renderer)
+            return interact(viewer.update, coronal=(0, self.shape[0] - 1),
+                            sagittal=(0, self.shape[-1] - 1), contour=fixed(False))
 
 
 class ZoomedVolumeCollection:
-    def __init__(self, allen_vol_data: AllenVolumetricData) -> None:
+    def __init__(self, allen_vol_data: AllenVolumetricData, max_bytes: int=2**29) -> None:
         self.vol_data = allen_vol_data
-        self.collection = LimitedSizeDict(5)
+        self.collection = LRUCache(max_bytes=max_bytes)
 
     def __getitem__(self, value: float) -> Any:
-        if value in self:
-            return self.collection[value]
+        zoomed = self.collection.get(value)
+        if zoomed is None:
+            count("zoom.cache.miss")
+            with timer("zoom.compute", factor=value, label=self.vol_data.is_label):
+                if self.vol_data.is_label:
+                    zoomed = zoom_labels(self.vol_data[:, :, :], value)
+                else:
+                    from scipy.ndimage import zoom
+                    zoomed = zoom(self.vol_data[:, :, :], value)
+            self.collection[value] = zoomed
         else:
-            self.collection[value] = zoom(self.vol_data[:, :, :], value)
-            return self.collection[value]
+            count("zoom.cache.hit")
+        return zoomed
 
     def __contains__(self, value: float) -> bool:
         return value in self.collection
@@ -210,11 +520,50 @@ class ZoomedVolumeCollection:
 class ColoredVolumetric:
     def __init__(self, allen_vol_data: AllenVolumetricData) -> None:
         self.vol_data = allen_vol_data
+        self._contours = LRUCache(max_items=64)
         
     def __getitem__(self, some_slice: Tuple[Any, Any, Any]) -> np.ndarray:
         return self.vol_data.color_table[self.vol_data[some_slice], :]
+
+    def _slice_contours(self, axis: int, index: int) -> Tuple[np.ndarray, Dict[int, np.ndarray]]:
+        cached = self._contours.get((axis, index))
+        if cached is None:
+            count("contours.cache.miss")
+            with timer("contours.compute"):
+                some_slice = [slice(None)] * 3
+                some_slice[axis] = index
+                section = self.vol_data[tuple(some_slice)]
+                segments, _ = boundary_segments(section)
+                by_label = contours_by_label(section)
+                cached = (segments, {int(self.vol_data.ids[k]): v for k, v in by_label.items()})
+            self._contours[(axis, index)] = cached
+        else:
+            count("contours.cache.hit")
+        return cached
+
+    def contours(self, axis: int, index: int) -> Dict[int, np.ndarray]:
+        """Returns the boundary segments of every structure in a slice
+
+        Args
+        ----
+        axis: int
+            0 for coronal, 2 for sagittal slices
+        index: int
+            the index of the slice along axis
+
+        Returns
+        -------
+        contours: dict
+            structure id -> (n, 2, 2) segments in (row, column) coordinates of the slice
+
+        """
+        return self._slice_contours(axis, index)[1]
     
-    def plot_slides(self, coronal: int, sagittal: int, contour: bool=False, ss: SubplotSpec=None, fig: Any=None, return_figure: bool=False) -> Any:
+    @timed("colored.plot_slides")
+    def plot_slides(self, coronal: int, sagittal: int, contour: bool=False, ss: Any=None, fig: Any=None, return_figure: bool=False) -> Any:
+            import matplotlib.pyplot as plt
+            from matplotlib.gridspec import GridSpecFromSubplotSpec
+            from matplotlib.collections import LineCollection
             if fig is None:
                 fig = plt.gcf()
             if ss is None:
@@ -228,32 +577,21 @@ class ColoredVolumetric:
             ax.axvline(sagittal, c='y', lw=1)
 
             if contour:
-                coronal_section = self.vol_data[coronal, :, :]
-                for one_hot in one_hot_encoding(coronal_section):
-                    ith_contours = find_contours(one_hot, 0.5)
-                    for n_ith_contour in ith_contours:
-                        ax.plot(n_ith_contour[:, 1], n_ith_contour[:, 0], lw=0.8,
-                                 color="w",zorder=1000)
+                segments, _ = self._slice_contours(0, coronal)
+                ax.add_collection(LineCollection(segments[..., ::-1], lw=0.8, colors="w", zorder=1000))
             ax = fig.add_subplot(gs[1])
             sagittal_section = self[:, :, sagittal]
             ax.imshow(np.transpose(sagittal_section, (1, 0, 2)))
             ax.axvline(coronal, c='y', lw=1)
 
             if contour:
-                sagittal_section = self.vol_data[:, :, sagittal]
-                for one_hot in one_hot_encoding(sagittal_section):
-                    ith_contours = find_contours(one_hot, 0.5)
-                    for n_ith_contour in ith_contours:
-                        ax.plot(n_ith_contour[:, 0], n_ith_contour[:, 1], lw=0.8, color="w",zorder=1000)
+                segments, _ = self._slice_contours(2, sagittal)
+                ax.add_collection(LineCollection(segments, lw=0.8, colors="w", zorder=1000))
             if return_figure:
                 return fig
     
     def interactive_slides(self) -> Any:
-        fig = plt.figure(figsize=(12, 5))
-        gs = plt.GridSpec(1, 1)
-
-        def plot_slides(coronal, sagittal, contour, ss, fig, return_figure):
-            return self.plot_slides(coronal, sagittal, contour, ss, fig, return_figure)
-        
-        return interact(plot_slides, coronal=(0, self.vol_data.shape[0] - 1), sagittal=(0, self.vol_data.shape[-1] - 1),
-                        contour=False, ss=fixed(gs[0]), fig=fixed(fig), return_figure=fixed(1)), plt.clf()
\ No newline at end of file
+        from ipywidgets import interact
+        viewer = SlideViewer(self.vol_data.renderer)
+        return interact(viewer.update, coronal=(0, self.vol_data.shape[0] - 1), sagittal=(0, self.vol_data.shape[-1] - 1),
+                        contour=False)
\ No newline at end of file
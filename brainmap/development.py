@@ -0,0 +1,204 @@
+import numpy as np
+import os
+import glob
+import json
+import logging
+from typing import *
+import brainmap as bm
+
+
+def normalize_time_point(time_point: str) -> str:
+    """Canonical name of a time point: `E11pt5`, `E11.5` and `E11` (as in the grid file names) become `E11.5`
+    """
+    time_point = time_point.replace("pt", ".")
+    if time_point.startswith("E") and "." not in time_point:
+        time_point += ".5"
+    return time_point
+
+
+def _age(time_point: str) -> Tuple[int, float]:
+    """Sort key of time points: embryonic before postnatal days
+    """
+    return (0 if time_point.startswith("E") else 1, float(time_point[1:]))
+
+
+def annotation_path(folder: str, time_point: str) -> Optional[str]:
+    """The gridAnnotation zip of a time point in a folder like `data/AllenBrain3d` (e.g. `E11pt5_DevMouse2012_gridAnnotation.zip`)
+    """
+    found = glob.glob(os.path.join(folder, "%s_*gridAnnotation.zip" % normalize_time_point(time_point).replace(".", "pt")))
+    return sorted(found)[0] if found else None
+
+
+class DevelopmentalAtlas:
+    ''' Gene expression grids across the developmental time points, with the annotation of each age
+
+    The grids of every time point have their own shape, so the atlas is a folder with one ExpressionStore
+    per time point (`<path>/<time point>/`) and `atlas.json`. A genome-wide read at one age is a scan of one
+    memory-map and the time course of a gene is one contiguous row per age. Stores, annotations and the
+    `development` ontology are opened on first use.
+
+    Attributes
+    ----------
+    path:
+        the folder of the atlas
+    time_points:
+        the time points with a store, in developmental order
+    annotation_dir:
+        the folder of the `*_gridAnnotation.zip` files
+    '''
+    info_file = "atlas.json"
+
+    def __init__(self, path: str, annotation_dir: str=None, reference: Any=None) -> None:
+        self.path = path
+        with open(os.path.join(path, self.info_file)) as f:
+            info = json.load(f)
+        self.time_points = info["time_points"]  # type: List[str]
+        self.annotation_dir = info["annotation_dir"] if annotation_dir is None else annotation_dir
+        self._reference = reference
+        self._stores = {}  # type: Dict[str, bm.ExpressionStore]
+        self._annotations = {}  # type: Dict[str, bm.AllenVolumetricData]
+
+    @classmethod
+    def build(cls, root: str, path: str, annotation_dir: str, time_points: Iterable[str]=None,
+              priority: List[str]=["coronal", "sagittal"]) -> "DevelopmentalAtlas":
+        """Packs the grids of a folder of ISH files in one ExpressionStore per time point
+
+        The time point of each file is parsed from its name (see `ISHIndex`); for every gene and age the most recent
+        experiment in the first plane of `priority` is kept. The no data entries are kept negative, so that they
+        are excluded by the statistics.
+
+        Args
+        ----
+        root: str
+            folder of `gene_plane_timepoint_id.zip` files of any age
+        path: str
+            the output folder
+        annotation_dir: str
+            folder of the gridAnnotation files, each store only keeps the grids with the shape of its annotation
+        time_points: iterable of str
+            the time points to pack, defaults to all the ones found in root
+
+        Returns
+        -------
+        atlas: DevelopmentalAtlas
+
+        """
+        files = bm.ISHIndex(root)
+        by_time_point = {}  # type: Dict[str, Dict[str, Tuple[str, str]]]
+        for gene in files.genes:
+            for entry in files.experiments(gene):
+                if entry["time_point"] is None:
+                    continue
+                time_point = normalize_time_point(entry["time_point"])
+                chosen = by_time_point.setdefault(time_point, {})
+                # experiments are sorted most recent first: keep the first one in the preferred plane
+                if entry["plane"] in priority and (gene not in chosen or
+                                                   priority.index(entry["plane"]) < priority.index(chosen[gene][0])):
+                    chosen[gene] = (entry["plane"], files.file_path(entry))
+        wanted = set(normalize_time_point(t) for t in time_points) if time_points is not None else set(by_time_point)
+        ordered = sorted(wanted & set(by_time_point), key=_age)
+        built = []
+        for time_point in ordered:
+            annotation = annotation_path(annotation_dir, time_point)
+            shape = None if annotation is None else bm.AllenVolumetricData(annotation).shape
+            index = {gene: file for gene, (_, file) in by_time_point[time_point].items()}
+            logging.debug("Packing %i genes at %s" % (len(index), time_point))
+            store = bm.ExpressionStore.build(index, os.path.join(path, time_point), remove_negative_entries=False, shape=shape)
+            if len(store):
+                built.append(time_point)
+        with open(os.path.join(path, cls.info_file + ".tmp"), "w") as f:
+            json.dump({"time_points": built, "annotation_dir": os.path.abspath(annotation_dir)}, f)
+        os.replace(os.path.join(path, cls.info_file + ".tmp"), os.path.join(path, cls.info_file))
+        return cls(path)
+
+    @property
+    def reference(self) -> Any:
+        """The `development` AllenBrainReference shared by all the annotations
+        """
+        if self._reference is None:
+            self._reference = bm.AllenBrainReference(graph="development")
+        return self._reference
+
+    def store(self, time_point: str) -> "bm.ExpressionStore":
+        """The genome-wide ExpressionStore of a time point
+        """
+        time_point = normalize_time_point(time_point)
+        if time_point not in self._stores:
+            if time_point not in self.time_points:
+                raise KeyError("time point %s is not in the atlas" % time_point)
+            self._stores[time_point] = bm.ExpressionStore(os.path.join(self.path, time_point))
+        return self._stores[time_point]
+
+    def annotation(self, time_point: str, colored: bool=True) -> "bm.AllenVolumetricData":
+        """The gridAnnotation of a time point, colored with the development ontology (fetched on first use) if `colored`
+        """
+        time_point = normalize_time_point(time_point)
+        if time_point not in self._annotations:
+            path = annotation_path(self.annotation_dir, time_point)
+            if path is None:
+                raise KeyError("there is no gridAnnotation for %s in %s" % (time_point, self.annotation_dir))
+            self._annotations[time_point] = bm.AllenVolumetricData(path)
+        annotation = self._annotations[time_point]
+        if colored and annotation.reference is None:
+            annotation.reference = self.reference
+        return annotation
+
+    @property
+    def genes(self) -> List[str]:
+        """The genes available at least at one time point
+        """
+        return sorted(set(g for t in self.time_points for g in self.store(t).genes))
+
+    def __contains__(self, gene: Any) -> bool:
+        return any(gene in self.store(t) for t in self.time_points)
+
+    def __getitem__(self, gene: str) -> Dict[str, np.ndarray]:
+        """The time course of a gene: time point -> volume (a view on the memory-map), for the ages where it was measured
+        """
+        course = {t: self.store(t)[gene] for t in self.time_points if gene in self.store(t)}
+        if not course:
+            raise KeyError(gene)
+        return course
+
+    def structure_time_course(self, genes: Iterable[str], hierarchical: bool=True, threshold: float=0.,
+                              chunk_size: int=256) -> Dict[str, Any]:
+        """Per-structure statistics of many genes at every time point (see `structure_statistics`)
+
+        Every age is reduced with one bincount per chunk of genes against its own annotation, reading `chunk_size`
+        rows of its store at a time. With `hierarchical` the columns are all the structures of the development
+        ontology, each including its descendants; otherwise the ontology is not needed.
+
+        Returns
+        -------
+        time_course: dict
+            `genes`, `time_points`, `ids` and the (genes, time points, structures) arrays `sum`, `count`, `mean`
+            and `fraction` (nan where a gene was not measured at an age or a structure has no valid voxel)
+
+        """
+        genes = list(genes)
+        gene_ix = {g: i for i, g in enumerate(genes)}
+        per_time_point = []
+        for time_point in self.time_points:
+            store = self.store(time_point)
+            present = [g for g in genes if g in store]
+            if not present:
+                per_time_point.append(None)
+                continue
+            statistics = bm.structure_statistics(store, self.annotation(time_point, colored=False),
+                                                 reference=self.reference if hierarchical else None,
+                                                 threshold=threshold, hierarchical=hierarchical,
+                                                 chunk_size=chunk_size, genes=present)
+            statistics["rows"] = [gene_ix[g] for g in present]
+            per_time_point.append(statistics)
+        ids = np.unique(np.concatenate([s["ids"] for s in per_time_point if s is not None] or [np.zeros(0, dtype=int)]))
+        result = {"genes": genes, "time_points": list(self.time_points), "ids": ids}  # type: Dict[str, Any]
+        for key in ("sum", "count", "mean", "fraction"):
+            result[key] = np.full((len(genes), len(self.time_points), len(ids)), np.nan)
+        for t, statistics in enumerate(per_time_point):
+            if statistics is None:
+                continue
+            columns = np.searchsorted(ids, statistics["ids"])
+            rows = np.array(statistics["rows"])
+            for key in ("sum", "count", "mean", "fraction"):
+                result[key][rows[:, None], t, columns[None, :]] = statistics[key]
+        return result
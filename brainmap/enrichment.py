@@ -0,0 +1,98 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+import brainmap as bm
+
+
+def _chunk_stats(matrix: np.ndarray, voxels: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns count, mean and variance of the valid voxels of every row (nan where there are none)
+    """
+    values = matrix[:, voxels].astype(np.float64)
+    valid = np.isfinite(values) & (values >= 0)
+    values[~valid] = 0
+    count = valid.sum(1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = values.sum(1) / count
+        variance = (values ** 2).sum(1) / count - mean ** 2
+    return count, mean, np.maximum(variance, 0)
+
+
+def rank_enrichment(source: Any, structure_id: int, annotation: Any, reference: Any=None, background: str="brain",
+                    sort_by: str="z", chunk_size: int=256, n_workers: int=None, pseudocount: float=1e-3) -> Dict[str, Any]:
+    """Ranks all the genes by their enrichment in a structure (and its descendants) versus a background
+
+    The genes are streamed in chunks of `chunk_size` across a pool of `n_workers` threads, so memory stays
+    bounded by a few chunks. Voxels with no data (negative or non finite) are excluded gene by gene.
+
+    Args
+    ----
+    source: ExpressionStore, ISHLoader or str
+        the genes to rank (an ExpressionStore is read from its memory-map and must keep its no data entries,
+        see `ExpressionStore.check_no_data`; an ISHLoader is read through its cache masking the no data entries)
+    structure_id: int
+        the structure of the AllenBrainReference
+    annotation: AllenVolumetricData
+        a label volume with the shape of the gene grids (e.g. the gridAnnotation)
+    reference: AllenBrainReference
+        defaults to `annotation.reference`
+    background: str
+        `brain` (all the annotated voxels outside the structure) or `parent` (the rest of the parent structure)
+    sort_by: str
+        `z` (Welch statistic of the difference of the means) or `fold_change`
+    pseudocount: float
+        added to both means when computing the fold change
+
+    Returns
+    -------
+    ranking: dict
+        `genes` and the arrays `mean_in`, `mean_out`, `fold_change`, `z`, `n_in`, `n_out`,
+        sorted by decreasing `sort_by` (genes without valid voxels last)
+
+    """
+    if reference is None:
+        reference = annotation.reference
+    if isinstance(source, str):
+        source = bm.ISHLoader(source)
+    inside = reference.structure_mask(structure_id, annotation).ravel()
+    if background == "brain":
+        outside = (annotation.ids[np.ravel(annotation[:, :, :])] != 0) & ~inside
+    elif background == "parent":
+        parent = reference[structure_id].parent
+        if parent is None:
+            raise ValueError("structure %s has no parent" % structure_id)
+        outside = reference.structure_mask(parent.id, annotation).ravel() & ~inside
+    else:
+        raise ValueError("background='%s' is not valid" % background)
+    inside, outside = np.where(inside)[0], np.where(outside)[0]
+    if len(inside) == 0:
+        raise ValueError("structure %s has no voxels in the annotation" % structure_id)
+
+    if isinstance(source, bm.ExpressionStore):
+        source.check_no_data()
+        genes = list(source.genes)
+
+        def read(start: int) -> np.ndarray:
+            return np.asarray(source.matrix[start:start + chunk_size])
+    else:
+        genes = sorted(source.index)
+
+        def read(start: int) -> np.ndarray:
+            return np.stack([source[g].masked().ravel() for g in genes[start:start + chunk_size]])
+
+    def work(start: int) -> Tuple[np.ndarray, ...]:
+        matrix = read(start)
+        if matrix.shape[1] != int(np.prod(annotation.shape)):
+            raise ValueError("gene grids have %i voxels and the annotation %i" % (matrix.shape[1], np.prod(annotation.shape)))
+        return _chunk_stats(matrix, inside) + _chunk_stats(matrix, outside)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(work, range(0, len(genes), chunk_size)))
+    n_in, mean_in, var_in, n_out, mean_out, var_out = [np.concatenate(i) for i in zip(*results)]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fold_change = (mean_in + pseudocount) / (mean_out + pseudocount)
+        z = (mean_in - mean_out) / np.sqrt(var_in / n_in + var_out / n_out)
+    score = {"z": z, "fold_change": fold_change}[sort_by]
+    order = np.argsort(-np.where(np.isnan(score), -np.inf, score), kind="stable")
+    return {"genes": [genes[i] for i in order], "mean_in": mean_in[order], "mean_out": mean_out[order],
+            "fold_change": fold_change[order], "z": z[order], "n_in": n_in[order], "n_out": n_out[order]}
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import logging
+import threading
+import functools
+from typing import *
+
+# Opt-in instrumentation: timers and counters are recorded only after `enable()` (or with BRAINMAP_INSTRUMENT=1),
+# when disabled every instrumented call only checks a module flag.
+_enabled = False
+_sinks = []  # type: List[Callable[[Dict[str, Any]], None]]
+
+
+class Stats:
+    ''' Thread-safe totals of the timers and counters recorded while the instrumentation is enabled
+
+    Timer names are dotted (e.g. `ish.download`), counters ending in `.hit` and `.miss` are combined in `hit_rates`.
+    '''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timers = {}  # type: Dict[str, List[float]]
+            self.counters = {}  # type: Dict[str, float]
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.timers.get(name)
+            if entry is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def add(self, name: str, value: float=1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def hit_rates(self) -> Dict[str, float]:
+        with self._lock:
+            counters = dict(self.counters)
+        rates = {}
+        for name in counters:
+            if name.endswith(".hit"):
+                prefix = name[:-len(".hit")]
+                hits, misses = counters[name], counters.get(prefix + ".miss", 0)
+                rates[prefix] = hits / (hits + misses)
+            elif name.endswith(".miss") and name[:-len(".miss")] + ".hit" not in counters:
+                rates[name[:-len(".miss")]] = 0.
+        return rates
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns a json serializable copy of the totals
+
+        Returns
+        -------
+        snapshot: dict
+            `timers` (name -> count, total_seconds, mean_seconds, max_seconds), `counters` and `hit_rates`
+
+        """
+        with self._lock:
+            timers = {k: {"count": int(v[0]), "total_seconds": v[1], "mean_seconds": v[1] / v[0], "max_seconds": v[2]}
+                      for k, v in self.timers.items()}
+            counters = dict(self.counters)
+        return {"timers": timers, "counters": counters, "hit_rates": self.hit_rates()}
+
+    def __getitem__(self, name: str) -> Any:
+        snapshot = self.snapshot()
+        if name in snapshot["timers"]:
+            return snapshot["timers"][name]
+        return snapshot["counters"][name]
+
+    def summary(self) -> str:
+        """A table of the timers sorted by total time, followed by the counters and hit rates
+        """
+        snapshot = self.snapshot()
+        lines = ["%-32s %8s %12s %12s" % ("timer", "count", "total (s)", "max (s)")]
+        for name, t in sorted(snapshot["timers"].items(), key=lambda i: -i[1]["total_seconds"]):
+            lines.append("%-32s %8i %12.4f %12.4f" % (name, t["count"], t["total_seconds"], t["max_seconds"]))
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append("%-32s %8s" % (name, ("%d" if float(value).is_integer() else "%g") % value))
+        for name, rate in sorted(snapshot["hit_rates"].items()):
+            lines.append("%-32s %7.1f%%" % (name + " hit rate", 100 * rate))
+        return "\n".join(lines)
+
+
+stats = Stats()
+
+
+def enable(sink: Callable[[Dict[str, Any]], None]=None, reset: bool=False) -> Stats:
+    """Starts recording, optionally sending every event to `sink` (see `log_sink`)
+    """
+    global _enabled
+    if reset:
+        stats.reset()
+    if sink is not None:
+        add_sink(sink)
+    _enabled = True
+    return stats
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def add_sink(sink: Callable[[Dict[str, Any]], None]) -> None:
+    """Registers a callable receiving a dict for every timer (`event`, `seconds`, ...) and counter (`event`, `value`)
+    """
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def remove_sink(sink: Callable[[Dict[str, Any]], None]) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def log_sink(logger: logging.Logger=None, level: int=logging.INFO) -> Callable[[Dict[str, Any]], None]:
+    """A sink writing every event as a json line to a logger (default `brainmap.instrument`)
+    """
+    logger = logging.getLogger("brainmap.instrument") if logger is None else logger
+
+    def sink(event: Dict[str, Any]) -> None:
+        logger.log(level, json.dumps(event, default=str))
+    return sink
+
+
+def _emit(event: Dict[str, Any]) -> None:
+    for sink in list(_sinks):
+        try:
+            sink(event)
+        except Exception as e:
+            logging.debug("Instrumentation sink %s failed: %s" % (sink, e))
+
+
+def count(name: str, value: float=1, **fields: Any) -> None:
+    """Adds value to a counter (e.g. bytes read or a cache hit)
+    """
+    if not _enabled:
+        return
+    stats.add(name, value)
+    if _sinks:
+        _emit(dict(fields, event=name, value=value))
+
+
+class _Timer:
+    def __init__(self, name: str, fields: Dict[str, Any]) -> None:
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        seconds = time.perf_counter() - self.start
+        stats.add_time(self.name, seconds)
+        if _sinks:
+            _emit(dict(self.fields, event=self.name, seconds=seconds, error=exc_info[0] is not None,
+                       thread=threading.current_thread().name))
+
+
+class _NullTimer:
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str, **fields: Any) -> Any:
+    """Context manager timing a block, e.g. `with timer("volume.inflate", file=path): ...`
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name, fields)
+
+
+def timed(name: str) -> Callable:
+    """Decorator timing every call of a function or method
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Timer(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if os.environ.get("BRAINMAP_INSTRUMENT", "") not in ("", "0"):
+    enable(sink=log_sink())
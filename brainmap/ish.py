@@ -1,14 +1,86 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from allensdk.api.queries.rma_api import RmaApi
-from allensdk.api.queries.grid_data_api import GridDataApi
 import os
-import glob
 from typing import *
 import brainmap as bm
 import re
+import json
+import time
+import zipfile
+import threading
+import http.client
 import logging
-from brainmap import LimitedSizeDict
+from urllib.parse import urlsplit, urljoin
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from brainmap import LRUCache
+from brainmap.instrument import timer, timed, count
+
+
+class DownloadError(IOError):
+    def __init__(self, url: str, status: int) -> None:
+        super(DownloadError, self).__init__("%s returned HTTP status %i" % (url, status))
+        self.url = url
+        self.status = status
+
+
+def _decode_grid(path: str) -> np.ndarray:
+    """Reads the values of a grid file (module level so that it can run in a process pool)
+    """
+    return bm.AllenVolumetricData(filename=path)[:, :, :]
+
+
+_REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class _ConnectionPool:
+    """Keeps one persistent HTTP connection per thread and host, so consecutive downloads reuse it
+    """
+    def __init__(self, timeout: float=60) -> None:
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = self._local.__dict__.setdefault("connections", {})
+        if (scheme, netloc) not in connections:
+            connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            connections[(scheme, netloc)] = connection_class(netloc, timeout=self.timeout)
+        return connections[(scheme, netloc)]
+
+    def download(self, url: str, path: str, chunk_size: int=2**16, max_redirects: int=5) -> int:
+        """Streams the body of a GET request to `path`, returns the number of bytes written
+
+        Redirects are followed up to `max_redirects` times (on the connection of the new host if it changed),
+        a redirect loop raises DownloadError with the last 3xx status.
+        """
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            connection = self._connection(parts.scheme, parts.netloc)
+            target = parts.path + ("?" + parts.query if parts.query else "")
+            try:
+                connection.request("GET", target)
+                response = connection.getresponse()
+                if response.status in _REDIRECTS and response.getheader("Location"):
+                    response.read()
+                    url = urljoin(url, response.getheader("Location"))
+                    continue
+                if response.status != 200:
+                    response.read()
+                    raise DownloadError(url, response.status)
+                n_bytes = 0
+                with open(path, "wb") as f:
+                    while True:
+                        chunk = response.read(chunk_size)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        n_bytes += len(chunk)
+                count("ish.bytes_downloaded", n_bytes)
+                return n_bytes
+            except (http.client.HTTPException, OSError):
+                # A broken connection can not be reused, it will be reopened by the next request
+                connection.close()
+                raise
+        raise DownloadError(url, response.status)
 
 
 class ISHFetcher:
@@ -26,6 +98,12 @@ class ISHFetcher:
     download_grid_recent:
         Dowloads the most recently qc-ed expression energy 3d density file (200um grid) that satisfy the query
 
+    find_ids_batch:
+        Returns the Section Data Sets of many genes, planes and time points using a few paged queries
+
+    download_many:
+        Dowloads the most recent grid of many genes concurrently, resuming interrupted runs
+
     Attributes
     ----------
     rma:
@@ -36,10 +114,25 @@ class ISHFetcher:
         results of the find_id_ish query
     '''
     def __init__(self) -> None:
-        self.rma = RmaApi()
-        self.gda = GridDataApi()
+        self._rma = None  # type: Any
+        self._gda = None  # type: Any
         self.res = None  # type: List
 
+    @property
+    def rma(self) -> Any:
+        if self._rma is None:
+            from allensdk.api.queries.rma_api import RmaApi
+            self._rma = RmaApi()
+        return self._rma
+
+    @property
+    def gda(self) -> Any:
+        if self._gda is None:
+            from allensdk.api.queries.grid_data_api import GridDataApi
+            self._gda = GridDataApi()
+        return self._gda
+
+    @timed("ish.find_id_ish")
     def find_id_ish(self, gene: str, sag_or_cor: str="sagittal",
                     adu_or_dev: str="adult", time_point: str="P56") -> List:
         """Returns the ids of Section Data Sets (a single gene experiment)
@@ -65,17 +158,7 @@ class ISHFetcher:
 
         """
         
-        if adu_or_dev == "adult" and "E" in time_point:
-            raise ValueError("there is not adult with age %s" % time_point)
-
-        if adu_or_dev == "adult":
-            adu_or_dev = "Mouse"
-        elif adu_or_dev == "development":
-            adu_or_dev = "DevMouse"
-        elif adu_or_dev == "both":
-            adu_or_dev = "*Mouse"
-        else:
-            raise ValueError("adu_or_dev='%s' is not valid" % adu_or_dev)
+        adu_or_dev = self._product_abbreviation(adu_or_dev, time_point)
         criteria = ["[failed$eq'false']",
                     "reference_space[name$li'*%s*']" % time_point,
                     "products[abbreviation$li'%s']" % adu_or_dev,
@@ -105,6 +188,88 @@ class ISHFetcher:
 
         return results
 
+    @staticmethod
+    def _product_abbreviation(adu_or_dev: str, time_point: str) -> str:
+        if adu_or_dev == "adult" and "E" in time_point:
+            raise ValueError("there is not adult with age %s" % time_point)
+
+        if adu_or_dev == "adult":
+            return "Mouse"
+        elif adu_or_dev == "development":
+            return "DevMouse"
+        elif adu_or_dev == "both":
+            return "*Mouse"
+        else:
+            raise ValueError("adu_or_dev='%s' is not valid" % adu_or_dev)
+
+    @timed("ish.find_ids_batch")
+    def find_ids_batch(self, genes: Iterable[str], planes: Iterable[str]=("coronal", "sagittal"),
+                       adu_or_dev: str="adult", time_points: Iterable[str]=("P56",),
+                       genes_per_query: int=200, page_size: int=2000) -> Dict[str, List[Dict[str, Any]]]:
+        """Returns the Section Data Sets of many genes using a few paged queries
+
+        Args
+        ----
+        genes: iterable of str
+            the genes to search for
+        planes: iterable of str
+            any of `coronal` and `sagittal`
+        adu_or_dev: str
+            `adult`, `development`, `both`
+        time_points: iterable of str (they will be autmatically wildcarded)
+            e.g. ["P56"], ["E11.5", "E13.5"]
+        genes_per_query: int
+            genes sent in a single `$in` criteria (limits the url length)
+        page_size: int
+            number of rows requested per page
+
+        Returns
+        -------
+        experiments: dict
+            gene -> list of dicts with keys `id`, `qc_date`, `plane`, `time_point`,
+            sorted by most_recent to mose ancient as in `find_id_ish`.
+            Genes with no experiment are mapped to an empty list
+
+        """
+        genes = list(genes)
+        planes = list(planes)
+        time_points = list(time_points)
+        found = {gene: [] for gene in genes}  # type: Dict[str, List[Dict[str, Any]]]
+        for time_point in time_points:
+            product = self._product_abbreviation(adu_or_dev, time_point)
+            for start in range(0, len(genes), genes_per_query):
+                batch = genes[start:start + genes_per_query]
+                in_batch = set(batch)
+                criteria = ["[failed$eq'false']",
+                            "reference_space[name$li'*%s*']" % time_point,
+                            "products[abbreviation$li'%s']" % product,
+                            "plane_of_section[name$in%s]" % ",".join("'%s'" % i for i in planes),
+                            "genes[acronym$in%s]" % ",".join("'%s'" % i for i in batch)]
+                for row in self._paged_query("SectionDataSet", ','.join(criteria), "genes,plane_of_section", page_size):
+                    # an experiment of several genes is returned by the query of every batch containing one of them
+                    for gene in row["genes"]:
+                        if gene["acronym"] in in_batch:
+                            found[gene["acronym"]].append({"id": int(row["id"]),
+                                                           "qc_date": row["qc_date"] or '',
+                                                           "plane": row["plane_of_section"]["name"],
+                                                           "time_point": time_point})
+        for gene, experiments in found.items():
+            experiments.sort(key=lambda x: x["qc_date"], reverse=True)
+        return found
+
+    def _paged_query(self, model: str, criteria: str, include: str, page_size: int) -> List[Dict[str, Any]]:
+        rows = []  # type: List[Dict[str, Any]]
+        while True:
+            # Without an explicit order the pages are not guaranteed to be consistent: rows could repeat or be skipped
+            with timer("ish.rma_query", model=model, start_row=len(rows)):
+                page = self.rma.model_query(model, criteria=criteria, include=include, count=False,
+                                            start_row=len(rows), num_rows=page_size, order=["'id'"])
+            if isinstance(page, str):
+                raise ValueError("Bad query! Server returned :\n%s" % page)
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+
     def download_grid_all(self, gene: str, folder: str='../data', sag_or_cor: str="sagittal",
                           adu_or_dev: str="adult", time_point: str="P56") -> None:
         """Dowloads all the files
@@ -126,9 +291,12 @@ class ISHFetcher:
         """
         ids = self.find_id_ish(gene, sag_or_cor=sag_or_cor, adu_or_dev=adu_or_dev, time_point=time_point) 
         for idd in ids:
-            self.gda.download_expression_grid_data(idd,
-                                                   path=os.path.join(folder,
-                                                                     "%s_%s_%s_%s.zip" % (gene, sag_or_cor, time_point, idd)))
+            self._download_grid(idd, os.path.join(folder, "%s_%s_%s_%s.zip" % (gene, sag_or_cor, time_point, idd)))
+
+    def _download_grid(self, idd: int, path: str) -> None:
+        with timer("ish.download", experiment_id=idd):
+            self.gda.download_expression_grid_data(idd, path=path)
+        count("ish.bytes_downloaded", os.path.getsize(path))
 
     def download_grid_recent(self, gene: str, folder: str='../data', sag_or_cor: str="sagittal",
                              adu_or_dev: str="adult", time_point: str="P56") -> Union[str, bool]:
@@ -158,54 +326,441 @@ class ISHFetcher:
         try:
             idd = ids[0]
             output_path = os.path.join(folder, "%s_%s_%s_%s.zip" % (gene, sag_or_cor, time_point, idd))
-            self.gda.download_expression_grid_data(idd, path=output_path)
+            self._download_grid(idd, output_path)
             return output_path
         except IndexError:
             logging.warn("Experiment %s was never performed" % gene)
             return False
 
+    def download_many(self, genes: Iterable[str], folder: str='../data', sag_or_cor: str="coronal",
+                      adu_or_dev: str="adult", time_point: str="P56", ids: Dict[str, int]=None,
+                      n_workers: int=8, retries: int=3, backoff: float=1.0,
+                      manifest: str=None, endpoint: str=None) -> Dict[str, Union[str, bool]]:
+        """Dowloads the most recently qc-ed grid of every gene concurrently
+
+        Each file is written to a temporary `.part` file and renamed when complete, so that half-written zips
+        never appear in `folder`. The outcome for each gene is recorded in a json manifest, keyed by
+        `gene|sag_or_cor|adu_or_dev|time_point`: calling again with the same arguments after an interruption
+        only downloads what is missing.
+
+        Args
+        ----
+        genes: iterable of str
+            the genes to download
+        folder: str
+            the output folder (e.g. the root of an ISHLoader)
+        sag_or_cor, adu_or_dev, time_point:
+            as in `find_id_ish`
+        ids: dict
+            gene -> Section Data Set id, if not given they are resolved with `find_ids_batch`
+        n_workers: int
+            number of concurrent downloads (each worker reuses its own HTTP connection)
+        retries: int
+            number of attempts after the first failed one
+        backoff: float
+            seconds to wait before the first retry, doubled at every attempt
+        manifest: str
+            the path of the manifest, defaults to `folder/.ish_manifest.json`
+        endpoint: str
+            base url of the grid data service, defaults to the one of GridDataApi
+
+        Returns
+        -------
+        results: dict
+            gene -> path of the downloaded file or False if the gene is not available
+
+        """
+        if manifest is None:
+            manifest = os.path.join(folder, ".ish_manifest.json")
+        if endpoint is None:
+            endpoint = self.gda.grid_data_endpoint
+        done = {}  # type: Dict[str, Any]
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                done = json.load(f)
+        lock = threading.Lock()
+        pool = _ConnectionPool()
+        results = {}  # type: Dict[str, Union[str, bool]]
+        todo = []  # type: List[str]
+
+        def key(gene: str) -> str:
+            # The same folder can mirror several planes and ages of a gene
+            return "|".join((gene, sag_or_cor, adu_or_dev, time_point))
+
+        for gene in genes:
+            entry = done.get(key(gene))
+            if entry is not None and (entry["file"] is None or os.path.exists(os.path.join(folder, entry["file"]))):
+                results[gene] = os.path.join(folder, entry["file"]) if entry["file"] else False
+            else:
+                todo.append(gene)
+        logging.debug("%i genes already in the manifest, %i to download" % (len(results), len(todo)))
+        if ids is None:
+            found = self._with_retries(self.find_ids_batch, retries, backoff, todo, planes=[sag_or_cor],
+                                       adu_or_dev=adu_or_dev, time_points=[time_point])
+            ids = {gene: experiments[0]["id"] for gene, experiments in found.items() if experiments}
+
+        def task(gene: str) -> None:
+            idd = ids.get(gene)
+            if idd is None:
+                logging.warn("Experiment %s was never performed" % gene)
+                filename = None
+            else:
+                filename = "%s_%s_%s_%s.zip" % (gene, sag_or_cor, time_point, idd)
+                output_path = os.path.join(folder, filename)
+                try:
+                    self._with_retries(self._download_atomic, retries, backoff, pool,
+                                       "%s/download/%i" % (endpoint, idd), output_path)
+                except (http.client.HTTPException, OSError) as e:
+                    # Not recorded in the manifest, the next run will try again
+                    logging.warn("Download of %s failed: %s" % (gene, e))
+                    results[gene] = False
+                    return
+            with lock:
+                done[key(gene)] = {"id": idd, "file": filename}
+                results[gene] = os.path.join(folder, filename) if filename else False
+                with open(manifest + ".tmp", "w") as f:
+                    json.dump(done, f)
+                os.replace(manifest + ".tmp", manifest)
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for future in [executor.submit(task, gene) for gene in todo]:
+                future.result()
+        return results
+
+    @staticmethod
+    def _with_retries(function: Callable, retries: int, backoff: float, *args: Any, **kwargs: Any) -> Any:
+        for attempt in range(retries + 1):
+            try:
+                return function(*args, **kwargs)
+            except DownloadError as e:
+                # Client errors will not go away retrying
+                if e.status < 500 or attempt == retries:
+                    raise
+            except (http.client.HTTPException, OSError):
+                if attempt == retries:
+                    raise
+            logging.debug("Attempt %i failed, retrying in %.1fs" % (attempt + 1, backoff * 2**attempt))
+            time.sleep(backoff * 2**attempt)
+
+    @staticmethod
+    def _download_atomic(pool: _ConnectionPool, url: str, output_path: str) -> None:
+        tmp_path = output_path + ".part"
+        try:
+            with timer("ish.download", url=url):
+                pool.download(url, tmp_path)
+            if not zipfile.is_zipfile(tmp_path):
+                raise IOError("%s did not return a valid zip file" % url)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_GRID_KINDS = ("energy", "intensity", "density")
+_TIME_POINT = re.compile(r"^[EP]\d+(pt5|\.5)?$")
+
+
+def parse_grid_filename(path: str) -> Dict[str, Any]:
+    """Parses a `gene_plane_timepoint_id.zip` file name (the tokens after the gene can be in any order)
+
+    Returns
+    -------
+    entry: dict
+        `file`, `gene`, `plane` (coronal, sagittal or None), `time_point` (e.g. P56, E11pt5 or None),
+        `experiment_id` (the last numeric token or None) and `kind` (energy, the default, intensity or density)
+
+    """
+    filename = os.path.basename(path)
+    tokens = os.path.splitext(filename)[0].split("_")
+    entry = {"file": filename, "gene": tokens[0], "plane": None, "time_point": None, "experiment_id": None,
+             "kind": "energy"}  # type: Dict[str, Any]
+    for token in tokens[1:]:
+        if token in ("coronal", "sagittal"):
+            entry["plane"] = token
+        elif token in _GRID_KINDS:
+            entry["kind"] = token
+        elif _TIME_POINT.match(token):
+            entry["time_point"] = token
+        elif token.isdigit():
+            entry["experiment_id"] = int(token)
+    return entry
+
+
+def _preference(entry: Dict[str, Any]) -> Tuple[bool, int, str]:
+    """Sort key of the experiments, the preferred last: energy grids, then the most recent (the experiment ids grow
+    over time), then the file name so that ties do not depend on the listing order
+    """
+    return entry["kind"] == "energy", -1 if entry["experiment_id"] is None else entry["experiment_id"], entry["file"]
+
+
+class ISHIndex:
+    ''' Persistent index of the grid files of an ISHLoader root
+
+    For every `gene_plane_timepoint_id.zip` file the index stores gene, plane, time point, experiment id,
+    size and mtime in `root/.ish_index.json` (or in `index_path`), with the mtime of the folder when it was listed.
+    On startup the folder is listed again only if its mtime changed (a file was added, removed or renamed) or it
+    was listed within `racy_ns` of its last change, otherwise the indexed files are only stat-ed to catch the ones
+    rewritten in place. Only the files whose size or mtime changed are parsed again.
+    The experiments of a gene are ordered energy grids first, then by decreasing experiment id, then by file name.
+    Lookups by gene, by (gene, plane, time point) and by (plane, time point) are dictionary accesses.
+
+    Attributes
+    ----------
+    root:
+        the folder indexed
+    path:
+        the json file of the index
+    entries:
+        file name -> entry dict (see `parse_grid_filename`, plus `size` and `mtime`)
+    '''
+    index_file = ".ish_index.json"
+    version = 3
+    # A folder listed this close to its last change could change again within its mtime resolution without changing it
+    racy_ns = 2 * 10**9
+
+    def __init__(self, root: str, persist: bool=True, index_path: str=None) -> None:
+        self.root = root
+        self.persist = persist
+        self.path = os.path.join(root, self.index_file) if index_path is None else index_path
+        self.entries = {}  # type: Dict[str, Dict[str, Any]]
+        self._root_mtime = None  # type: Optional[int]
+        self._racy = True
+        self._lock = threading.Lock()
+        self._load()
+        self.refresh()
+
+    def _load(self) -> None:
+        if not self.persist or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                info = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.debug("Ignoring unreadable index %s: %s" % (self.path, e))
+            return
+        if info.get("version") == self.version:
+            self.entries = info["entries"]
+            self._root_mtime = info["root_mtime"]
+            self._racy = info["racy"]
+
+    def save(self) -> None:
+        """Writes the index (silently skipped if its folder is read-only)
+
+        An existing index is rewritten in place, which does not change the mtime of the folder. A reader racing with
+        the write finds an invalid file and lists the folder again.
+        """
+        try:
+            with open(self.path, "w") as f:
+                json.dump({"version": self.version, "root_mtime": self._root_mtime, "racy": self._racy,
+                           "entries": self.entries}, f)
+        except OSError as e:
+            logging.debug("Could not save the index %s: %s" % (self.path, e))
+
+    def refresh(self, force: bool=False) -> int:
+        """Updates the index with the files added, removed or modified since the last scan
+
+        Args
+        ----
+        force: bool
+            list and stat the folder even if its mtime did not change
+
+        Returns
+        -------
+        n_parsed: int
+            the number of new or modified files that were parsed
+
+        """
+        root_mtime = os.stat(self.root).st_mtime_ns
+        # A file added in the same mtime tick as the last listing would not change the mtime of the folder
+        racy = time.time_ns() - root_mtime < self.racy_ns
+        entries = {}  # type: Dict[str, Dict[str, Any]]
+        n_parsed = 0
+
+        def update(name: str, stat: os.stat_result) -> None:
+            nonlocal n_parsed
+            entry = self.entries.get(name)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                entry = parse_grid_filename(name)
+                entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime_ns
+                n_parsed += 1
+            entries[name] = entry
+
+        if root_mtime == self._root_mtime and not self._racy and not force:
+            # No file was added, removed or renamed: only check the indexed files for in place rewrites
+            for name in self.entries:
+                try:
+                    update(name, os.stat(os.path.join(self.root, name)))
+                except FileNotFoundError:
+                    pass
+        else:
+            with os.scandir(self.root) as it:
+                for dir_entry in it:
+                    name = dir_entry.name
+                    if not (name.endswith(".zip") and "_" in name) or not dir_entry.is_file():
+                        continue
+                    update(name, dir_entry.stat())
+        changed = n_parsed > 0 or len(entries) != len(self.entries) or root_mtime != self._root_mtime or racy != self._racy
+        self.entries = entries
+        self._root_mtime, self._racy = root_mtime, racy
+        self._group()
+        if self.persist and changed:
+            self.save()
+        logging.debug("Indexed %i files in %s (%i parsed)" % (len(entries), self.root, n_parsed))
+        return n_parsed
+
+    def add(self, path: str) -> Dict[str, Any]:
+        """Adds a file just written in the root (e.g. a download) without rescanning the folder or regrouping the index
+        """
+        stat = os.stat(path)
+        entry = parse_grid_filename(path)
+        entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime_ns
+        with self._lock:
+            replaced = entry["file"] in self.entries
+            self.entries[entry["file"]] = entry
+            if replaced:
+                self._group()
+            else:
+                self._insert(entry)
+        return entry
+
+    def _insert(self, entry: Dict[str, Any]) -> None:
+        for group in (self._by_gene.setdefault(entry["gene"], []),
+                      self._by_experiment.setdefault((entry["gene"], entry["plane"], entry["time_point"]), [])):
+            position = len(group)
+            while position > 0 and _preference(group[position - 1]) < _preference(entry):
+                position -= 1
+            group.insert(position, entry)
+        genes = self._by_plane_time.setdefault((entry["plane"], entry["time_point"]), {})
+        if entry["gene"] not in genes or _preference(genes[entry["gene"]]) < _preference(entry):
+            genes[entry["gene"]] = entry
+
+    def _group(self) -> None:
+        # Preferred experiment first
+        ordered = sorted(self.entries.values(), key=_preference, reverse=True)
+        self._by_gene = {}  # type: Dict[str, List[Dict[str, Any]]]
+        self._by_experiment = {}  # type: Dict[Tuple[str, Any, Any], List[Dict[str, Any]]]
+        self._by_plane_time = {}  # type: Dict[Tuple[Any, Any], Dict[str, Dict[str, Any]]]
+        for entry in ordered:
+            self._by_gene.setdefault(entry["gene"], []).append(entry)
+            self._by_experiment.setdefault((entry["gene"], entry["plane"], entry["time_point"]), []).append(entry)
+            self._by_plane_time.setdefault((entry["plane"], entry["time_point"]), {}).setdefault(entry["gene"], entry)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, gene: Any) -> bool:
+        return gene in self._by_gene
+
+    @property
+    def genes(self) -> List[str]:
+        return list(self._by_gene)
+
+    def file_path(self, entry: Dict[str, Any]) -> str:
+        return os.path.join(self.root, entry["file"])
+
+    def experiments(self, gene: str, plane: str=None, time_point: str=None) -> List[Dict[str, Any]]:
+        """All the experiments of a gene, preferred first (see `_preference`), optionally of a given plane and time point
+        """
+        if plane is None and time_point is None:
+            return list(self._by_gene.get(gene, []))
+        if plane is not None and time_point is not None:
+            return list(self._by_experiment.get((gene, plane, time_point), []))
+        return [e for e in self._by_gene.get(gene, [])
+                if (plane is None or e["plane"] == plane) and (time_point is None or e["time_point"] == time_point)]
+
+    def most_recent(self, gene: str, plane: str="coronal", time_point: str=None) -> Optional[Dict[str, Any]]:
+        """The energy grid with the largest id of a gene in a plane (and time point), None if there is not one
+        (another kind of grid is returned only if there is no energy grid)
+        """
+        found = self.experiments(gene, plane, time_point)
+        return found[0] if found else None
+
+    def select(self, plane: str, time_point: str) -> Dict[str, Dict[str, Any]]:
+        """The preferred experiment of every gene for a plane and time point, e.g. `select("sagittal", "P56")`
+        """
+        return dict(self._by_plane_time.get((plane, time_point), {}))
+
 
 class ISHLoader:
     def __init__(self, root: str, adu_or_dev: str="adult",
-                 time_point: str="P56", priority: List[str]=["coronal", "sagittal"]) -> None:
+                 time_point: str="P56", priority: List[str]=["coronal", "sagittal"], cache_bytes: int=2**30,
+                 index_path: str=None) -> None:
         self.root = root
         self.adu_or_dev = adu_or_dev
         self.time_point = time_point
         self.priority = priority
-        self.regex_list = [re.compile("(.*?)%s(.*?).zip" % i) for i in self.priority]
         assert os.path.isdir(self.root), "%s is not a folder" % self.root
         self._fetcher = ISHFetcher()
         self.index = {}  # type: Dict[str, str]
-        self._build_index()
-        self._cache = LimitedSizeDict(size_limit=300)  # type: LimitedSizeDict
+        with timer("ishloader.index", root=root):
+            self.files = ISHIndex(self.root, index_path=index_path)
+            self._build_index()
+        self._cache = LRUCache(max_bytes=cache_bytes)  # type: LRUCache
+        self._remote = {}  # type: Dict[str, Optional[Tuple[str, int]]]
 
     def _build_index(self) -> None:
-        """Build dict gene->file
+        """Build dict gene->file choosing, in the first plane of `priority` that has one, the most recent experiment
+        (of `time_point` if there is one)
         """
         self.duplicates = []  # type: List[str]
-        file_list = glob.glob(os.path.join(self.root, "*_*.zip"))
-        if file_list == []:
-            return
-        all_genes, all_paths = zip(*[(os.path.split(i)[-1].split("_")[0], i) for i in file_list])
-        for n, regex in enumerate(self.regex_list[::-1]):
-            for i, (path, gene) in enumerate(zip(all_paths, all_genes)):
-                if regex.match(path):
-                    if gene in self:
-                        self.duplicates.append(gene)
-                    self.index[all_genes[i]] = path
+        for gene in self.files.genes:
+            for sag_or_cor in self.priority:
+                found = self.files.experiments(gene, sag_or_cor, self.time_point) or self.files.experiments(gene, sag_or_cor)
+                if found:
+                    self.index[gene] = self.files.file_path(found[0])
+                    break
+            if len([e for e in self.files.experiments(gene) if e["plane"] in self.priority]) > 1:
+                self.duplicates.append(gene)
         logging.debug("%i duplicates were found" % len(self.duplicates))
 
     def __contains__(self, value: Any) -> bool:
         return value in self.index
 
+    def resolve(self, genes: Iterable[str]) -> Dict[str, Optional[Tuple[str, int]]]:
+        """Finds with a few batched queries the experiment that would be downloaded for each missing gene
+
+        After this call `__getitem__` downloads the missing genes directly, without querying again.
+
+        Returns
+        -------
+        resolved: dict
+            gene -> (plane, id) of the most recent experiment in the first plane of `priority`
+            that has one, or None if the gene is not available
+
+        """
+        missing = [gene for gene in genes if gene not in self and gene not in self._remote]
+        found = self._fetcher.find_ids_batch(missing, planes=self.priority, adu_or_dev=self.adu_or_dev,
+                                             time_points=[self.time_point])
+        for gene, experiments in found.items():
+            self._remote[gene] = None
+            for sag_or_cor in self.priority[::-1]:
+                recent = [i["id"] for i in experiments if i["plane"] == sag_or_cor]
+                if recent:
+                    self._remote[gene] = (sag_or_cor, recent[0])
+        return {gene: self._remote.get(gene) for gene in missing}
+
     def __getitem__(self, value: str) -> np.ndarray:
-        if value in self._cache:
-            return self._cache[value]
-        elif value in self:
+        vol_data = self._cache.get(value)
+        if vol_data is not None:
+            count("ishloader.cache.hit")
+            return vol_data
+        count("ishloader.cache.miss")
+        if value in self:
             path = self.index[value]
             vol_data = bm.AllenVolumetricData(filename=path)
             self._cache[value] = vol_data
             return vol_data
+        elif value in self._remote:
+            if self._remote[value] is None:
+                raise KeyError("gene %s is not available in root or for dowload in the Allen Brain Atlas" % value)
+            sag_or_cor, idd = self._remote[value]
+            output_path = os.path.join(self.root, "%s_%s_%s_%s.zip" % (value, sag_or_cor, self.time_point, idd))
+            self._fetcher._download_grid(idd, output_path)
+            self.files.add(output_path)
+            self.index[value] = output_path
+            vol_data = bm.AllenVolumetricData(filename=self.index[value])
+            self._cache[value] = vol_data
+            return vol_data
         else:
             logging.debug("%s was not in root, attempting dowload" % value)
             for sag_or_cor in self.priority:
@@ -213,6 +768,107 @@ class ISHLoader:
                                                                  adu_or_dev=self.adu_or_dev, time_point=self.time_point)
                 if output_path and isinstance(output_path, str):
                     logging.debug("%s slicing derived dataset was found" % sag_or_cor)
+                    self.files.add(output_path)
                     self.index[value] = output_path
-                    return bm.AllenVolumetricData(filename=self.index[value])
+                    vol_data = bm.AllenVolumetricData(filename=self.index[value])
+                    self._cache[value] = vol_data
+                    return vol_data
             raise KeyError("gene %s is not available in root or for dowload in the Allen Brain Atlas" % value)
+
+    def _load_status(self, gene: str, download: bool) -> Tuple[str, Optional[np.ndarray]]:
+        if gene in self or gene in self._cache:
+            status = "local"
+        elif not download:
+            return "unavailable", None
+        else:
+            status = "downloaded"
+        try:
+            return status, self[gene][:, :, :]
+        except KeyError:
+            return "unavailable", None
+
+    def iter_many(self, genes: Iterable[str], n_workers: int=8, prefetch: int=16, download: bool=True,
+                  use_processes: bool=False) -> Iterator[Tuple[str, str, Optional[np.ndarray]]]:
+        """Loads many genes concurrently, yielding them in order while up to `prefetch` genes are loaded ahead
+
+        Args
+        ----
+        genes: iterable of str
+            the genes to load
+        n_workers: int
+            size of the worker pool
+        prefetch: int
+            number of genes submitted ahead of the one being yielded
+        download: bool
+            download the genes that are not in root (resolved first with a few batched queries)
+        use_processes: bool
+            decode the local files in a process pool instead of threads
+
+        Yields
+        ------
+        gene, status, values:
+            status is `local`, `downloaded` or `unavailable` (values is None)
+
+        """
+        genes = list(genes)
+        if download:
+            missing = [gene for gene in genes if gene not in self and gene not in self._remote]
+            if missing:
+                self.resolve(missing)
+        threads = ThreadPoolExecutor(max_workers=n_workers)
+        processes = ProcessPoolExecutor(max_workers=n_workers) if use_processes else None
+        pending = deque()  # type: deque
+        try:
+            for n in range(len(genes) + prefetch):
+                if n < len(genes):
+                    gene = genes[n]
+                    if processes is not None and gene in self and gene not in self._cache:
+                        pending.append((gene, True, processes.submit(_decode_grid, self.index[gene])))
+                    else:
+                        pending.append((gene, False, threads.submit(self._load_status, gene, download)))
+                if n >= prefetch and pending:
+                    gene, decoded, future = pending.popleft()
+                    if decoded:
+                        yield gene, "local", future.result()
+                    else:
+                        yield (gene,) + future.result()
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+            threads.shutdown()
+            if processes is not None:
+                processes.shutdown()
+
+    def load_many(self, genes: Iterable[str], n_workers: int=8, download: bool=True,
+                  use_processes: bool=False) -> Tuple[np.ndarray, Dict[str, str]]:
+        """Loads many genes concurrently in a single preallocated array
+
+        Args
+        ----
+        genes: iterable of str
+            the genes to load
+        n_workers, download, use_processes:
+            as in `iter_many`
+
+        Returns
+        -------
+        values: np.ndarray
+            (len(genes), X, Y, Z) float32 array, filled with nan for the unavailable genes
+        status: dict
+            gene -> `local`, `downloaded` or `unavailable`
+
+        """
+        genes = list(genes)
+        values = None  # type: np.ndarray
+        status = {}  # type: Dict[str, str]
+        for n, (gene, gene_status, volume) in enumerate(self.iter_many(genes, n_workers=n_workers, prefetch=2 * n_workers,
+                                                                        download=download, use_processes=use_processes)):
+            status[gene] = gene_status
+            if volume is None:
+                continue
+            if values is None:
+                values = np.full((len(genes),) + volume.shape, np.nan, dtype=np.float32)
+            values[n] = volume
+        if values is None:
+            raise KeyError("none of the %i genes is available" % len(genes))
+        return values, status
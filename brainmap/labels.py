@@ -0,0 +1,160 @@
+import numpy as np
+import os
+import tempfile
+from typing import *
+
+
+def unique_labels(array1d: np.ndarray, chunk_size: int=2**22) -> np.ndarray:
+    """The sorted unique entries of a 1d array, computed `chunk_size` entries at a time
+    """
+    if len(array1d) == 0:
+        return np.unique(array1d)
+    return np.unique(np.concatenate([np.unique(array1d[i:i + chunk_size]) for i in range(0, len(array1d), chunk_size)]))
+
+
+def encode_labels(array1d: np.ndarray, out: np.ndarray=None, ids: np.ndarray=None,
+                  chunk_size: int=2**22) -> Tuple[np.ndarray, np.ndarray]:
+    """Equivalent of `np.unique(array1d, return_inverse=True)` that stores the inverse in the narrowest unsigned dtype
+
+    The ids are collected and the voxels encoded `chunk_size` at a time, so that besides `out` only a few chunks
+    are allocated (np.unique would sort a full int64 copy).
+
+    Args
+    ----
+    array1d: np.ndarray
+        the raw labels (structure ids)
+    out: np.ndarray
+        optional 1d array receiving the label indexes (e.g. a flat view of a memory-map),
+        it must have a dtype wide enough for `len(ids) - 1`
+    ids: np.ndarray
+        the result of `unique_labels`, if already known
+
+    Returns
+    -------
+    ids: np.ndarray
+        the sorted unique labels
+    inverse: np.ndarray
+        the index in ids of every entry (uint8 for up to 256 labels, uint16 up to 65536, ...)
+
+    """
+    if ids is None:
+        ids = unique_labels(array1d, chunk_size)
+    if out is None:
+        out = np.empty(len(array1d), dtype=np.min_scalar_type(max(len(ids) - 1, 0)))
+    for i in range(0, len(array1d), chunk_size):
+        out[i:i + chunk_size] = np.searchsorted(ids, array1d[i:i + chunk_size])
+    return ids, out
+
+
+class LabelIndex:
+    ''' Spatial index of a volume of label indexes
+
+    Voxel counts and bounding boxes of every label are computed in a single chunked pass.
+    The flat indexes (C order) of the voxels of every label are sorted by label with a counting sort
+    the first time they are requested, so that the voxels of a label are a slice of one array.
+
+    Attributes
+    ----------
+    shape:
+        the shape of the volume
+    counts:
+        (n_labels,) number of voxels of each label
+    bbox_min, bbox_max:
+        (n_labels, 3) inclusive bounding box of each label (bbox_min > bbox_max for absent labels)
+    '''
+    def __init__(self, labels: np.ndarray, n_labels: int=None, chunk_size: int=2**22) -> None:
+        self._labels = labels
+        self.shape = tuple(labels.shape)
+        self.chunk_size = chunk_size
+        self.n_labels = int(labels.max()) + 1 if n_labels is None else n_labels
+        self.counts = np.zeros(self.n_labels, dtype=np.int64)
+        presence = [np.zeros(self.n_labels * n, dtype=bool) for n in self.shape]
+        for start, stop in self._slabs():
+            slab = np.asarray(labels[start:stop]).astype(np.intp)
+            self.counts += np.bincount(slab.ravel(), minlength=self.n_labels)
+            coordinates = np.ix_(np.arange(start, stop), np.arange(self.shape[1]), np.arange(self.shape[2]))
+            for axis, coordinate in enumerate(coordinates):
+                bins = slab * self.shape[axis] + coordinate
+                presence[axis] |= np.bincount(bins.ravel(), minlength=len(presence[axis])) > 0
+        self.bbox_min = np.zeros((self.n_labels, 3), dtype=np.int64)
+        self.bbox_max = np.full((self.n_labels, 3), -1, dtype=np.int64)
+        present = self.counts > 0
+        for axis, axis_presence in enumerate(presence):
+            axis_presence = axis_presence.reshape(self.n_labels, self.shape[axis])
+            self.bbox_min[present, axis] = np.argmax(axis_presence[present], axis=1)
+            self.bbox_max[present, axis] = self.shape[axis] - 1 - np.argmax(axis_presence[present, ::-1], axis=1)
+        self._flat = None  # type: np.ndarray
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def _slabs(self) -> Iterator[Tuple[int, int]]:
+        step = max(1, self.chunk_size // max(1, self.shape[1] * self.shape[2]))
+        for start in range(0, self.shape[0], step):
+            yield start, min(start + step, self.shape[0])
+
+    @property
+    def flat(self) -> np.ndarray:
+        """The C order flat indexes of all the voxels, sorted by label and then by position
+        """
+        if self._flat is None:
+            flat = np.empty(int(self.starts[-1]), dtype=np.min_scalar_type(max(self.starts[-1] - 1, 0)))
+            cursor = self.starts[:-1].copy()
+            plane = self.shape[1] * self.shape[2]
+            for start, stop in self._slabs():
+                slab = np.asarray(self._labels[start:stop]).ravel()
+                order = np.argsort(slab, kind="stable")
+                chunk_counts = np.bincount(slab, minlength=self.n_labels)
+                chunk_starts = np.cumsum(chunk_counts) - chunk_counts
+                sorted_labels = slab[order]
+                destination = cursor[sorted_labels] + np.arange(len(order)) - chunk_starts[sorted_labels]
+                flat[destination] = order + start * plane
+                cursor += chunk_counts
+            self._flat = flat
+        return self._flat
+
+    def voxels(self, label: int) -> np.ndarray:
+        """Sorted C order flat indexes of the voxels of a label, a view costing O(1)
+        """
+        return self.flat[self.starts[label]:self.starts[label + 1]]
+
+    def coordinates(self, label: int) -> Tuple[np.ndarray, ...]:
+        """The (i, j, k) coordinates of the voxels of a label, usable as `volume[coordinates]`
+        """
+        return np.unravel_index(self.voxels(label), self.shape)
+
+    def bbox(self, labels: Union[int, Sequence[int]]) -> Optional[Tuple[slice, ...]]:
+        """The slices cropping the union of the bounding boxes of one or more labels (None if they are absent)
+        """
+        labels = np.atleast_1d(labels)
+        labels = labels[self.counts[labels] > 0]
+        if len(labels) == 0:
+            return None
+        low, high = self.bbox_min[labels].min(0), self.bbox_max[labels].max(0)
+        return tuple(slice(int(a), int(b) + 1) for a, b in zip(low, high))
+
+    def save(self, path: str) -> None:
+        arrays = {"counts": self.counts, "bbox_min": self.bbox_min, "bbox_max": self.bbox_max,
+                  "shape": np.array(self.shape)}
+        if self._flat is not None:
+            arrays["flat"] = self._flat
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".",
+                                        suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str, labels: np.ndarray) -> "LabelIndex":
+        self = cls.__new__(cls)
+        with np.load(path) as f:
+            self.counts, self.bbox_min, self.bbox_max = f["counts"], f["bbox_min"], f["bbox_max"]
+            self.shape = tuple(int(i) for i in f["shape"])
+            self._flat = f["flat"] if "flat" in f else None
+        self._labels = labels
+        self.n_labels = len(self.counts)
+        self.chunk_size = 2**22
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)])
+        return self
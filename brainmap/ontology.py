@@ -0,0 +1,190 @@
+import numpy as np
+import os
+import json
+import tempfile
+import logging
+from typing import *
+
+ONTOLOGY_CACHE_VERSION = 1
+STRUCTURE_GRAPH_IDS = {"adult": 1, "development": 17}
+
+
+def default_cache_dir() -> str:
+    """The folder where brainmap keeps its local caches (`$BRAINMAP_CACHE` or `~/.brainmap`)
+    """
+    return os.environ.get("BRAINMAP_CACHE", os.path.join(os.path.expanduser("~"), ".brainmap"))
+
+
+class OntologyTable:
+    ''' Array-backed structure ontology
+
+    One row per structure, in the order returned by the Allen Brain Atlas api.
+    The full structure records are kept as a json blob and only decoded when a structure object is requested.
+
+    Attributes
+    ----------
+    ids:
+        structure ids
+    parent:
+        row index of the parent structure (-1 for the root)
+    depth:
+        depth in the hierarchy
+    color:
+        (n, 3) uint8 RGB colors
+    acronym:
+        structure acronyms
+    '''
+    def __init__(self, ids: np.ndarray, parent: np.ndarray, depth: np.ndarray, color: np.ndarray,
+                 acronym: np.ndarray, records_json: bytes) -> None:
+        self.ids = ids
+        self.parent = parent
+        self.depth = depth
+        self.color = color
+        self.acronym = acronym
+        self._records_json = records_json
+        self._records = None  # type: List[Dict[str, Any]]
+        self._sorter = np.argsort(ids)
+        self._children = None  # type: Tuple[np.ndarray, np.ndarray]
+        self._tour = None  # type: Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "OntologyTable":
+        ids = np.array([i["id"] for i in records], dtype=np.int64)
+        row_of = {idd: n for n, idd in enumerate(ids)}
+        parent = np.array([row_of.get(i["parent_structure_id"], -1) for i in records], dtype=np.int32)
+        depth = np.array([i["depth"] for i in records], dtype=np.int16)
+        color = np.array([[int(i["color_hex_triplet"][k:k + 2], 16) for k in (0, 2, 4)] for i in records], dtype=np.uint8)
+        acronym = np.array([i["acronym"] for i in records])
+        table = cls(ids, parent, depth, color, acronym, json.dumps(records).encode())
+        table._records = records
+        return table
+
+    @classmethod
+    def fetch(cls, graph: str="adult") -> "OntologyTable":
+        """Downloads the ontology from the Allen Brain Atlas api
+        """
+        from allensdk.api.queries.ontologies_api import OntologiesApi
+        records = OntologiesApi().get_structures(structure_graph_ids=STRUCTURE_GRAPH_IDS[graph], num_rows='all')
+        return cls.from_records(records)
+
+    @classmethod
+    def load(cls, path: str) -> "OntologyTable":
+        with np.load(path) as f:
+            if int(f["version"]) != ONTOLOGY_CACHE_VERSION:
+                raise ValueError("%s has version %i instead of %i" % (path, f["version"], ONTOLOGY_CACHE_VERSION))
+            return cls(f["ids"], f["parent"], f["depth"], f["color"], f["acronym"], f["records"].tobytes())
+
+    def save(self, path: str) -> None:
+        """Writes the table under a unique temporary name and renames it, so that processes saving at once do not clash
+        """
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, version=ONTOLOGY_CACHE_VERSION, ids=self.ids, parent=self.parent, depth=self.depth,
+                         color=self.color, acronym=self.acronym, records=np.frombuffer(self._records_json, dtype=np.uint8))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def cached(cls, graph: str="adult", cache_dir: str=None, refresh: bool=False) -> "OntologyTable":
+        """Loads the ontology from the local cache, downloading and saving it if missing, outdated or if `refresh`
+        """
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        path = os.path.join(cache_dir, "ontology_%s.npz" % graph)
+        if not refresh and os.path.exists(path):
+            try:
+                return cls.load(path)
+            except ValueError as e:
+                logging.debug("Ontology cache is outdated: %s" % e)
+        table = cls.fetch(graph)
+        table.save(path)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def records(self) -> List[Dict[str, Any]]:
+        if self._records is None:
+            self._records = json.loads(self._records_json.decode())
+        return self._records
+
+    def index_of(self, ids: Any) -> np.ndarray:
+        """Returns the row index of each structure id (-1 for the ids not in the ontology)
+        """
+        ids = np.asarray(ids)
+        pos = np.searchsorted(self.ids, ids, sorter=self._sorter).clip(0, len(self.ids) - 1)
+        rows = self._sorter[pos]
+        return np.where(self.ids[rows] == ids, rows, -1)
+
+    def children(self, row: int) -> np.ndarray:
+        """Returns the row indexes of the children of a row
+        """
+        if self._children is None:
+            order = np.argsort(self.parent, kind="stable")
+            offsets = np.searchsorted(self.parent[order], np.arange(len(self) + 1))
+            self._children = (order, offsets)
+        order, offsets = self._children
+        return order[offsets[row]:offsets[row + 1]]
+
+    @property
+    def tour(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Euler tour intervals of the hierarchy
+
+        Returns
+        -------
+        preorder: np.ndarray
+            the rows in depth-first order
+        enter: np.ndarray
+            position of each row in preorder
+        exit: np.ndarray
+            enter + size of the subtree of each row, so that the descendants (self included) of a row r
+            are `preorder[enter[r]:exit[r]]` and s descends from r iff enter[r] <= enter[s] < exit[r]
+
+        """
+        if self._tour is None:
+            preorder = np.zeros(len(self), dtype=np.int32)
+            enter = np.zeros(len(self), dtype=np.int32)
+            exit = np.zeros(len(self), dtype=np.int32)
+            position = 0
+            stack = [(int(r), False) for r in np.where(self.parent < 0)[0][::-1]]
+            while stack:
+                row, done = stack.pop()
+                if done:
+                    exit[row] = position
+                    continue
+                preorder[position] = row
+                enter[row] = position
+                position += 1
+                stack.append((row, True))
+                stack.extend((int(c), False) for c in self.children(row)[::-1])
+            self._tour = (preorder, enter, exit)
+        return self._tour
+
+    def is_descendant(self, rows: Any, ancestor_rows: Any) -> np.ndarray:
+        """True where rows descend from (or are) ancestor_rows, broadcasting the two. Negative rows are never descendants
+        """
+        preorder, enter, exit = self.tour
+        rows = np.asarray(rows)
+        ancestor_rows = np.asarray(ancestor_rows)
+        position = enter[rows]
+        return (rows >= 0) & (ancestor_rows >= 0) & (enter[ancestor_rows] <= position) & (position < exit[ancestor_rows])
+
+    def descendants(self, row: int) -> np.ndarray:
+        """Returns the rows of the subtree of a row (itself included)
+        """
+        preorder, enter, exit = self.tour
+        return preorder[enter[row]:exit[row]]
+
+    def subtree_sum(self, values: np.ndarray) -> np.ndarray:
+        """Sums over the last axis the values of every row and all its descendants with one prefix sum over the tour
+        """
+        preorder, enter, exit = self.tour
+        cumulative = np.zeros(values.shape[:-1] + (len(self) + 1,))
+        np.cumsum(values[..., preorder], axis=-1, out=cumulative[..., 1:])
+        return cumulative[..., exit] - cumulative[..., enter]
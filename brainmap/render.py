@@ -0,0 +1,122 @@
+import numpy as np
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+from brainmap.utils import LRUCache
+
+
+class SliceRenderer:
+    ''' Renders display-ready coronal (axis 0) and sagittal (axis 2) slices of a volume and caches them
+
+    Label volumes with a reference are colored through the uint8 `color_lut` of the volume, other volumes (label
+    volumes without a reference included, as label indexes) are returned as float slices to display in gray.
+    Sagittal slices are transposed as they are displayed. After every request the neighbouring slices
+    are rendered in a background thread, so that scrolling through the volume hits the cache.
+
+    Attributes
+    ----------
+    vol_data:
+        the AllenVolumetricData rendered
+    prefetch:
+        number of slices rendered ahead on each side of the requested one
+    '''
+    def __init__(self, vol_data: Any, max_bytes: int=2**28, prefetch: int=2) -> None:
+        self.vol_data = vol_data
+        self.prefetch = prefetch
+        self.cache = LRUCache(max_bytes=max_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = set()  # type: Set[Tuple[int, int]]
+        self._lock = threading.Lock()
+
+    @property
+    def colored(self) -> bool:
+        """True if the slices are RGB (a label volume with a reference), False if they are values to map in gray
+        """
+        return bool(self.vol_data.is_label and self.vol_data.reference is not None)
+
+    def render(self, axis: int, index: int) -> np.ndarray:
+        some_slice = [slice(None)] * 3  # type: List[Any]
+        some_slice[axis] = index
+        section = self.vol_data[tuple(some_slice)]
+        if self.colored:
+            section = self.vol_data.color_lut[section]
+        else:
+            section = np.array(section, dtype=float)
+        if axis == 2:
+            section = np.ascontiguousarray(np.swapaxes(section, 0, 1))
+        return section
+
+    def __getitem__(self, key: Tuple[int, int]) -> np.ndarray:
+        axis, index = key
+        rendered = self.cache.get(key)
+        if rendered is None:
+            rendered = self.render(axis, index)
+            self.cache[key] = rendered
+        self._schedule_neighbours(axis, index)
+        return rendered
+
+    def _schedule_neighbours(self, axis: int, index: int) -> None:
+        for offset in range(1, self.prefetch + 1):
+            for neighbour in (index + offset, index - offset):
+                key = (axis, neighbour)
+                if 0 <= neighbour < self.vol_data.shape[axis] and key not in self.cache:
+                    with self._lock:
+                        if key in self._pending:
+                            continue
+                        self._pending.add(key)
+                    self._executor.submit(self._prefetch, key)
+
+    def _prefetch(self, key: Tuple[int, int]) -> None:
+        try:
+            if key not in self.cache:
+                self.cache[key] = self.render(*key)
+        except Exception as e:
+            logging.debug("Prefetch of %s failed: %s" % (key, e))
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+class SlideViewer:
+    ''' Coronal and sagittal views of a volume that are updated in place
+
+    The figure, the `imshow` artists, the cursor lines and the contour collections are created once,
+    `update` only swaps their data and asks the canvas to redraw.
+    Use with an interactive matplotlib backend (e.g. `%matplotlib widget`).
+    '''
+    def __init__(self, renderer: SliceRenderer, fig: Any=None, ss: Any=None) -> None:
+        import matplotlib.pyplot as plt
+        from matplotlib.gridspec import GridSpecFromSubplotSpec
+        from matplotlib.collections import LineCollection
+        self.renderer = renderer
+        vol_data = renderer.vol_data
+        self.fig = plt.figure(figsize=(12, 5)) if fig is None else fig
+        if ss is None:
+            ss = plt.GridSpec(1, 1)[0]
+        gs = GridSpecFromSubplotSpec(1, 2, subplot_spec=ss)
+        cmap = None if renderer.colored else "gray"
+        self.axes = [self.fig.add_subplot(gs[0]), self.fig.add_subplot(gs[1])]
+        self.images = [self.axes[0].imshow(renderer[0, 0], cmap=cmap),
+                       self.axes[1].imshow(renderer[2, 0], cmap=cmap)]
+        if not renderer.colored:
+            for image in self.images:
+                image.set_clim(np.min(vol_data[:, :, :]), np.max(vol_data[:, :, :]))
+        self.cursors = [self.axes[0].axvline(0, c='y', lw=1), self.axes[1].axvline(0, c='y', lw=1)]
+        self.contours = [LineCollection([], lw=0.8, colors="w", zorder=1000) for _ in range(2)]
+        for ax, collection in zip(self.axes, self.contours):
+            ax.add_collection(collection)
+
+    def update(self, coronal: int, sagittal: int, contour: bool=False) -> None:
+        self.images[0].set_data(self.renderer[0, coronal])
+        self.images[1].set_data(self.renderer[2, sagittal])
+        self.cursors[0].set_xdata([sagittal, sagittal])
+        self.cursors[1].set_xdata([coronal, coronal])
+        if contour and self.renderer.vol_data.is_label:
+            colored = self.renderer.vol_data.colored
+            self.contours[0].set_segments(colored._slice_contours(0, coronal)[0][..., ::-1])
+            self.contours[1].set_segments(colored._slice_contours(2, sagittal)[0])
+        else:
+            for collection in self.contours:
+                collection.set_segments([])
+        self.fig.canvas.draw_idle()
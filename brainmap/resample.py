@@ -0,0 +1,142 @@
+import numpy as np
+import functools
+from typing import *
+
+# Voxel i of a volume covers [offset + i * spacing, offset + (i + 1) * spacing) in physical coordinates (um),
+# so that a block of f voxels of a fine volume corresponds to one voxel of a volume with f times its spacing.
+
+
+def mode_downsample(labels: np.ndarray, factors: Union[int, Sequence[int]], max_chunk_bytes: int=2**26) -> np.ndarray:
+    """Downsamples a label volume assigning to each block of voxels its most frequent label
+
+    Args
+    ----
+    labels: np.ndarray
+        3d array of small non negative integers (e.g. the `_values` of a label AllenVolumetricData)
+    factors: int or tuple of 3 ints
+        block size along each axis, the last incomplete blocks are reduced over the voxels they contain
+    max_chunk_bytes: int
+        bounds the size of the (blocks, labels) count matrix computed at once
+
+    Returns
+    -------
+    downsampled: np.ndarray
+        array of shape ceil(labels.shape / factors) and the same dtype of labels.
+        Ties are resolved in favour of the smallest label
+
+    """
+    factors = np.broadcast_to(factors, (3,)).astype(int)
+    n_labels = int(labels.max()) + 1
+    out_shape = -(-np.array(labels.shape) // factors)
+    padded_shape = out_shape * factors
+    # Padding voxels get the extra label n_labels, that is excluded from the argmax
+    padded = np.full(padded_shape, n_labels, dtype=np.min_scalar_type(n_labels))
+    padded[:labels.shape[0], :labels.shape[1], :labels.shape[2]] = labels
+    blocks = padded.reshape(out_shape[0], factors[0], out_shape[1], factors[1], out_shape[2], factors[2])
+    blocks = blocks.transpose(0, 2, 4, 1, 3, 5).reshape(-1, int(np.prod(factors)))
+    del padded
+
+    result = np.empty(blocks.shape[0], dtype=labels.dtype)
+    chunk = max(1, max_chunk_bytes // (8 * (n_labels + 1)))
+    for start in range(0, blocks.shape[0], chunk):
+        block_chunk = blocks[start:start + chunk].astype(np.intp)
+        bins = block_chunk + (n_labels + 1) * np.arange(block_chunk.shape[0])[:, None]
+        counts = np.bincount(bins.ravel(), minlength=block_chunk.shape[0] * (n_labels + 1))
+        counts = counts.reshape(block_chunk.shape[0], n_labels + 1)
+        result[start:start + chunk] = np.argmax(counts[:, :n_labels], axis=1)
+    return result.reshape(out_shape)
+
+
+def nearest_upsample(labels: np.ndarray, factors: Union[int, Sequence[int]]) -> np.ndarray:
+    """Upsamples a volume repeating every voxel `factors` times along each axis
+    """
+    factors = np.broadcast_to(factors, (3,)).astype(int)
+    upsampled = labels
+    for axis, factor in enumerate(factors):
+        if factor != 1:
+            upsampled = np.repeat(upsampled, factor, axis=axis)
+    return upsampled
+
+
+@functools.lru_cache(maxsize=64)
+def _axis_maps(src_space: Tuple[Tuple[int, ...], Tuple[float, ...], Tuple[float, ...]],
+               dst_space: Tuple[Tuple[int, ...], Tuple[float, ...], Tuple[float, ...]]) -> Tuple[np.ndarray, ...]:
+    src_shape, src_spacing, src_offset = src_space
+    dst_shape, dst_spacing, dst_offset = dst_space
+    maps = []
+    for n_src, sp_src, off_src, n_dst, sp_dst, off_dst in zip(src_shape, src_spacing, src_offset, dst_shape, dst_spacing, dst_offset):
+        centers = off_dst + (np.arange(n_dst) + 0.5) * sp_dst
+        ix = np.floor((centers - off_src) / sp_src).astype(np.intp)
+        ix[(ix < 0) | (ix >= n_src)] = -1
+        ix.flags.writeable = False
+        maps.append(ix)
+    return tuple(maps)
+
+
+def space_of(vol_data: Any) -> Tuple[Tuple[int, ...], Tuple[float, ...], Tuple[float, ...]]:
+    """Returns (shape, spacing, offset) of an AllenVolumetricData as read from its .mhd header
+    """
+    return (tuple(vol_data.shape),
+            tuple(float(i) for i in vol_data.file_info["ElementSpacing"]),
+            tuple(float(i) for i in vol_data.file_info["Offset"]))
+
+
+def voxel_map(src: Any, dst: Any) -> Tuple[np.ndarray, ...]:
+    """Nearest-neighbour voxel-to-voxel map from the space of `dst` to the one of `src`
+
+    The reference spaces are axis aligned, so the map is separable: `src[np.ix_(*maps)]` has the shape of `dst`.
+    The maps are cached per pair of spaces.
+
+    Args
+    ----
+    src, dst: AllenVolumetricData or (shape, spacing, offset)
+        the volumes (or spaces) to map
+
+    Returns
+    -------
+    maps: tuple of 3 np.ndarray
+        for each axis, the src index of every dst index (-1 where dst falls outside of src)
+
+    """
+    src_space = src if isinstance(src, tuple) else space_of(src)
+    dst_space = dst if isinstance(dst, tuple) else space_of(dst)
+    return _axis_maps(src_space, dst_space)
+
+
+def resample_labels(src: Any, dst: Any, fill: int=0) -> np.ndarray:
+    """Resamples a label AllenVolumetricData in the space of another volume
+
+    When `dst` has an integer multiple of the spacing of `src` the labels are downsampled by majority vote,
+    otherwise each voxel takes the label of the nearest `src` voxel.
+
+    Returns
+    -------
+    resampled: np.ndarray
+        structure ids (not label indexes) with the shape of `dst`, `fill` where dst falls outside of src
+
+    """
+    src_space = space_of(src)
+    dst_space = dst if isinstance(dst, tuple) else space_of(dst)
+    ratio = np.array(dst_space[1]) / np.array(src_space[1])
+    factors = np.round(ratio).astype(int)
+    values = src[:, :, :]
+    if np.all(factors > 1) and np.allclose(ratio, factors):
+        values = mode_downsample(values, factors)
+        src_space = (values.shape, tuple(np.array(src_space[1]) * factors), src_space[2])
+    maps = voxel_map(src_space, dst_space)
+    resampled = src.ids[values[np.ix_(*[np.clip(ix, 0, n - 1) for ix, n in zip(maps, values.shape)])]]
+    outside = (maps[0] < 0)[:, None, None] | (maps[1] < 0)[None, :, None] | (maps[2] < 0)[None, None, :]
+    resampled[outside] = fill
+    return resampled
+
+
+def zoom_labels(labels: np.ndarray, factor: float) -> np.ndarray:
+    """Label-aware equivalent of `scipy.ndimage.zoom`: majority vote for integer reductions, nearest neighbour otherwise
+    """
+    if factor < 1 and np.isclose(1 / factor, np.round(1 / factor)):
+        return mode_downsample(labels, int(np.round(1 / factor)))
+    if factor >= 1 and np.isclose(factor, np.round(factor)):
+        return nearest_upsample(labels, int(np.round(factor)))
+    out_shape = tuple(int(np.round(n * factor)) for n in labels.shape)
+    maps = voxel_map((labels.shape, (1., 1., 1.), (0., 0., 0.)), (out_shape, (1 / factor,) * 3, (0., 0., 0.)))
+    return labels[np.ix_(*[np.clip(ix, 0, n - 1) for ix, n in zip(maps, labels.shape)])]
@@ -0,0 +1,318 @@
+"""Local server keeping the reference, the label volumes and a bounded gene cache warm for many clients
+
+    python -m brainmap.server --root data/ --annotation grid=data/AllenBrain3d/P56_Mouse_gridAnnotation.zip
+
+Clients POST a json list of requests to `/batch` and receive one binary response: a 4 bytes little-endian
+length, a json header and the raw buffers of the arrays, that `BrainmapClient` wraps with `np.frombuffer`
+without copies. The supported requests are
+
+    {"op": "slice", "volume": "grid" or gene, "axis": 0, "index": 30, "rgb": false}
+    {"op": "gene", "gene": "Gad1"}
+    {"op": "experiments", "gene": "Gad1"}
+    {"op": "statistics", "genes": ["Gad1", "Th"], "annotation": "grid", "hierarchical": true}
+    {"op": "structure", "id": 672}
+
+A failed request returns {"error": message} in its position, the others are not affected.
+"""
+import numpy as np
+import sys
+import json
+import socket
+import struct
+import logging
+import argparse
+import http.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import *
+import brainmap as bm
+from brainmap.utils import LRUCache
+
+_ARRAY_KEY = "__array__"
+
+
+def encode_results(results: List[Any]) -> bytes:
+    """Serializes a list of json-like results whose values can be numpy arrays (see the module docstring)
+    """
+    buffers = []  # type: List[np.ndarray]
+
+    def replace(value: Any) -> Any:
+        if isinstance(value, np.ndarray):
+            buffers.append(np.ascontiguousarray(value))
+            return {_ARRAY_KEY: len(buffers) - 1, "dtype": value.dtype.str, "shape": list(value.shape)}
+        if isinstance(value, dict):
+            return {k: replace(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [replace(v) for v in value]
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    header = replace(results)
+    sizes = [b.nbytes for b in buffers]
+    header = json.dumps({"results": header, "sizes": sizes}).encode()
+    return b"".join([struct.pack("<I", len(header)), header] + [b.tobytes() for b in buffers])
+
+
+def decode_results(body: bytes) -> List[Any]:
+    """Inverse of `encode_results`, the arrays are read-only views on the body
+    """
+    view = memoryview(body)
+    length = struct.unpack("<I", view[:4])[0]
+    header = json.loads(bytes(view[4:4 + length]).decode())
+    offsets = np.cumsum([4 + length] + header["sizes"])
+
+    def restore(value: Any) -> Any:
+        if isinstance(value, dict):
+            if _ARRAY_KEY in value:
+                i = value[_ARRAY_KEY]
+                return np.frombuffer(view[offsets[i]:offsets[i + 1]], dtype=value["dtype"]).reshape(value["shape"])
+            return {k: restore(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [restore(v) for v in value]
+        return value
+
+    return restore(header["results"])
+
+
+class BrainmapService:
+    ''' The state shared by the threads of the server: ontology, label volumes, genes and caches
+
+    Label volumes are loaded once (memory-mapped from the sidecar cache if `volume_cache_dir` is given),
+    gene volumes are served from the bounded cache of an ISHLoader (genes missing from root are not downloaded),
+    rendered slices and per-gene statistics have their own caches.
+
+    Attributes
+    ----------
+    reference:
+        the AllenBrainReference
+    annotations:
+        name -> label AllenVolumetricData
+    loader:
+        the ISHLoader of the gene grids (None if no root was given)
+    '''
+    def __init__(self, root: str=None, annotations: Dict[str, str]=None, graph: str="adult", ontology_cache: str=None,
+                 cache_bytes: int=2**30, slice_cache_bytes: int=2**28, volume_cache_dir: str=None) -> None:
+        self.reference = bm.AllenBrainReference(graph=graph, cache_dir=ontology_cache)
+        self.annotations = {name: bm.AllenVolumetricData(path, reference=self.reference, cache_dir=volume_cache_dir)
+                            for name, path in (annotations or {}).items()}  # type: Dict[str, bm.AllenVolumetricData]
+        self.loader = bm.ISHLoader(root, cache_bytes=cache_bytes) if root is not None else None
+        self._slices = LRUCache(max_bytes=slice_cache_bytes)
+        self._statistics = LRUCache(max_bytes=slice_cache_bytes)
+        self._ops = {"slice": self.slice, "gene": self.gene, "experiments": self.experiments,
+                     "statistics": self.statistics, "structure": self.structure}  # type: Dict[str, Callable[..., Any]]
+
+    def volume(self, name: str) -> "bm.AllenVolumetricData":
+        if name in self.annotations:
+            return self.annotations[name]
+        if self.loader is not None and name in self.loader:
+            return self.loader[name]
+        raise KeyError("%s is neither an annotation nor a gene in root" % name)
+
+    def slice(self, volume: str, axis: int, index: int, rgb: bool=False) -> np.ndarray:
+        """A coronal (axis 0), horizontal (1) or sagittal (2) section, as values or as uint8 colors for labels
+        """
+        key = (volume, axis, index, rgb)
+        section = self._slices.get(key)
+        if section is None:
+            vol_data = self.volume(volume)
+            some_slice = [slice(None)] * 3  # type: List[Any]
+            some_slice[axis] = index
+            section = vol_data[tuple(some_slice)]
+            if vol_data.is_label:
+                section = vol_data.color_lut[section] if rgb else vol_data.ids[section]
+            else:
+                section = np.array(section, dtype=np.float32)
+                if vol_data.no_data is not None:
+                    section[vol_data.no_data[tuple(some_slice)]] = np.nan
+            self._slices[key] = section
+        return section
+
+    def gene(self, gene: str) -> np.ndarray:
+        """The float32 grid of a gene, nan where there is no data
+        """
+        return self.volume(gene).masked()
+
+    def experiments(self, gene: str) -> List[Dict[str, Any]]:
+        """The files of a gene in root, most recent first
+        """
+        if self.loader is None:
+            return []
+        return self.loader.files.experiments(gene)
+
+    def statistics(self, genes: List[str], annotation: str, hierarchical: bool=True, threshold: float=0.) -> Dict[str, Any]:
+        """Per-structure statistics of genes (see `structure_statistics`), computed once per gene and cached
+        """
+        labels = self.annotations[annotation]
+        rows = {g: self._statistics.get((g, annotation, hierarchical, threshold)) for g in genes}
+        missing = [g for g in rows if rows[g] is None]
+        if missing:
+            result = bm.structure_statistics(np.stack([self.gene(g).ravel() for g in missing]), labels,
+                                             reference=self.reference, threshold=threshold, hierarchical=hierarchical)
+            for i, g in enumerate(missing):
+                rows[g] = (result["ids"], result["mean"][i].copy(), result["fraction"][i].copy(), result["count"][i].copy())
+                self._statistics[(g, annotation, hierarchical, threshold)] = rows[g]
+        if not rows:
+            raise ValueError("no genes were requested")
+        return {"genes": list(genes), "ids": rows[genes[0]][0],
+                "mean": np.stack([rows[g][1] for g in genes]),
+                "fraction": np.stack([rows[g][2] for g in genes]),
+                "count": np.stack([rows[g][3] for g in genes])}
+
+    def structure(self, id: int) -> Dict[str, Any]:
+        """The ontology record of a structure
+        """
+        return self.reference.table.records[int(self.reference.table.index_of(id))] if id in self.reference else {}
+
+    def handle(self, request: Dict[str, Any]) -> Any:
+        request = dict(request)
+        op = request.pop("op", None)
+        if op not in self._ops:
+            raise ValueError("op '%s' is not valid" % op)
+        return self._ops[op](**request)
+
+    def batch(self, requests: List[Dict[str, Any]]) -> List[Any]:
+        results = []
+        for request in requests:
+            try:
+                results.append(self.handle(request))
+            except Exception as e:
+                logging.debug("Request %s failed: %s" % (request, e))
+                results.append({"error": "%s: %s" % (type(e).__name__, e)})
+        return results
+
+    def info(self) -> Dict[str, Any]:
+        return {"annotations": {k: list(v.shape) for k, v in self.annotations.items()},
+                "genes": len(self.loader.index) if self.loader is not None else 0,
+                "gene_cache": self.loader._cache.stats() if self.loader is not None else None,
+                "slice_cache": self._slices.stats(), "statistics_cache": self._statistics.stats()}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None  # type: BrainmapService
+
+    def setup(self) -> None:
+        super().setup()
+        # Headers and body are written separately: without this small responses wait for the delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/info":
+            self._send(200, json.dumps(self.service.info()).encode(), "application/json")
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/batch":
+            self._send(404, b"not found", "text/plain")
+            return
+        try:
+            requests = json.loads(body.decode())
+        except ValueError as e:
+            self._send(400, str(e).encode(), "text/plain")
+            return
+        self._send(200, encode_results(self.service.batch(requests)), "application/octet-stream")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug("%s - %s" % (self.address_string(), format % args))
+
+
+def make_server(service: BrainmapService, host: str="127.0.0.1", port: int=8765) -> ThreadingHTTPServer:
+    """A threading HTTP server for the service (call `serve_forever` on it)
+    """
+    handler = type("Handler", (_Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class BrainmapClient:
+    ''' Client of a local brainmap server, keeping one persistent connection
+
+    The arrays returned are read-only views on the response.
+    '''
+    def __init__(self, host: str="127.0.0.1", port: int=8765, timeout: float=60) -> None:
+        self.host = host
+        self.port = port
+        self._connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def batch(self, requests: List[Dict[str, Any]]) -> List[Any]:
+        """Sends many requests in one round trip, returns their results in order
+        """
+        body = json.dumps(requests).encode()
+        try:
+            self._connection.request("POST", "/batch", body=body, headers={"Content-Type": "application/json"})
+            response = self._connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self._connection.close()
+            raise
+        if response.status != 200:
+            raise IOError("server returned %i: %s" % (response.status, data[:200]))
+        return decode_results(data)
+
+    def _one(self, request: Dict[str, Any]) -> Any:
+        result = self.batch([request])[0]
+        if isinstance(result, dict) and "error" in result and len(result) == 1:
+            raise KeyError(result["error"])
+        return result
+
+    def slice(self, volume: str, axis: int, index: int, rgb: bool=False) -> np.ndarray:
+        return self._one({"op": "slice", "volume": volume, "axis": axis, "index": index, "rgb": rgb})
+
+    def gene(self, gene: str) -> np.ndarray:
+        return self._one({"op": "gene", "gene": gene})
+
+    def experiments(self, gene: str) -> List[Dict[str, Any]]:
+        return self._one({"op": "experiments", "gene": gene})
+
+    def statistics(self, genes: List[str], annotation: str, hierarchical: bool=True, threshold: float=0.) -> Dict[str, Any]:
+        return self._one({"op": "statistics", "genes": list(genes), "annotation": annotation,
+                          "hierarchical": hierarchical, "threshold": threshold})
+
+    def structure(self, id: int) -> Dict[str, Any]:
+        return self._one({"op": "structure", "id": id})
+
+    def info(self) -> Dict[str, Any]:
+        self._connection.request("GET", "/info")
+        return json.loads(self._connection.getresponse().read().decode())
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def main(argv: List[str]=None) -> None:
+    parser = argparse.ArgumentParser(description="Serve brainmap volumes from memory to local clients")
+    parser.add_argument("--root", default=None, help="folder of the gene grids (an ISHLoader root)")
+    parser.add_argument("--annotation", action="append", default=[], metavar="NAME=PATH", help="a label volume to serve")
+    parser.add_argument("--graph", default="adult", help="the structure ontology, adult or development")
+    parser.add_argument("--ontology-cache", default=None, help="folder of the ontology cache")
+    parser.add_argument("--volume-cache", default=None, help="folder of the sidecar cache of the label volumes")
+    parser.add_argument("--cache-bytes", type=int, default=2**30, help="budget of the gene cache")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    annotations = dict(a.split("=", 1) for a in args.annotation)
+    service = BrainmapService(root=args.root, annotations=annotations, graph=args.graph, ontology_cache=args.ontology_cache,
+                              cache_bytes=args.cache_bytes, volume_cache_dir=args.volume_cache)
+    server = make_server(service, args.host, args.port)
+    logging.info("Serving on http://%s:%i" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,239 @@
+import numpy as np
+import os
+import json
+from typing import *
+import brainmap as bm
+
+
+def _hashing_projection(buckets: np.ndarray, signs: np.ndarray, dim: int) -> Any:
+    """Sparse random projection that adds every voxel with a random sign to one of dim buckets
+    """
+    from scipy.sparse import csr_matrix
+    return csr_matrix((signs.astype(np.float32), (np.arange(len(buckets)), buckets)), shape=(len(buckets), dim))
+
+
+def normalize_expression(matrix: np.ndarray) -> np.ndarray:
+    """Standardizes each row over its valid voxels (finite and non negative) and scales it to unit norm
+
+    The no data voxels are set to 0 (the mean), so that the dot product of two rows approximates their
+    correlation over the voxels that are valid in both.
+    """
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+    valid = np.isfinite(matrix) & (matrix >= 0)
+    n_valid = np.maximum(valid.sum(1, keepdims=True), 1)
+    values = np.where(valid, matrix, 0)
+    mean = values.sum(1, keepdims=True) / n_valid
+    centered = np.where(valid, values - mean, 0)
+    norm = np.linalg.norm(centered, axis=1, keepdims=True)
+    norm[norm == 0] = 1
+    return centered / norm
+
+
+class SimilarityIndex:
+    ''' Top-k search of the genes with the most similar spatial expression pattern
+
+    Every gene volume is normalized with `normalize_expression` and optionally reduced with a sparse random
+    projection (each voxel is added with a random sign to one of `dim` buckets) or PCA, then stored as a unit norm
+    row of a memory-mapped float32 matrix. The cosine similarity of the rows approximates the correlation over the
+    valid voxels.
+
+    The index is a folder containing `vectors.f32`, `index.json` and, if reduced, `projection.npz`.
+    New genes can be inserted with `add` using the persisted projection.
+
+    Attributes
+    ----------
+    path:
+        the folder of the index
+    genes:
+        list of gene names, in row order
+    shape:
+        the shape of the gene volumes
+    vectors:
+        (len(genes), dim) np.memmap
+    '''
+    vectors_file = "vectors.f32"
+    index_file = "index.json"
+    projection_file = "projection.npz"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, self.index_file)) as f:
+            info = json.load(f)
+        self.genes = info["genes"]  # type: List[str]
+        self.shape = tuple(info["shape"])  # type: Tuple[int, ...]
+        self.method = info["method"]  # type: Optional[str]
+        self.dim = info["dim"]  # type: int
+        self._gene_ix = {g: i for i, g in enumerate(self.genes)}  # type: Dict[str, int]
+        self.projection = None  # type: Any
+        if self.method is not None:
+            with np.load(os.path.join(path, self.projection_file)) as f:
+                if self.method == "random":
+                    self.projection = _hashing_projection(f["buckets"], f["signs"], self.dim)
+                else:
+                    self.projection = f["components"]
+        self._open()
+
+    def _open(self) -> None:
+        if len(self.genes):
+            self.vectors = np.memmap(os.path.join(self.path, self.vectors_file), dtype="float32", mode="r",
+                                     shape=(len(self.genes), self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype="float32")
+
+    @classmethod
+    def build(cls, source: Any, path: str, method: Optional[str]="random", dim: int=1024,
+              pca_samples: int=2000, chunk_size: int=256, seed: int=0) -> "SimilarityIndex":
+        """Builds the index of all the genes of an ISHLoader root or of an ExpressionStore
+
+        Args
+        ----
+        source: ISHLoader, str or ExpressionStore
+            the grids to index (from an ISHLoader the volumes are read through its cache, masking the no data entries)
+        path: str
+            the output folder, it will be created if it does not exist
+        method: str or None
+            `random` (sparse random projection), `pca` (principal components of up to `pca_samples` genes)
+            or None to keep all the voxels
+        dim: int
+            the number of dimensions after reduction
+        chunk_size: int
+            genes normalized and projected at the same time
+        seed: int
+            seed of the random projection and of the PCA sample
+
+        Returns
+        -------
+        index: SimilarityIndex
+
+        """
+        if isinstance(source, str):
+            source = bm.ISHLoader(source)
+        if isinstance(source, bm.ExpressionStore):
+            source.check_no_data()
+        genes = list(source.genes) if isinstance(source, bm.ExpressionStore) else sorted(source.index)
+        if genes == []:
+            raise ValueError("there are no genes to index")
+
+        def read(chunk: List[str]) -> np.ndarray:
+            if isinstance(source, bm.ExpressionStore):
+                return source.rows(chunk)
+            return np.stack([source[g].masked().ravel() for g in chunk])
+
+        if isinstance(source, bm.ExpressionStore):
+            shape = source.shape
+        else:
+            shape = source[genes[0]].shape
+        n_voxels = int(np.prod(shape))
+        random_state = np.random.RandomState(seed)
+        os.makedirs(path, exist_ok=True)
+        projection = None  # type: Any
+        if method == "random":
+            buckets = random_state.randint(0, dim, n_voxels).astype(np.int32)
+            signs = random_state.choice(np.array([-1, 1], dtype=np.int8), n_voxels)
+            np.savez(os.path.join(path, cls.projection_file), buckets=buckets, signs=signs)
+            projection = _hashing_projection(buckets, signs, dim)
+        elif method == "pca":
+            sample = sorted(random_state.choice(len(genes), min(pca_samples, len(genes)), replace=False))
+            sample_matrix = normalize_expression(read([genes[i] for i in sample]))
+            _, _, components = np.linalg.svd(sample_matrix, full_matrices=False)
+            projection = np.ascontiguousarray(components[:dim].T, dtype=np.float32)
+            np.savez(os.path.join(path, cls.projection_file), components=projection)
+        elif method is not None:
+            raise ValueError("method='%s' is not valid" % method)
+        dim = n_voxels if projection is None else projection.shape[1]
+
+        vectors = np.memmap(os.path.join(path, cls.vectors_file), dtype="float32", mode="w+", shape=(len(genes), dim))
+        for start in range(0, len(genes), chunk_size):
+            vectors[start:start + chunk_size] = cls._embed(read(genes[start:start + chunk_size]), projection)
+        vectors.flush()
+        del vectors
+        cls._write_index(path, genes, shape, method, dim)
+        return cls(path)
+
+    @staticmethod
+    def _embed(matrix: np.ndarray, projection: Optional[np.ndarray]) -> np.ndarray:
+        embedded = normalize_expression(matrix)
+        if projection is not None:
+            embedded = np.asarray(embedded @ projection)
+            norm = np.linalg.norm(embedded, axis=1, keepdims=True)
+            norm[norm == 0] = 1
+            embedded /= norm
+        return embedded.astype(np.float32)
+
+    @classmethod
+    def _write_index(cls, path: str, genes: List[str], shape: Tuple[int, ...], method: Optional[str], dim: int) -> None:
+        index_path = os.path.join(path, cls.index_file)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({"genes": genes, "shape": list(shape), "method": method, "dim": dim}, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    def __contains__(self, gene: Any) -> bool:
+        return gene in self._gene_ix
+
+    def embed(self, volume: Any) -> np.ndarray:
+        """Returns the unit norm vector of a volume (AllenVolumetricData or array with the shape of the index)
+
+        The no data voxels of an AllenVolumetricData are masked as in `build`.
+        """
+        if isinstance(volume, bm.AllenVolumetricData):
+            volume = volume.masked()
+        values = np.asarray(volume, dtype=np.float64).ravel()
+        if values.shape[0] != int(np.prod(self.shape)):
+            raise ValueError("volume has %i voxels instead of %i" % (values.shape[0], np.prod(self.shape)))
+        return self._embed(values[None, :], self.projection)[0]
+
+    def add(self, gene: str, volume: Any) -> None:
+        """Inserts (or replaces) a gene, e.g. after it has been downloaded
+
+        The vectors are memory-mapped read-only, so that an index can be queried without write permission:
+        the row is written to the file and the memory-map reopened.
+        """
+        vector = self.embed(volume)
+        del self.vectors
+        try:
+            if gene in self:
+                with open(os.path.join(self.path, self.vectors_file), "r+b") as f:
+                    f.seek(self._gene_ix[gene] * vector.nbytes)
+                    f.write(vector.tobytes())
+            else:
+                with open(os.path.join(self.path, self.vectors_file), "ab") as f:
+                    f.write(vector.tobytes())
+                self._gene_ix[gene] = len(self.genes)
+                self.genes.append(gene)
+                self._write_index(self.path, self.genes, self.shape, self.method, self.dim)
+        finally:
+            self._open()
+
+    def query(self, query: Any, k: int=10, exclude_self: bool=True) -> List[Tuple[str, float]]:
+        """Returns the k most similar genes
+
+        Args
+        ----
+        query: str, AllenVolumetricData or np.ndarray
+            a gene of the index or a volume
+        k: int
+            the number of results
+        exclude_self: bool
+            if the query is a gene, do not return it
+
+        Returns
+        -------
+        results: list of (gene, similarity)
+            sorted by decreasing similarity
+
+        """
+        if isinstance(query, str):
+            vector = np.asarray(self.vectors[self._gene_ix[query]])
+        else:
+            vector = self.embed(query)
+        scores = np.asarray(self.vectors).dot(vector)
+        skip = self._gene_ix[query] if isinstance(query, str) and exclude_self else -1
+        n = min(k + (skip >= 0), len(scores))
+        if n == 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return [(self.genes[i], float(scores[i])) for i in top if i != skip][:k]
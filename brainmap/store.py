@@ -0,0 +1,153 @@
+import numpy as np
+import os
+import json
+import logging
+from typing import *
+import brainmap as bm
+
+
+def _parse_experiment_id(path: str) -> Optional[int]:
+    """Returns the last purely numeric token of a `gene_..._id.zip` file name (None if there is not one)
+    """
+    tokens = os.path.splitext(os.path.basename(path))[0].split("_")
+    for token in tokens[::-1]:
+        if token.isdigit():
+            return int(token)
+    return None
+
+
+class ExpressionStore:
+    ''' A gene x voxel expression matrix packed in a single memory-mapped float32 file
+
+    The store is a folder containing `expression.f32` (a C-ordered float32 matrix with one row per gene
+    and one column per voxel of the grid) and `index.json` (genes, experiment ids, source files and grid shape).
+    It is built once from an ISHLoader root with `ExpressionStore.build` and reopened as a memory-map,
+    so that scans over all the genes are a single strided read instead of one zip decode per gene.
+
+    Attributes
+    ----------
+    path:
+        the folder containing the store
+    genes:
+        list of gene names, in row order
+    experiment_ids:
+        the Section Data Set id of each row (None if it could not be parsed from the file name)
+    keeps_no_data:
+        True if the no data entries were kept negative (the default), False if they were replaced when packing
+        (None for stores that do not record it)
+    shape:
+        the shape of a single gene volume
+    matrix:
+        np.memmap of shape (len(genes), prod(shape))
+    '''
+    values_file = "expression.f32"
+    index_file = "index.json"
+
+    def __init__(self, path: str, mode: str="r") -> None:
+        self.path = path
+        with open(os.path.join(path, self.index_file)) as f:
+            info = json.load(f)
+        self.shape = tuple(info["shape"])  # type: Tuple[int, ...]
+        self.genes = info["genes"]  # type: List[str]
+        self.experiment_ids = info["experiment_ids"]  # type: List[Optional[int]]
+        self.files = info["files"]  # type: List[str]
+        self.keeps_no_data = info.get("keeps_no_data")  # type: Optional[bool]
+        self._gene_ix = {g: i for i, g in enumerate(self.genes)}  # type: Dict[str, int]
+        if len(self.genes):
+            self.matrix = np.memmap(os.path.join(path, self.values_file), dtype="float32", mode=mode,
+                                    shape=(len(self.genes), int(np.prod(self.shape))))
+        else:
+            self.matrix = np.zeros((0, int(np.prod(self.shape))), dtype="float32")
+
+    @classmethod
+    def build(cls, loader: Any, path: str, remove_negative_entries: bool=False,
+              shape: Tuple[int, ...]=None) -> "ExpressionStore":
+        """Packs every grid indexed by an ISHLoader in a new store
+
+        Args
+        ----
+        loader: ISHLoader, str or dict
+            the loader (or its root folder) whose index will be packed, or a dict gene -> grid file
+        path: str
+            the output folder, it will be created if it does not exist
+        remove_negative_entries: bool
+            passed to AllenVolumetricData. By default the no data entries stay negative, so that the statistics,
+            the enrichment and the similarity index can exclude them; if True they are lost.
+        shape: tuple
+            the shape of the grids, the ones with a different shape are skipped (defaults to the shape of the first)
+
+        Returns
+        -------
+        store: ExpressionStore
+            the newly built store opened read-only
+
+        """
+        if isinstance(loader, str):
+            loader = bm.ISHLoader(loader)
+        index = loader if isinstance(loader, Mapping) else loader.index
+        genes = sorted(index)
+        if genes == []:
+            raise ValueError("there are no grid files to pack in %s" % path)
+        os.makedirs(path, exist_ok=True)
+        # The index is written last so that an interrupted build is never opened as a valid store
+        index_path = os.path.join(path, cls.index_file)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+        if shape is None:
+            shape = bm.AllenVolumetricData(filename=index[genes[0]]).shape
+        shape = tuple(shape)
+        n_voxels = int(np.prod(shape))
+        matrix = np.memmap(os.path.join(path, cls.values_file), dtype="float32", mode="w+", shape=(len(genes), n_voxels))
+        kept = []  # type: List[str]
+        for gene in genes:
+            vol_data = bm.AllenVolumetricData(filename=index[gene], remove_negative_entries=remove_negative_entries)
+            if vol_data.shape != shape:
+                logging.warn("%s has shape %s instead of %s and will be skipped" % (gene, vol_data.shape, shape))
+                continue
+            matrix[len(kept), :] = vol_data[:, :, :].ravel()
+            kept.append(gene)
+        matrix.flush()
+        del matrix
+        if len(kept) < len(genes):
+            with open(os.path.join(path, cls.values_file), "r+b") as f:
+                f.truncate(len(kept) * n_voxels * 4)
+
+        files = [index[g] for g in kept]
+        info = {"shape": list(shape),
+                "genes": kept,
+                "experiment_ids": [_parse_experiment_id(p) for p in files],
+                "files": files,
+                "keeps_no_data": not remove_negative_entries}
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(index_path + ".tmp", index_path)
+        logging.debug("Packed %i genes in %s" % (len(kept), path))
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    def __contains__(self, gene: Any) -> bool:
+        return gene in self._gene_ix
+
+    def __getitem__(self, gene: str) -> np.ndarray:
+        """Returns the volume of a gene as a (read-only) view on the memory-map
+        """
+        return self.row(gene).reshape(self.shape)
+
+    def check_no_data(self) -> None:
+        """Raises ValueError if the no data entries were replaced when packing, so that they cannot be excluded
+        """
+        if self.keeps_no_data is False:
+            raise ValueError("%s was built with remove_negative_entries=True, the no data entries cannot be excluded; "
+                             "rebuild it with the default remove_negative_entries=False" % self.path)
+
+    def row(self, gene: str) -> np.ndarray:
+        return self.matrix[self._gene_ix[gene], :]
+
+    def rows(self, genes: Iterable[str]) -> np.ndarray:
+        """Returns a (len(genes), n_voxels) array with the rows of the genes
+        """
+        ix = np.array([self._gene_ix[g] for g in genes], dtype=int)
+        return self.matrix[ix, :]
@@ -1,4 +1,6 @@
 import numpy as np
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
 
 
 def translation_M(v: np.ndarray) -> np.ndarray:
@@ -55,6 +57,105 @@ def omogeneous_coordinates(x: np.ndarray) -> np.ndarray:
 
 
 def apply_transform(x: np.ndarray, M: np.ndarray) -> np.ndarray:
-    tmp = omogeneous_coordinates(x)
-    tmp = M.dot(tmp)
-    return tmp[:-1, :].T
+    points = x.T if x.shape[0] == 3 else x
+    # Same result of M.dot(omogeneous_coordinates(x)) without stacking a row of ones onto a copy of x
+    return points.dot(M[:3, :3].T) + M[:3, 3]
+
+
+def _sampling_chunk(Minv: np.ndarray, input_shape: Tuple[int, ...], output_shape: Tuple[int, ...],
+                    start: int, stop: int, order: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flat input indexes and weights of the output rows start:stop
+
+    Returns (indexes, weights, inside) of shapes (corners, n), (corners, n) and (n,)
+    """
+    i, j, k = np.meshgrid(np.arange(start, stop), np.arange(output_shape[1]), np.arange(output_shape[2]),
+                          indexing="ij", copy=False)
+    # Source coordinates computed column by column to avoid building the (4, n) omogeneous coordinates
+    coords = [Minv[d, 0] * i + Minv[d, 1] * j + Minv[d, 2] * k + Minv[d, 3] for d in range(3)]
+    strides = (input_shape[1] * input_shape[2], input_shape[2], 1)
+    if order == 0:
+        ix = [np.rint(c).astype(np.intp).ravel() for c in coords]
+        inside = np.ones(ix[0].shape, dtype=bool)
+        for d in range(3):
+            inside &= (ix[d] >= 0) & (ix[d] < input_shape[d])
+            ix[d].clip(0, input_shape[d] - 1, out=ix[d])
+        indexes = (ix[0] * strides[0] + ix[1] * strides[1] + ix[2] * strides[2])[None, :]
+        return indexes, np.ones(indexes.shape), inside
+    base = [np.floor(c).astype(np.intp).ravel() for c in coords]
+    frac = [c.ravel() - b for c, b in zip(coords, base)]
+    inside = np.ones(base[0].shape, dtype=bool)
+    for d in range(3):
+        inside &= (base[d] >= 0) & (base[d] <= input_shape[d] - 1)
+    indexes = np.empty((8, len(base[0])), dtype=np.intp)
+    weights = np.empty((8, len(base[0])))
+    for n, corner in enumerate(np.ndindex(2, 2, 2)):
+        flat = np.zeros(len(base[0]), dtype=np.intp)
+        weight = np.ones(len(base[0]))
+        for d in range(3):
+            flat += np.clip(base[d] + corner[d], 0, input_shape[d] - 1) * strides[d]
+            weight *= frac[d] if corner[d] else 1 - frac[d]
+        indexes[n] = flat
+        weights[n] = weight
+    return indexes, weights, inside
+
+
+def resample_volumes(volumes: Any, M: np.ndarray, output_shape: Tuple[int, ...]=None, order: int=1, cval: float=0,
+                     chunk_rows: int=8, n_threads: int=None) -> np.ndarray:
+    """Warps a stack of volumes with the affine M (e.g. composed from translation_M, rotation_*_M, scale_M, shear_M)
+
+    M maps voxel coordinates of the input volumes to voxel coordinates of the output, as in apply_transform.
+    The output is computed in chunks of `chunk_rows` rows along the first axis across a thread pool;
+    the sampling coordinates and weights of each chunk are computed once and applied to all the volumes.
+
+    Args
+    ----
+    volumes: np.ndarray or list
+        (volumes, X, Y, Z) array or list of 3d arrays / AllenVolumetricData with the same shape
+    M: np.ndarray
+        4x4 affine transform
+    output_shape: tuple
+        shape of the output volumes, defaults to the input shape
+    order: int
+        1 for trilinear interpolation (intensities), 0 for nearest neighbour (labels)
+    cval: float
+        value of the voxels that map outside of the input. Voxel centers are at integer coordinates:
+        with order=0 a voxel is sampled when its source rounds into the grid, so up to half a voxel outside of it;
+        with order=1 it is sampled when its source is in [0, n), the last half-open voxel clamping to n-1.
+        scipy.ndimage.affine_transform(mode="constant") instead blends toward cval past n-1.
+
+    Returns
+    -------
+    warped: np.ndarray
+        (volumes,) + output_shape array, with the dtype of the input for order=0 and float otherwise
+
+    """
+    flat = [np.ascontiguousarray(v[:, :, :]).ravel() for v in volumes]
+    input_shape = tuple(np.shape(volumes[0][:, :, :]))
+    if output_shape is None:
+        output_shape = input_shape
+    Minv = np.linalg.inv(M)
+    dtype = flat[0].dtype if order == 0 else np.result_type(flat[0].dtype, np.float32)
+    out = np.empty((len(flat),) + tuple(output_shape), dtype=dtype)
+
+    def work(start: int) -> None:
+        stop = min(start + chunk_rows, output_shape[0])
+        indexes, weights, inside = _sampling_chunk(Minv, input_shape, output_shape, start, stop, order)
+        for n, values in enumerate(flat):
+            if order == 0:
+                chunk = values[indexes[0]]
+            else:
+                chunk = np.einsum("cn,cn->n", values[indexes], weights)
+            chunk[~inside] = cval
+            out[n, start:stop] = chunk.reshape((stop - start,) + tuple(output_shape[1:]))
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(work, range(0, output_shape[0], chunk_rows)))
+    return out
+
+
+def resample_volume(volume: Any, M: np.ndarray, output_shape: Tuple[int, ...]=None, order: int=1, cval: float=0,
+                    chunk_rows: int=8, n_threads: int=None) -> np.ndarray:
+    """Warps a single volume, see resample_volumes
+    """
+    return resample_volumes([volume], M, output_shape=output_shape, order=order, cval=cval,
+                            chunk_rows=chunk_rows, n_threads=n_threads)[0]
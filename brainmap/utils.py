@@ -1,5 +1,7 @@
 from typing import *
 import numpy as np
+import sys
+import threading
 from collections import OrderedDict
 
 
@@ -19,11 +21,92 @@ class LimitedSizeDict(OrderedDict):
                 self.popitem(last=False)
 
 
+def _nbytes(value: Any) -> int:
+    if isinstance(value, tuple):
+        return sum(_nbytes(i) for i in value)
+    return int(getattr(value, "nbytes", sys.getsizeof(value)))
+
+
+class LRUCache:
+    """Thread-safe least recently used cache bounded by the total `nbytes` of its values and/or their number
+
+    Reads move entries to the most recent end, so the least recently used ones are evicted first.
+    `hits`, `misses` and `evictions` are counted (membership tests with `in` are not).
+    """
+    def __init__(self, max_bytes: int=None, max_items: int=None) -> None:
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # type: OrderedDict
+        self._sizes = {}  # type: Dict[Any, int]
+        self._lock = threading.RLock()
+
+    def get(self, key: Any, default: Any=None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def __getitem__(self, key: Any) -> Any:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                raise KeyError(key)
+            return self.get(key)
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        with self._lock:
+            if key in self._data:
+                self.pop(key)
+            self._data[key] = value
+            self._sizes[key] = _nbytes(value)
+            self.nbytes += self._sizes[key]
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._data and ((self.max_bytes is not None and self.nbytes > self.max_bytes) or
+                              (self.max_items is not None and len(self._data) > self.max_items)):
+            key, _ = self._data.popitem(last=False)
+            self.nbytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        with self._lock:
+            if key not in self._data:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            self.nbytes -= self._sizes.pop(key)
+            return self._data.pop(key)
+
+    def __contains__(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"items": len(self._data), "nbytes": self.nbytes, "max_bytes": self.max_bytes, "max_items": self.max_items,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / requests if requests else None}
+
+
 def one_hot_encoding(array2d: np.ndarray) -> List[np.ndarray]:
     temp = np.array(array2d, dtype=int)
-    labels, temp.flat[:] = np.unique(temp, return_inverse=True)
-    arrays = [np.zeros(temp.shape, dtype=bool) for _ in range(len(labels))]
-    for i in range(temp.shape[0]):
-        for j in range(temp.shape[1]):
-            arrays[temp[i, j]][i, j] = True
-    return arrays
+    labels, inverse = np.unique(temp, return_inverse=True)
+    return list(inverse.reshape(temp.shape)[None, :, :] == np.arange(len(labels))[:, None, None])
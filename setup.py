@@ -11,12 +11,11 @@ setup(
         'numpy',
         'allensdk',
         'matplotlib',
-        'colormap',
         'ipywidgets',
-        'scikit-image',
         'easydev'
     ],
     # scripts=[],
+    entry_points={"console_scripts": ["brainmap-server=brainmap.server:main"]},
     author="Gioele La Manno",
     author_email="gioelelamanno@gmail.com",
     description="AllenBrainAtlas utils module",
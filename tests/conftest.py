@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pytest
+import brainmap as bm
+from brainmap.ontology import OntologyTable
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+GRID_ANNOTATION = os.path.join(DATA, "AllenBrain3d", "P56_Mouse_gridAnnotation.zip")
+GENE_GRIDS = {"Gad1": os.path.join(DATA, "Gad1_coronal_adult_P56_479.zip"),
+              "Th": os.path.join(DATA, "Th_coronal_P56_1056.zip"),
+              "Adora2a": os.path.join(DATA, "Adora2a_P56_coronal_72109410_200um.zip")}
+ROOT_ID = 997
+
+
+def _record(idd, parent, depth):
+    return {"id": idd, "acronym": "s%i" % idd, "name": "s%i" % idd, "safe_name": "s%i" % idd,
+            "parent_structure_id": parent, "depth": depth, "color_hex_triplet": "%06X" % (idd * 2654435761 % 2**24)}
+
+
+def random_ontology(leaves, n_internal=12, seed=0):
+    """Structure records of a random tree: the root, n_internal groups and the leaves hanging from the groups
+    """
+    random_state = np.random.RandomState(seed)
+    records = [_record(ROOT_ID, None, 0)]
+    depth = {ROOT_ID: 0}
+    internal = [ROOT_ID]
+    for n in range(n_internal):
+        idd = 900000 + n
+        parent = internal[random_state.randint(len(internal))]
+        depth[idd] = depth[parent] + 1
+        records.append(_record(idd, parent, depth[idd]))
+        internal.append(idd)
+    for idd in leaves:
+        parent = internal[random_state.randint(len(internal))]
+        records.append(_record(int(idd), parent, depth[parent] + 1))
+    # the api does not return the structures sorted by depth
+    order = [0] + list(1 + random_state.permutation(len(records) - 1))
+    return [records[i] for i in order]
+
+
+@pytest.fixture(scope="session")
+def annotation():
+    return bm.AllenVolumetricData(GRID_ANNOTATION)
+
+
+@pytest.fixture(scope="session")
+def reference(annotation, tmp_path_factory):
+    """A random ontology over the labels of the P56 gridAnnotation, leaving out the background label 0
+    """
+    leaves = [i for i in annotation.ids if i not in (0, ROOT_ID)]
+    cache_dir = str(tmp_path_factory.mktemp("ontology"))
+    OntologyTable.from_records(random_ontology(leaves)).save(os.path.join(cache_dir, "ontology_adult.npz"))
+    return bm.AllenBrainReference(cache_dir=cache_dir)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import brainmap as bm
+from conftest import GENE_GRIDS
+
+
+def naive_statistics(values, label_ids, structure_ids, threshold=0.):
+    """Sum, count and fraction of each structure computed with one boolean mask per structure
+    """
+    valid = np.isfinite(values) & (values >= 0)
+    result = np.zeros((3, len(structure_ids)))
+    for n, ids in enumerate(structure_ids):
+        mask = np.isin(label_ids, ids) & valid
+        result[:, n] = values[mask].sum(), mask.sum(), (values[mask] > threshold).sum()
+    return result
+
+
+def test_flat_statistics(annotation):
+    raw = bm.AllenVolumetricData(GENE_GRIDS["Gad1"], remove_negative_entries=False)
+    statistics = bm.structure_statistics(raw, annotation, hierarchical=False, threshold=1.)
+    values, label_ids = raw[:, :, :], annotation.ids[annotation[:, :, :]]
+    expected = naive_statistics(values, label_ids, [[i] for i in annotation.ids], threshold=1.)
+    assert statistics["genes"] == [None]
+    assert np.array_equal(statistics["ids"], annotation.ids)
+    assert np.allclose(statistics["sum"][0], expected[0], rtol=1e-5)
+    assert np.array_equal(statistics["count"][0], expected[1])
+    with np.errstate(invalid="ignore"):
+        assert np.allclose(statistics["fraction"][0], expected[2] / expected[1], equal_nan=True)
+
+
+def test_hierarchical_statistics(annotation, reference):
+    raw = bm.AllenVolumetricData(GENE_GRIDS["Th"], remove_negative_entries=False)
+    statistics = bm.structure_statistics(raw, annotation, reference=reference)
+    assert np.array_equal(statistics["ids"], reference.table.ids)
+    values, label_ids = raw[:, :, :], annotation.ids[annotation[:, :, :]]
+    expected = naive_statistics(values, label_ids, [reference.descendants(i) for i in statistics["ids"]])
+    assert np.allclose(statistics["sum"][0], expected[0], rtol=1e-5)
+    assert np.array_equal(statistics["count"][0], expected[1])
+    assert np.array_equal(statistics["count"][0][statistics["ids"] == 997], [np.sum((values >= 0) & (label_ids != 0))])
+
+
+def test_no_data_is_excluded(annotation, tmp_path):
+    """Volumes loaded with the default replacement, raw volumes and a default store give the same statistics
+    """
+    loaded = {g: bm.AllenVolumetricData(f) for g, f in GENE_GRIDS.items()}
+    raw = {g: bm.AllenVolumetricData(f, remove_negative_entries=False) for g, f in GENE_GRIDS.items()}
+    store = bm.ExpressionStore.build(GENE_GRIDS, str(tmp_path / "store"))
+    results = [bm.structure_statistics(source, annotation, hierarchical=False, chunk_size=2)
+               for source in (loaded, raw, store)]
+    results.append(bm.structure_statistics(store, annotation, hierarchical=False, genes=sorted(GENE_GRIDS)))
+    order = [list(results[0]["genes"]).index(g) for g in sorted(GENE_GRIDS)]
+    for statistics in results[1:]:
+        rows = [list(statistics["genes"]).index(g) for g in sorted(GENE_GRIDS)]
+        for key in ("sum", "count", "mean", "fraction"):
+            assert np.allclose(statistics[key][rows], results[0][key][order], rtol=1e-5, equal_nan=True)
+    assert results[0]["count"].sum() < np.sum(annotation[:, :, :] >= 0) * len(GENE_GRIDS)
+
+
+def test_store_without_no_data(annotation, tmp_path):
+    store = bm.ExpressionStore.build(GENE_GRIDS, str(tmp_path / "store"), remove_negative_entries=True)
+    assert store.keeps_no_data is False
+    with pytest.raises(ValueError, match="remove_negative_entries"):
+        bm.structure_statistics(store, annotation, hierarchical=False)
@@ -0,0 +1,146 @@
+import os
+import json
+import shutil
+import threading
+import collections
+import http.server
+import pytest
+import brainmap as bm
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Section Data Set id -> bundled grid served by the stand-in grid data service
+GRIDS = {479: "Gad1_coronal_adult_P56_479.zip", 1056: "Th_coronal_P56_1056.zip"}
+NOT_A_ZIP = 5
+FLAKY = 1056
+
+
+class _GridHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # /moved/... and /loop/... redirect on the same server, /elsewhere/... on another one
+        if self.path.startswith("/moved/"):
+            return self._redirect(302, self.path[len("/moved"):])
+        if self.path.startswith("/loop/"):
+            return self._redirect(307, self.path)
+        if self.path.startswith("/elsewhere/"):
+            return self._redirect(301, self.server.elsewhere + self.path[len("/elsewhere"):])
+        idd = int(self.path.rsplit("/", 1)[-1])
+        self.server.requests[idd] += 1
+        if idd == FLAKY and self.server.requests[idd] == 1:
+            self._reply(503, b"try again")
+        elif idd == NOT_A_ZIP:
+            self._reply(200, b"<html>not a zip</html>")
+        elif idd in GRIDS:
+            with open(os.path.join(DATA, GRIDS[idd]), "rb") as f:
+                self._reply(200, f.read())
+        else:
+            self._reply(404, b"not found")
+
+    def _redirect(self, status, location):
+        self.server.redirects += 1
+        self.send_response(status)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _serve():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _GridHandler)
+    server.requests = collections.Counter()
+    server.redirects = 0
+    server.elsewhere = None
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    return server, "http://127.0.0.1:%i" % server.server_address[1]
+
+
+@pytest.fixture
+def endpoint():
+    server, url = _serve()
+    other, server.elsewhere = _serve()
+    yield server, url
+    for s in (server, other):
+        s.shutdown()
+        s.server_close()
+
+
+def test_download_many(endpoint, tmp_path):
+    server, url = endpoint
+    fetcher = bm.ISHFetcher()
+    ids = {"Gad1": 479, "Th": FLAKY, "Bad": NOT_A_ZIP, "Missing": 7}
+    results = fetcher.download_many(["Gad1", "Th", "Bad", "Missing", "Never"], folder=str(tmp_path), ids=ids,
+                                    endpoint=url, retries=2, backoff=0.01, n_workers=4)
+    assert results["Gad1"] == str(tmp_path / "Gad1_coronal_P56_479.zip")
+    assert results["Th"] == str(tmp_path / "Th_coronal_P56_1056.zip")
+    assert results["Bad"] is False and results["Missing"] is False and results["Never"] is False
+    # 503 is retried, 404 is not, an invalid zip is retried and then rejected
+    assert server.requests[FLAKY] == 2
+    assert server.requests[7] == 1
+    assert server.requests[NOT_A_ZIP] == 3
+    assert sorted(os.listdir(str(tmp_path))) == [".ish_manifest.json", "Gad1_coronal_P56_479.zip", "Th_coronal_P56_1056.zip"]
+    with open(os.path.join(DATA, GRIDS[479]), "rb") as a, open(results["Gad1"], "rb") as b:
+        assert a.read() == b.read()
+
+    # failed downloads are not recorded, so that they are tried again
+    with open(str(tmp_path / ".ish_manifest.json")) as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == ["Gad1|coronal|adult|P56", "Never|coronal|adult|P56", "Th|coronal|adult|P56"]
+    assert manifest["Never|coronal|adult|P56"]["file"] is None
+
+    server.requests.clear()
+    again = fetcher.download_many(["Gad1", "Th", "Never"], folder=str(tmp_path), ids={}, endpoint=url, backoff=0.01)
+    assert again == {k: results[k] for k in ("Gad1", "Th", "Never")}
+    assert sum(server.requests.values()) == 0
+
+    # a file removed after the run is downloaded again
+    os.remove(results["Gad1"])
+    fetcher.download_many(["Gad1"], folder=str(tmp_path), ids=ids, endpoint=url, backoff=0.01)
+    assert server.requests[479] == 1 and os.path.exists(results["Gad1"])
+    assert bm.ISHLoader(str(tmp_path)).index == {"Gad1": results["Gad1"], "Th": results["Th"]}
+
+
+def test_download_many_planes(endpoint, tmp_path):
+    """Other planes and ages of a gene already in the manifest are downloaded in the same folder
+    """
+    server, url = endpoint
+    fetcher = bm.ISHFetcher()
+    coronal = fetcher.download_many(["Gad1"], folder=str(tmp_path), ids={"Gad1": 479}, endpoint=url, backoff=0.01)
+    sagittal = fetcher.download_many(["Gad1"], folder=str(tmp_path), sag_or_cor="sagittal", ids={"Gad1": 1056},
+                                     endpoint=url, backoff=0.01)
+    development = fetcher.download_many(["Gad1"], folder=str(tmp_path), adu_or_dev="development", time_point="E15.5",
+                                        ids={"Gad1": 1056}, endpoint=url, backoff=0.01)
+    assert coronal["Gad1"] == str(tmp_path / "Gad1_coronal_P56_479.zip")
+    assert sagittal["Gad1"] == str(tmp_path / "Gad1_sagittal_P56_1056.zip")
+    assert development["Gad1"] == str(tmp_path / "Gad1_coronal_E15.5_1056.zip")
+    assert all(os.path.exists(r["Gad1"]) for r in (coronal, sagittal, development))
+    server.requests.clear()
+    again = fetcher.download_many(["Gad1"], folder=str(tmp_path), sag_or_cor="sagittal", ids={}, endpoint=url)
+    assert again == sagittal and sum(server.requests.values()) == 0
+
+
+def test_download_many_redirects(endpoint, tmp_path):
+    server, url = endpoint
+    fetcher = bm.ISHFetcher()
+    ids = {"Gad1": 479, "Th": 1056}
+    for name in ("moved", "elsewhere", "loop"):
+        (tmp_path / name).mkdir()
+    moved = fetcher.download_many(["Gad1"], folder=str(tmp_path / "moved"), ids=ids, endpoint=url + "/moved")
+    elsewhere = fetcher.download_many(["Th"], folder=str(tmp_path / "elsewhere"), ids=ids, endpoint=url + "/elsewhere",
+                                      backoff=0.01)
+    with open(os.path.join(DATA, GRIDS[479]), "rb") as a, open(moved["Gad1"], "rb") as b:
+        assert a.read() == b.read()
+    assert os.path.exists(elsewhere["Th"])
+    assert server.requests[479] == 1 and server.requests[1056] == 0
+    # a redirect loop is a permanent failure: it is not retried
+    server.redirects = 0
+    looping = fetcher.download_many(["Gad1"], folder=str(tmp_path / "loop"), ids=ids, endpoint=url + "/loop")
+    assert looping["Gad1"] is False and server.redirects == 6
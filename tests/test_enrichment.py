@@ -0,0 +1,38 @@
+import shutil
+import numpy as np
+import pytest
+import brainmap as bm
+from conftest import GENE_GRIDS
+
+
+def test_rank_enrichment(annotation, reference, tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    for path in GENE_GRIDS.values():
+        shutil.copy(path, str(root))
+    # the largest group of the random ontology
+    groups = [i for i in reference.table.ids if i >= 900000]
+    structure = max(groups, key=lambda i: reference.structure_mask(int(i), annotation).sum())
+    inside = reference.structure_mask(int(structure), annotation)
+    outside = (annotation.ids[annotation[:, :, :]] != 0) & ~inside
+
+    rankings = [bm.rank_enrichment(source, int(structure), annotation, reference=reference, chunk_size=2, n_workers=2)
+                for source in (bm.ISHLoader(str(root)), bm.ExpressionStore.build(str(root), str(tmp_path / "store")))]
+    for key in ("genes", "n_in", "n_out", "mean_in", "mean_out", "z"):
+        assert np.array_equal(rankings[0][key], rankings[1][key])
+    ranking = rankings[0]
+    assert np.all(np.diff(ranking["z"]) <= 0)
+    for n, gene in enumerate(ranking["genes"]):
+        values = bm.AllenVolumetricData(GENE_GRIDS[gene], remove_negative_entries=False)[:, :, :]
+        valid = values >= 0
+        assert ranking["n_in"][n] == np.sum(inside & valid) and ranking["n_out"][n] == np.sum(outside & valid)
+        assert np.isclose(ranking["mean_in"][n], values[inside & valid].mean())
+        assert np.isclose(ranking["mean_out"][n], values[outside & valid].mean())
+    # the no data voxels differ gene by gene
+    assert len(set(ranking["n_in"])) > 1
+
+
+def test_store_without_no_data(annotation, reference, tmp_path):
+    store = bm.ExpressionStore.build(GENE_GRIDS, str(tmp_path / "store"), remove_negative_entries=True)
+    with pytest.raises(ValueError, match="remove_negative_entries"):
+        bm.rank_enrichment(store, 997, annotation, reference=reference)
@@ -0,0 +1,117 @@
+import re
+import fnmatch
+import shutil
+import pytest
+import brainmap as bm
+from conftest import GENE_GRIDS
+
+# id, genes, plane, reference space, qc date
+EXPERIMENTS = [
+    (11, ["Gad1"], "coronal", "P56 Mouse", "2008-01-01"),
+    (12, ["Gad1"], "sagittal", "P56 Mouse", "2012-01-01"),
+    (13, ["Gad1"], "coronal", "P56 Mouse", "2010-06-01"),
+    (14, ["Gad1", "Gad2"], "coronal", "P56 Mouse", None),
+    (15, ["Gad1"], "coronal", "E15.5 DevMouse", "2011-01-01"),
+    (21, ["Th"], "sagittal", "P56 Mouse", "2009-01-01"),
+    (22, ["Th"], "sagittal", "P56 Mouse", "2009-05-01"),
+    (31, ["Adora2a"], "coronal", "P28 Mouse", "2013-01-01"),
+] + [(100 + n, ["G%i" % (n % 20)], ("coronal", "sagittal")[n % 2], "P56 Mouse", "2005-%02i-01" % (n % 12 + 1))
+     for n in range(45)]
+
+
+class FakeRma:
+    """Stands in for RmaApi.model_query, filtering EXPERIMENTS with the criteria and returning a page of them
+    """
+    def __init__(self):
+        self.calls = []
+
+    @staticmethod
+    def _in(criteria, field):
+        return re.search(r"%s\$in([^\]]*)\]" % re.escape(field), criteria).group(1).replace("'", "").split(",")
+
+    def model_query(self, model, criteria, include, count, start_row, num_rows, order):
+        assert model == "SectionDataSet" and include == "genes,plane_of_section" and order == ["'id'"]
+        self.calls.append((criteria, start_row, num_rows))
+        space_pattern = re.search(r"reference_space\[name\$li'([^']*)'\]", criteria).group(1)
+        product = re.search(r"products\[abbreviation\$li'([^']*)'\]", criteria).group(1)
+        genes, planes = self._in(criteria, "genes[acronym"), self._in(criteria, "plane_of_section[name")
+        rows = [{"id": idd, "qc_date": qc_date, "genes": [{"acronym": g} for g in gene_list],
+                 "plane_of_section": {"name": plane}}
+                for idd, gene_list, plane, space, qc_date in EXPERIMENTS
+                if fnmatch.fnmatchcase(space, space_pattern) and fnmatch.fnmatchcase(space.split()[1], product)
+                and plane in planes
+                and set(gene_list) & set(genes)]
+        return sorted(rows, key=lambda row: row["id"])[start_row:start_row + num_rows]
+
+
+def naive_find(genes, planes, time_points):
+    found = {gene: [] for gene in genes}
+    for time_point in time_points:
+        for idd, gene_list, plane, space, qc_date in EXPERIMENTS:
+            for gene in gene_list:
+                if gene in found and plane in planes and space == "%s Mouse" % time_point:
+                    found[gene].append({"id": idd, "qc_date": qc_date or '', "plane": plane, "time_point": time_point})
+    return {gene: sorted(e, key=lambda x: x["qc_date"], reverse=True) for gene, e in found.items()}
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = bm.ISHFetcher()
+    fetcher._rma = FakeRma()
+    return fetcher
+
+
+@pytest.mark.parametrize("page_size", [1, 4, 7, 2000])
+@pytest.mark.parametrize("genes_per_query", [1, 3, 200])
+def test_find_ids_batch(fetcher, page_size, genes_per_query):
+    genes = ["Gad1", "Gad2", "Th", "Adora2a", "Nope"] + ["G%i" % n for n in range(20)]
+    found = fetcher.find_ids_batch(genes, time_points=["P56", "P28"], genes_per_query=genes_per_query,
+                                   page_size=page_size)
+    assert found == naive_find(genes, ("coronal", "sagittal"), ["P56", "P28"])
+    # most recent first, no qc date last; 14 (Gad1 and Gad2) is listed once even when the genes are in different batches
+    assert [e["id"] for e in found["Gad1"]] == [12, 13, 11, 14]
+    assert found["Gad2"] == [{"id": 14, "qc_date": '', "plane": "coronal", "time_point": "P56"}]
+    assert found["Adora2a"][0]["time_point"] == "P28" and found["Nope"] == []
+    assert sum(len(e) for e in found.values()) == 8 + 45
+    # every query asks for full pages until a short one
+    queries = {}
+    for criteria, start_row, num_rows in fetcher.rma.calls:
+        assert num_rows == page_size and start_row == len(queries.get(criteria, ())) * page_size
+        queries.setdefault(criteria, []).append(start_row)
+    assert len(queries) == 2 * -(-len(genes) // genes_per_query)
+
+
+def test_find_ids_batch_planes(fetcher):
+    found = fetcher.find_ids_batch(["Gad1", "Th"], planes=["coronal"], adu_or_dev="both", time_points=["P56", "E15.5"],
+                                   page_size=2)
+    assert [(e["id"], e["time_point"]) for e in found["Gad1"]] == [(15, "E15.5"), (13, "P56"), (11, "P56"), (14, "P56")]
+    assert found["Th"] == []
+    with pytest.raises(ValueError):
+        fetcher.find_ids_batch(["Gad1"], time_points=["E15.5"])
+
+
+def test_resolve(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    root.mkdir()
+    shutil.copy(GENE_GRIDS["Adora2a"], str(root))
+    loader = bm.ISHLoader(str(root))
+    loader._fetcher._rma = FakeRma()
+    assert loader.resolve(["Gad1", "Th", "Adora2a", "Nope"]) == {"Gad1": ("coronal", 13), "Th": ("sagittal", 22),
+                                                                "Nope": None}
+    assert loader.resolve(["Gad1", "Th"]) == {} and len(loader._fetcher.rma.calls) == 1
+    loader.priority = ["sagittal", "coronal"]
+    assert loader.resolve(["Gad2"]) == {"Gad2": ("coronal", 14)}
+
+    # the resolved genes are downloaded without querying again
+    downloads = []
+
+    def download(idd, path):
+        downloads.append(idd)
+        shutil.copy(GENE_GRIDS["Gad1"], path)
+    monkeypatch.setattr(loader._fetcher, "_download_grid", download)
+    monkeypatch.setattr(loader._fetcher, "download_grid_recent", lambda *args, **kwargs: pytest.fail("queried"))
+    assert loader["Th"].shape == loader["Adora2a"].shape
+    assert downloads == [22] and loader.index["Th"] == str(root / "Th_sagittal_P56_22.zip")
+    with pytest.raises(KeyError):
+        loader["Nope"]
+    assert len(loader._fetcher.rma.calls) == 2
@@ -0,0 +1,128 @@
+import os
+import shutil
+import pytest
+import brainmap as bm
+from brainmap.ish import parse_grid_filename
+from conftest import DATA
+
+
+def touch(folder, *names):
+    for name in names:
+        shutil.copy(os.path.join(DATA, "Th_coronal_P56_1056.zip"), os.path.join(str(folder), name))
+
+
+def test_parse_grid_filename():
+    entry = parse_grid_filename("/a/Adora2a_P56_coronal_72109410_200um_intensity.zip")
+    assert entry == {"file": "Adora2a_P56_coronal_72109410_200um_intensity.zip", "gene": "Adora2a", "plane": "coronal",
+                     "time_point": "P56", "experiment_id": 72109410, "kind": "intensity"}
+    assert parse_grid_filename("Th_sagittal_E11pt5_7.zip")["kind"] == "energy"
+    assert parse_grid_filename("Th_E15.5_sagittal_7.zip")["time_point"] == "E15.5"
+    assert parse_grid_filename("Th.zip")["plane"] is None
+
+
+def test_grid_kinds(tmp_path):
+    """Energy grids are preferred over the other kinds of the same experiment, whatever the listing order
+    """
+    touch(tmp_path, "Adora2a_P56_coronal_7_200um_intensity.zip", "Adora2a_P56_coronal_7_200um.zip",
+          "Adora2a_P56_coronal_9_200um_density.zip", "Adora2a_P56_coronal_5_200um.zip")
+    index = bm.ISHIndex(str(tmp_path))
+    assert [e["file"] for e in index.experiments("Adora2a")] == [
+        "Adora2a_P56_coronal_7_200um.zip", "Adora2a_P56_coronal_5_200um.zip",
+        "Adora2a_P56_coronal_9_200um_density.zip", "Adora2a_P56_coronal_7_200um_intensity.zip"]
+    assert index.most_recent("Adora2a")["file"] == "Adora2a_P56_coronal_7_200um.zip"
+    assert index.select("coronal", "P56")["Adora2a"]["file"] == "Adora2a_P56_coronal_7_200um.zip"
+    assert bm.ISHLoader(str(tmp_path)).index["Adora2a"] == str(tmp_path / "Adora2a_P56_coronal_7_200um.zip")
+
+
+def age(folder, seconds=10):
+    """Moves the mtime of a folder in the past, as if it had been changed long before the next scan
+    """
+    past = os.stat(str(folder)).st_mtime_ns - seconds * 10**9
+    os.utime(str(folder), ns=(past, past))
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """The names parsed by ISHIndex
+    """
+    names = []
+
+    def parse(path):
+        names.append(os.path.basename(path))
+        return parse_grid_filename(path)
+    monkeypatch.setattr(bm.ish, "parse_grid_filename", parse)
+    return names
+
+
+def test_refresh(tmp_path, parsed, monkeypatch):
+    touch(tmp_path, "Th_coronal_P56_1.zip", "Th_sagittal_P56_2.zip", "Gad1_coronal_P56_3.zip", "notes.txt")
+    age(tmp_path)
+    index = bm.ISHIndex(str(tmp_path))
+    assert sorted(parsed) == ["Gad1_coronal_P56_3.zip", "Th_coronal_P56_1.zip", "Th_sagittal_P56_2.zip"]
+    assert len(index) == 3 and sorted(index.genes) == ["Gad1", "Th"]
+    # creating the index file changed the folder: listed once more, nothing parsed
+    age(tmp_path)
+    del parsed[:]
+    bm.ISHIndex(str(tmp_path))
+    assert parsed == []
+
+    # warm start: the folder is not listed
+    with monkeypatch.context() as m:
+        m.setattr(bm.ish.os, "scandir", lambda *args: pytest.fail("the folder was listed"))
+        warm = bm.ISHIndex(str(tmp_path))
+    assert parsed == [] and warm.entries == index.entries
+
+    # a file rewritten in place is parsed again without listing the folder
+    with open(str(tmp_path / "Th_coronal_P56_1.zip"), "ab") as f:
+        f.write(b"\0")
+    with monkeypatch.context() as m:
+        m.setattr(bm.ish.os, "scandir", lambda *args: pytest.fail("the folder was listed"))
+        rewritten = bm.ISHIndex(str(tmp_path))
+    assert parsed == ["Th_coronal_P56_1.zip"]
+    assert rewritten.entries["Th_coronal_P56_1.zip"]["size"] == os.stat(str(tmp_path / "Th_coronal_P56_1.zip")).st_size
+
+    # a file added or removed
+    del parsed[:]
+    touch(tmp_path, "Th_coronal_P56_9.zip")
+    os.remove(str(tmp_path / "Gad1_coronal_P56_3.zip"))
+    age(tmp_path)
+    changed = bm.ISHIndex(str(tmp_path))
+    assert parsed == ["Th_coronal_P56_9.zip"]
+    assert changed.genes == ["Th"] and changed.most_recent("Th")["experiment_id"] == 9
+    assert changed.refresh() == 0
+
+
+def test_racy_listing(tmp_path):
+    touch(tmp_path, "Th_coronal_P56_1.zip")
+    index = bm.ISHIndex(str(tmp_path))
+    # the folder changed less than racy_ns ago: a file added in the same mtime tick is still found
+    mtime = os.stat(str(tmp_path)).st_mtime_ns
+    touch(tmp_path, "Th_coronal_P56_2.zip")
+    os.utime(str(tmp_path), ns=(mtime, mtime))
+    assert index._racy and "Th_coronal_P56_2.zip" in bm.ISHIndex(str(tmp_path)).entries
+    assert index.refresh() == 1
+
+
+def test_add_and_lookups(tmp_path):
+    names = ["Th_coronal_P56_5.zip", "Th_coronal_P56_12.zip", "Th_sagittal_P56_7.zip", "Th_coronal_E15.5_20.zip",
+             "Th_coronal_P56_12_intensity.zip", "Th_coronal_P56.zip", "Gad1_coronal_P56_3.zip", "Gad1_coronal_P56_8.zip"]
+    touch(tmp_path, *names)
+    grouped = bm.ISHIndex(str(tmp_path), persist=False)
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    index = bm.ISHIndex(str(empty), persist=False)
+    for name in names:
+        index.add(str(tmp_path / name))
+    index.add(str(tmp_path / names[0]))  # replacing an entry
+    for attribute in ("_by_gene", "_by_experiment", "_by_plane_time"):
+        assert getattr(index, attribute) == getattr(grouped, attribute)
+
+    assert [e["file"] for e in index.experiments("Th")] == [
+        "Th_coronal_E15.5_20.zip", "Th_coronal_P56_12.zip", "Th_sagittal_P56_7.zip", "Th_coronal_P56_5.zip",
+        "Th_coronal_P56.zip", "Th_coronal_P56_12_intensity.zip"]
+    assert [e["experiment_id"] for e in index.experiments("Th", "coronal", "P56")] == [12, 5, None, 12]
+    assert [e["experiment_id"] for e in index.experiments("Th", plane="sagittal")] == [7]
+    assert [e["experiment_id"] for e in index.experiments("Th", time_point="E15.5")] == [20]
+    assert index.most_recent("Th", "sagittal")["experiment_id"] == 7 and index.most_recent("Th", "nope") is None
+    assert {g: e["experiment_id"] for g, e in index.select("coronal", "P56").items()} == {"Th": 12, "Gad1": 8}
+    assert index.experiments("Nope") == []
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from brainmap.labels import LabelIndex, encode_labels, unique_labels
+
+
+def random_labels(shape=(11, 9, 5), n_labels=12, seed=0):
+    """Labels in blobs along the first axis, with a few labels never used
+    """
+    random_state = np.random.RandomState(seed)
+    labels = random_state.randint(0, n_labels, shape)
+    labels[labels % 5 == 3] = 0
+    labels[:4][labels[:4] == 7] = 1  # label 7 only in the last rows
+    return labels.astype(np.uint8)
+
+
+def naive_bbox(labels, label):
+    coordinates = np.argwhere(labels == label)
+    if len(coordinates) == 0:
+        return None
+    return tuple(slice(int(a), int(b) + 1) for a, b in zip(coordinates.min(0), coordinates.max(0)))
+
+
+def check(index, labels, n_labels):
+    assert index.shape == labels.shape and index.n_labels == n_labels
+    assert np.array_equal(index.counts, np.bincount(labels.ravel(), minlength=n_labels))
+    for label in range(n_labels):
+        assert np.array_equal(index.voxels(label), np.flatnonzero(labels == label))
+        assert all(np.array_equal(a, b) for a, b in zip(index.coordinates(label), np.nonzero(labels == label)))
+        assert index.bbox(label) == naive_bbox(labels, label)
+        box = naive_bbox(labels, label)
+        if box is None:
+            assert (index.bbox_min[label] > index.bbox_max[label]).all()
+        else:
+            assert [s.start for s in box] == list(index.bbox_min[label])
+            assert [s.stop - 1 for s in box] == list(index.bbox_max[label])
+    present = np.flatnonzero(index.counts)
+    union = naive_bbox(np.isin(labels, present[:3]), True)
+    assert index.bbox(list(present[:3]) + [n_labels - 1]) == union
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 2**22])
+def test_label_index(chunk_size):
+    labels = random_labels()
+    n_labels = 15  # more than the labels in the volume
+    index = LabelIndex(labels, n_labels=n_labels, chunk_size=chunk_size)
+    assert index.counts[[3, 8, 13, 14]].sum() == 0 and index.bbox([3, 8]) is None
+    assert index.bbox(7)[0].start >= 4
+    check(index, labels, n_labels)
+    assert np.array_equal(index.flat, np.argsort(labels.ravel(), kind="stable"))
+
+
+@pytest.mark.parametrize("computed", [False, True])
+def test_save_load(tmp_path, computed):
+    labels = random_labels(seed=1)
+    index = LabelIndex(labels, chunk_size=50)
+    if computed:
+        index.flat
+    path = str(tmp_path / "labels.npz")
+    index.save(path)
+    index.save(path)
+    loaded = LabelIndex.load(path, labels)
+    assert (loaded._flat is not None) == computed
+    check(loaded, labels, index.n_labels)
+    assert [p.name for p in tmp_path.iterdir()] == ["labels.npz"]
+
+
+def test_annotation(annotation):
+    labels = annotation[:, :, :]
+    index = annotation.label_index
+    assert index.n_labels == len(annotation.ids)
+    for label in np.random.RandomState(0).choice(index.n_labels, 10, replace=False):
+        assert np.array_equal(index.voxels(label), np.flatnonzero(labels == label))
+        assert index.bbox(label) == naive_bbox(labels, label)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 13, 2**22])
+def test_encode_labels(chunk_size):
+    raw = np.random.RandomState(2).choice([0, 5, 997, 70000, 2**31 + 3], 200).astype(np.int64)
+    ids, inverse = encode_labels(raw, chunk_size=chunk_size)
+    expected_ids, expected_inverse = np.unique(raw, return_inverse=True)
+    assert np.array_equal(ids, expected_ids) and np.array_equal(inverse, expected_inverse)
+    assert inverse.dtype == np.uint8
+    assert np.array_equal(unique_labels(raw, chunk_size), expected_ids)
+    assert len(unique_labels(raw[:0], chunk_size)) == 0
+
+    wide = np.arange(300)[::-1].repeat(2)
+    ids, inverse = encode_labels(wide, chunk_size=chunk_size)
+    assert inverse.dtype == np.uint16 and np.array_equal(ids[inverse], wide)
+    out = np.zeros(len(wide), dtype=np.uint32)
+    assert encode_labels(wide, out=out, ids=ids, chunk_size=chunk_size)[1] is out
+    assert np.array_equal(out, inverse)
@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import brainmap as bm
+from brainmap.ontology import OntologyTable
+from conftest import ROOT_ID, random_ontology
+
+
+def ancestors(records, idd):
+    """The ids of a structure and all its ancestors, walking the parent ids
+    """
+    parent_of = {r["id"]: r["parent_structure_id"] for r in records}
+    found = []
+    while idd is not None:
+        found.append(idd)
+        idd = parent_of[idd]
+    return found
+
+
+@pytest.fixture
+def records():
+    return random_ontology(range(1, 200), n_internal=30, seed=1)
+
+
+def test_table(records):
+    table = OntologyTable.from_records(records)
+    ids = [r["id"] for r in records]
+    for n, idd in enumerate(ids):
+        children = sorted(r["id"] for r in records if r["parent_structure_id"] == idd)
+        assert sorted(table.ids[table.children(n)]) == children
+        descendants = sorted(i for i in ids if idd in ancestors(records, i))
+        assert sorted(table.ids[table.descendants(n)]) == descendants
+        assert np.array_equal(table.is_descendant(np.arange(len(ids)), n), np.isin(table.ids, descendants))
+    values = np.random.RandomState(0).rand(2, len(ids))
+    expected = np.stack([values[:, table.descendants(n)].sum(1) for n in range(len(ids))], 1)
+    assert np.allclose(table.subtree_sum(values), expected)
+
+
+def test_reference(records, tmp_path):
+    OntologyTable.from_records(records).save(str(tmp_path / "ontology_adult.npz"))
+    reference = bm.AllenBrainReference(cache_dir=str(tmp_path))
+    assert len(reference) == len(records)
+    assert reference.parent_of(ROOT_ID) is None
+    leaf = records[-1]
+    assert reference.parent_of(leaf["id"]).id == leaf["parent_structure_id"]
+    assert reference[leaf["id"]].parent.id == leaf["parent_structure_id"]
+    ids = np.array([leaf["id"], ROOT_ID, 123456789])
+    assert list(reference.is_descendant(ids, ROOT_ID)) == [True, True, False]
+    assert list(reference.is_descendant(ROOT_ID, ids)) == [False, True, False]
+    for method in (reference.parent_of, reference.children_of, reference.descendants, reference.__getitem__):
+        with pytest.raises(KeyError):
+            method(123456789)
+
+
+def test_structure_mask(annotation, reference):
+    label_ids = annotation.ids[annotation[:, :, :]]
+    for idd in list(reference.table.ids[:20]) + [ROOT_ID]:
+        mask = reference.structure_mask(int(idd), annotation)
+        assert np.array_equal(mask, np.isin(label_ids, reference.descendants(int(idd))))
+    assert not reference.structure_mask(ROOT_ID, annotation)[label_ids == 0].any()
+    with pytest.raises(KeyError):
+        reference.structure_mask(123456789, annotation)
+
+
+def test_concurrent_save(records, tmp_path):
+    table = OntologyTable.from_records(records)
+    path = str(tmp_path / "ontology_adult.npz")
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: table.save(path), range(16)))
+    assert os.listdir(str(tmp_path)) == ["ontology_adult.npz"]
+    loaded = OntologyTable.load(path)
+    assert np.array_equal(loaded.ids, table.ids) and np.array_equal(loaded.parent, table.parent)
+    assert loaded.records == records
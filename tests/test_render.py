@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import brainmap as bm
+from conftest import GENE_GRIDS, GRID_ANNOTATION
+
+
+def test_label_slices(reference):
+    labels = bm.AllenVolumetricData(GRID_ANNOTATION)
+    middle = labels.shape[0] // 2
+    # without a reference the label indexes are shown in gray
+    assert not labels.renderer.colored
+    assert np.array_equal(labels.renderer[0, middle], labels[middle, :, :])
+    assert np.array_equal(labels.renderer[2, 10], labels[:, :, 10].T)
+    labels.reference = reference
+    assert labels.renderer.colored
+    rgb = labels.renderer[0, middle]
+    assert rgb.shape == labels[middle, :, :].shape + (3,) and rgb.dtype == np.uint8
+    assert np.array_equal(rgb, labels.color_lut[labels[middle, :, :]]) and rgb.max() > 0
+
+
+def test_grid_slices():
+    grid = bm.AllenVolumetricData(GENE_GRIDS["Gad1"])
+    assert not grid.renderer.colored
+    assert np.array_equal(grid.renderer[0, 30], grid[30, :, :])
+
+
+def test_viewer(reference):
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from brainmap.render import SlideViewer
+    labels = bm.AllenVolumetricData(GRID_ANNOTATION)
+    viewer = SlideViewer(labels.renderer)
+    viewer.update(20, 10)
+    assert viewer.images[0].get_cmap().name == "gray"
+    assert viewer.images[0].get_clim() == (0, labels[:, :, :].max())
+    plt.close(viewer.fig)
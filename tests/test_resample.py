@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from brainmap.resample import mode_downsample, nearest_upsample, voxel_map, zoom_labels
+
+
+def naive_mode(labels, factors):
+    out_shape = [-(-n // f) for n, f in zip(labels.shape, factors)]
+    result = np.empty(out_shape, dtype=labels.dtype)
+    for index in np.ndindex(*out_shape):
+        block = labels[tuple(slice(i * f, (i + 1) * f) for i, f in zip(index, factors))]
+        counts = np.bincount(block.ravel())
+        result[index] = np.argmax(counts)  # the first maximum: ties go to the smallest label
+    return result
+
+
+@pytest.mark.parametrize("factors", [2, 3, (2, 1, 4)])
+@pytest.mark.parametrize("max_chunk_bytes", [2**26, 64])
+def test_mode_downsample(factors, max_chunk_bytes):
+    labels = np.random.RandomState(0).randint(0, 5, (13, 8, 10)).astype(np.uint8)
+    result = mode_downsample(labels, factors, max_chunk_bytes=max_chunk_bytes)
+    assert result.dtype == labels.dtype
+    assert np.array_equal(result, naive_mode(labels, np.broadcast_to(factors, (3,))))
+
+
+def test_mode_downsample_ties():
+    labels = np.zeros((2, 2, 2), dtype=np.uint16)
+    labels[0] = 7
+    labels[1] = 3
+    assert mode_downsample(labels, 2).tolist() == [[[3]]]
+
+
+def test_zoom_labels():
+    labels = np.random.RandomState(1).randint(0, 300, (6, 9, 4)).astype(np.uint16)
+    up = zoom_labels(labels, 2)
+    assert np.array_equal(up, nearest_upsample(labels, 2))
+    assert np.array_equal(zoom_labels(up, 0.5), labels)
+
+
+def test_voxel_map():
+    src = ((10, 10, 10), (200., 200., 200.), (0., 0., 0.))
+    dst = ((25, 20, 5), (100., 100., 400.), (-100., 0., 0.))
+    maps = voxel_map(src, dst)
+    assert maps[0][0] == -1 and maps[0][1] == 0 and maps[0][2] == 0 and maps[0][-1] == -1
+    assert np.array_equal(maps[1], np.arange(20) // 2)
+    assert np.array_equal(maps[2], np.arange(5) * 2 + 1)
@@ -0,0 +1,72 @@
+import os
+import stat
+import shutil
+import numpy as np
+import pytest
+import brainmap as bm
+from conftest import GENE_GRIDS
+
+
+@pytest.fixture
+def loader(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    for path in GENE_GRIDS.values():
+        shutil.copy(path, str(root))
+    return bm.ISHLoader(str(root))
+
+
+@pytest.mark.parametrize("method", [None, "random"])
+def test_query(loader, tmp_path, method):
+    index = bm.SimilarityIndex.build(loader, str(tmp_path / "index"), method=method, dim=256)
+    for gene in GENE_GRIDS:
+        # a loaded volume is masked like the indexed ones
+        assert np.isclose(index.embed(loader[gene]).dot(index.vectors[index._gene_ix[gene]]), 1, atol=1e-5)
+        hits = index.query(gene, k=2)
+        assert len(hits) == 2 and gene not in [g for g, _ in hits]
+        assert hits == index.query(loader[gene], k=3)[1:]
+    if method is None:
+        a, b = loader["Gad1"].masked().ravel(), loader["Th"].masked().ravel()
+        valid = np.isfinite(a) & np.isfinite(b)
+        similarity = dict(index.query("Gad1", k=5))["Th"]
+        assert np.isclose(similarity, np.corrcoef(a[valid], b[valid])[0, 1], atol=0.05)
+
+
+def test_add(loader, tmp_path):
+    index = bm.SimilarityIndex.build(loader, str(tmp_path / "index"), dim=256)
+    index.add("Copy", loader["Th"])
+    assert index.query("Copy", k=1)[0][0] == "Th"
+    assert np.isclose(index.query("Copy", k=1)[0][1], 1, atol=1e-5)
+    reopened = bm.SimilarityIndex(str(tmp_path / "index"))
+    assert reopened.genes == index.genes and np.array_equal(reopened.vectors, index.vectors)
+
+
+def test_store_source(loader, tmp_path):
+    store = bm.ExpressionStore.build(loader, str(tmp_path / "store"))
+    from_store = bm.SimilarityIndex.build(store, str(tmp_path / "a"), dim=256)
+    from_loader = bm.SimilarityIndex.build(loader, str(tmp_path / "b"), dim=256)
+    assert np.allclose(from_store.vectors, from_loader.vectors, atol=1e-5)
+
+
+def test_read_only(loader, tmp_path):
+    path = str(tmp_path / "index")
+    bm.SimilarityIndex.build(loader, path, dim=256)
+    for name in os.listdir(path):
+        os.chmod(os.path.join(path, name), stat.S_IRUSR)
+    try:
+        index = bm.SimilarityIndex(path)
+        assert not index.vectors.flags.writeable
+        assert index.query("Th", k=1)[0][0] in GENE_GRIDS
+    finally:
+        for name in os.listdir(path):
+            os.chmod(os.path.join(path, name), stat.S_IRUSR | stat.S_IWUSR)
+
+
+def test_replace(loader, tmp_path):
+    index = bm.SimilarityIndex.build(loader, str(tmp_path / "index"), dim=256)
+    before = np.array(index.vectors)
+    index.add("Gad1", loader["Th"])
+    row = index._gene_ix["Gad1"]
+    assert len(index) == len(GENE_GRIDS) and np.allclose(index.vectors[row], index.embed(loader["Th"]))
+    assert np.array_equal(np.delete(index.vectors, row, 0), np.delete(before, row, 0))
+    assert np.array_equal(bm.SimilarityIndex(str(tmp_path / "index")).vectors, index.vectors)
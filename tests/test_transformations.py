@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from brainmap.transformations import (resample_volume, resample_volumes, rotation_x_M, rotation_z_M, scale_M,
+                                      translation_M)
+
+
+@pytest.fixture
+def volumes():
+    return np.random.RandomState(0).rand(3, 11, 9, 7)
+
+
+def affine():
+    """A transform that rotates and stretches the volume so that part of the output maps outside of it
+    """
+    return translation_M([1.3, -0.7, 0.4]).dot(rotation_z_M(0.3)).dot(rotation_x_M(-0.2)).dot(scale_M([1.2, 0.9, 1.1]))
+
+
+def sources(M, output_shape):
+    """Input coordinates of every output voxel, (3,) + output_shape
+    """
+    grid = np.indices(output_shape).reshape(3, -1)
+    Minv = np.linalg.inv(M)
+    return (Minv[:3, :3].dot(grid) + Minv[:3, 3:]).reshape((3,) + tuple(output_shape))
+
+
+@pytest.mark.parametrize("order", [0, 1])
+@pytest.mark.parametrize("chunk_rows", [1, 3, 8, 64])
+def test_resample_volume(volumes, order, chunk_rows):
+    ndimage = pytest.importorskip("scipy.ndimage")
+    M, output_shape = affine(), (12, 8, 9)
+    warped = resample_volume(volumes[0], M, output_shape, order=order, cval=-1, chunk_rows=chunk_rows)
+    Minv = np.linalg.inv(M)
+    expected = ndimage.affine_transform(volumes[0], Minv[:3, :3], Minv[:3, 3], output_shape, order=order, cval=-1)
+    # the two agree wherever the source is within the grid, they differ only on the edge convention
+    coords = sources(M, output_shape)
+    inside = np.all([(c >= 0) & (c <= n - 1) for c, n in zip(coords, volumes.shape[1:])], 0)
+    assert inside.sum() > warped.size // 4
+    assert np.allclose(warped[inside], expected[inside])
+    if order == 0:
+        rounded = np.rint(coords)
+        in_grid = np.all([(c >= 0) & (c < n) for c, n in zip(rounded, volumes.shape[1:])], 0)
+    else:
+        in_grid = np.all([(c >= 0) & (c < n) for c, n in zip(coords, volumes.shape[1:])], 0)
+    assert np.array_equal(warped != -1, in_grid)
+
+
+def test_edges():
+    volume = np.arange(4.)[:, None, None] * np.ones((1, 2, 2))
+    # a half voxel shift: the output samples at -0.5, 0.5, ... 3.5
+    shifted = resample_volume(volume, translation_M([0.5, 0, 0]), (5, 2, 2), order=1, cval=-1)
+    assert np.allclose(shifted[:, 0, 0], [-1, 0.5, 1.5, 2.5, 3])
+    nearest = resample_volume(volume, translation_M([0.4, 0, 0]), (5, 2, 2), order=0, cval=-1)
+    assert np.allclose(nearest[:, 0, 0], [0, 1, 2, 3, -1])
+
+
+@pytest.mark.parametrize("order", [0, 1])
+def test_resample_volumes(volumes, order):
+    M = affine()
+    labels = (volumes * 10).astype(np.uint16) if order == 0 else volumes
+    batch = resample_volumes(labels, M, order=order, chunk_rows=4, n_threads=3)
+    assert batch.shape == labels.shape
+    assert batch.dtype == (np.uint16 if order == 0 else np.float64)
+    for volume, warped in zip(labels, batch):
+        assert np.array_equal(warped, resample_volume(volume, M, order=order, chunk_rows=5))
+    assert np.array_equal(resample_volumes(list(labels), M, order=order), batch)
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from brainmap.utils import LRUCache
+
+
+def array(nbytes):
+    return np.zeros(nbytes, dtype=np.uint8)
+
+
+def test_lru_order():
+    cache = LRUCache(max_items=3)
+    for key in "abc":
+        cache[key] = array(1)
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    assert "b" in cache  # membership does not refresh an entry
+    cache["d"] = array(1)
+    assert list(cache._data) == ["c", "a", "d"] and "b" not in cache
+    cache["e"] = array(1)
+    assert list(cache._data) == ["a", "d", "e"]
+    assert len(cache) == 3 and cache.evictions == 2
+
+
+def test_byte_budget():
+    cache = LRUCache(max_bytes=100)
+    cache["a"] = array(40)
+    cache["b"] = (array(30), array(20))  # tuples count the bytes of all their items
+    assert cache.nbytes == 90 and cache.evictions == 0
+    cache["c"] = array(30)
+    assert list(cache._data) == ["b", "c"] and cache.nbytes == 80
+    cache["d"] = array(90)
+    assert list(cache._data) == ["d"] and cache.nbytes == 90
+    # a value larger than the budget is not kept
+    cache["e"] = array(101)
+    assert len(cache) == 0 and cache.nbytes == 0 and cache.evictions == 5
+
+
+def test_replace():
+    cache = LRUCache(max_bytes=100, max_items=3)
+    cache["a"] = array(40)
+    cache["b"] = array(10)
+    cache["a"] = array(60)  # replacing does not evict the old value of the same key
+    assert cache.nbytes == 70 and cache.evictions == 0 and len(cache["a"]) == 60
+    assert list(cache._data) == ["b", "a"]
+    cache["b"] = array(50)  # now too big together: "a" is the least recently used
+    assert list(cache._data) == ["b"] and cache.nbytes == 50 and cache.evictions == 1
+    assert cache.pop("b").nbytes == 50 and cache.nbytes == 0
+    assert cache.pop("b", None) is None
+    with pytest.raises(KeyError):
+        cache.pop("b")
+
+
+def test_stats():
+    cache = LRUCache(max_items=2)
+    assert cache.stats()["hit_rate"] is None
+    cache["a"] = array(8)
+    cache.get("a")
+    cache["a"]
+    assert cache.get("x", 5) == 5
+    with pytest.raises(KeyError):
+        cache["x"]
+    "x" in cache
+    cache["b"] = array(8)
+    cache["c"] = array(8)
+    assert cache.stats() == {"items": 2, "nbytes": 16, "max_bytes": None, "max_items": 2,
+                             "hits": 2, "misses": 2, "evictions": 1, "hit_rate": 0.5}
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0 and cache.stats()["hits"] == 2
+
+
+def test_threads():
+    cache = LRUCache(max_bytes=1000, max_items=50)
+
+    def work(n):
+        cache[n % 70] = array(n % 30)
+        cache.get((n * 7) % 70)
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(work, range(5000)))
+    assert cache.nbytes == sum(v.nbytes for v in cache._data.values()) <= 1000
+    assert len(cache) <= 50 and set(cache._sizes) == set(cache._data)
+    assert cache.hits + cache.misses == 5000
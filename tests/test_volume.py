@@ -0,0 +1,65 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import brainmap as bm
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+GRID = os.path.join(DATA, "Gad1_coronal_adult_P56_479.zip")
+ANNOTATION = os.path.join(DATA, "AllenBrain3d", "E11pt5_DevMouse2012_annotation.zip")
+
+
+def naive_decode(path):
+    """The volume stored in a zip, read in one go with numpy
+    """
+    with zipfile.ZipFile(path) as z:
+        names = z.namelist()
+        header = z.read([n for n in names if n.endswith(".mhd")][0]).decode("ascii")
+        info = dict(line.split(" = ") for line in header.rstrip().split("\n"))
+        dtype = {"MET_UINT": "uint32", "MET_UCHAR": "uint8", "MET_FLOAT": "float32"}[info["ElementType"]]
+        shape = tuple(int(i) for i in info["DimSize"].split(" "))
+        raw = np.frombuffer(z.read([n for n in names if n.endswith(".raw")][0]), dtype=dtype)
+    return raw.reshape(shape, order="F")
+
+
+@pytest.mark.parametrize("remove_negative_entries", [True, False])
+def test_grid_decode(remove_negative_entries, tmp_path):
+    expected = naive_decode(GRID)
+    no_data = expected < 0
+    assert no_data.any()
+    if remove_negative_entries:
+        expected = np.where(no_data, expected[~no_data].min(), expected)
+    for cache_dir in (None, str(tmp_path), str(tmp_path)):  # decode, extract the sidecar, memory-map it
+        vol = bm.AllenVolumetricData(GRID, remove_negative_entries=remove_negative_entries, cache_dir=cache_dir)
+        assert vol.shape == expected.shape
+        assert np.array_equal(vol[:, :, :], expected)
+        assert np.array_equal(vol.no_data, no_data)
+        masked = vol.masked()
+        assert np.isnan(masked[no_data]).all() and np.array_equal(masked[~no_data], expected[~no_data])
+
+
+def test_label_decode(tmp_path):
+    expected = naive_decode(ANNOTATION)
+    for cache_dir in (None, str(tmp_path), str(tmp_path)):
+        vol = bm.AllenVolumetricData(ANNOTATION, cache_dir=cache_dir)
+        assert np.array_equal(vol.ids, np.unique(expected))
+        assert vol[:, :, :].dtype == np.min_scalar_type(len(vol.ids) - 1)
+        assert np.array_equal(vol.ids[vol[:, :, :]], expected)
+        assert vol.no_data is None
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
+
+
+def test_sidecar_key(tmp_path):
+    bm.AllenVolumetricData(GRID, cache_dir=str(tmp_path))
+    bm.AllenVolumetricData(GRID, remove_negative_entries=False, cache_dir=str(tmp_path))
+    assert len([name for name in os.listdir(str(tmp_path)) if name.endswith(".json")]) == 2
+
+
+def test_concurrent_extraction(tmp_path):
+    expected = naive_decode(ANNOTATION)
+    with ThreadPoolExecutor(4) as executor:
+        volumes = list(executor.map(lambda _: bm.AllenVolumetricData(ANNOTATION, cache_dir=str(tmp_path)), range(4)))
+    for vol in volumes:
+        assert np.array_equal(vol.ids[vol[:, :, :]], expected)
+    assert len(os.listdir(str(tmp_path))) == 3